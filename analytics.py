@@ -0,0 +1,248 @@
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from database import db
+from cache import normalize_query
+from models import RollupState, SearchQuery, SearchQueryRollup, hash_query
+
+logger = logging.getLogger(__name__)
+
+LAST_ROLLED_ID = 'search_query.last_rolled_id'
+
+# Rows younger than this may belong to transactions that have not
+# committed yet, so the rollup job leaves them for its next run.
+ROLLUP_GRACE = timedelta(minutes=5)
+
+# top_queries() counts at most this many raw rows the rollups lack
+MAX_RAW_ROWS = 5000
+
+
+def bucket_start(timestamp):
+    """Start of the hourly rollup bucket containing timestamp."""
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def db_now():
+    """Current time on the database clock, which stamps SearchQuery rows."""
+    now = db.session.query(db.func.now()).scalar()
+    if isinstance(now, str):  # SQLite returns CURRENT_TIMESTAMP as text
+        now = datetime.fromisoformat(now)
+    return now.replace(tzinfo=None)
+
+
+def upgrade_search_query_schema():
+    """Add the query_hash column and indexes to a pre-existing table.
+
+    db.create_all() creates missing tables but never alters existing
+    ones. Existing rows keep a NULL hash; the rollup job hashes them
+    itself.
+    """
+    inspector = db.inspect(db.engine)
+    table = SearchQuery.__table__
+    columns = {column['name'] for column in inspector.get_columns(table.name)}
+    with db.engine.begin() as connection:
+        if 'query_hash' not in columns:
+            logger.info("Adding search_query.query_hash column")
+            connection.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN query_hash BIGINT"))
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+
+
+def _last_rolled_id():
+    state = db.session.get(RollupState, LAST_ROLLED_ID)
+    if state is None:
+        state = RollupState(name=LAST_ROLLED_ID, value=0)
+        db.session.add(state)
+    return state
+
+
+def _add_rollup_counts(counts, names, chunk_size=1000):
+    """Add {(query_hash, bucket_start): n} onto the rollup table."""
+    rows = [{'query_hash': query_hash, 'bucket_start': bucket, 'query': names[query_hash],
+             'count': count}
+            for (query_hash, bucket), count in counts.items()]
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        for i in range(0, len(rows), chunk_size):
+            stmt = insert(SearchQueryRollup).values(rows[i:i + chunk_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['query_hash', 'bucket_start'],
+                set_={'count': SearchQueryRollup.count + stmt.excluded['count']})
+            db.session.execute(stmt)
+        return
+    for row in rows:
+        existing = (db.session.query(SearchQueryRollup)
+                    .filter_by(query_hash=row['query_hash'], bucket_start=row['bucket_start'])
+                    .first())
+        if existing is None:
+            db.session.add(SearchQueryRollup(**row))
+        else:
+            existing.count += row['count']
+
+
+def roll_up_search_queries(batch_size=10000):
+    """Fold SearchQuery rows added since the last run into hourly rollups.
+
+    Progress is tracked by id in RollupState, so each row is counted
+    exactly once and a run only reads rows it has not seen before. Each
+    batch commits its counts together with the new id, and only if the id
+    is still the one it started from; when another worker rolled the same
+    rows up first, the batch is rolled back and this run stops.
+    Returns the number of rows rolled up.
+    """
+    last_id = _last_rolled_id().value
+    try:
+        db.session.commit()  # the state row must exist for the updates below
+    except IntegrityError:  # another worker created it first
+        db.session.rollback()
+        return 0
+    cutoff = db_now() - ROLLUP_GRACE
+    # Stop before the first row that is still inside the grace period
+    stop_id = (db.session.query(db.func.min(SearchQuery.id))
+               .filter(SearchQuery.id > last_id, SearchQuery.timestamp >= cutoff)
+               .scalar())
+    total = 0
+    while True:
+        rows_query = (db.session.query(SearchQuery.id, SearchQuery.query,
+                                       SearchQuery.query_hash, SearchQuery.timestamp)
+                      .filter(SearchQuery.id > last_id))
+        if stop_id is not None:
+            rows_query = rows_query.filter(SearchQuery.id < stop_id)
+        rows = rows_query.order_by(SearchQuery.id).limit(batch_size).all()
+        if not rows:
+            break
+        counts = Counter()
+        names = {}
+        for _, query, query_hash, timestamp in rows:
+            if query_hash is None:
+                query_hash = hash_query(query)
+            counts[(query_hash, bucket_start(timestamp))] += 1
+            names.setdefault(query_hash, normalize_query(query)[:500])
+        _add_rollup_counts(counts, names)
+        claimed = (db.session.query(RollupState)
+                   .filter(RollupState.name == LAST_ROLLED_ID, RollupState.value == last_id)
+                   .update({'value': rows[-1][0]}, synchronize_session=False))
+        if not claimed:
+            db.session.rollback()
+            logger.info("Search queries were rolled up by another worker meanwhile")
+            break
+        db.session.commit()
+        last_id = rows[-1][0]
+        total += len(rows)
+    db.session.commit()
+    if total:
+        logger.info(f"Rolled up {total} search queries")
+    return total
+
+
+def run_rollups(app, interval, batch_size=10000):
+    """Call roll_up_search_queries() in app's context every interval seconds.
+
+    Runs forever, so give it a thread of its own. Every worker may run
+    one; they take turns through the checks in roll_up_search_queries.
+    """
+    while True:
+        time.sleep(interval)
+        try:
+            with app.app_context():
+                roll_up_search_queries(batch_size=batch_size)
+        except Exception as e:
+            logger.warning(f"Failed to roll up search queries: {e}")
+
+
+def compact_search_queries(retention=timedelta(days=30), batch_size=10000):
+    """Roll up new rows, then delete raw rows older than retention.
+
+    Only rows that are already part of the rollups are deleted. Returns
+    the number of raw rows removed.
+    """
+    roll_up_search_queries(batch_size=batch_size)
+    last_rolled = _last_rolled_id().value
+    cutoff = db_now() - retention
+    deleted = 0
+    while True:
+        ids = [row[0] for row in
+               db.session.query(SearchQuery.id)
+               .filter(SearchQuery.id <= last_rolled, SearchQuery.timestamp < cutoff)
+               .order_by(SearchQuery.id)
+               .limit(batch_size)
+               .all()]
+        if not ids:
+            break
+        db.session.query(SearchQuery).filter(SearchQuery.id.in_(ids)).delete(
+            synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+    logger.info(f"Deleted {deleted} raw search queries older than {cutoff}")
+    return deleted
+
+
+def top_queries(start, end=None, limit=10, last_seen=False):
+    """Most searched queries between start and end, most popular first.
+
+    Counts come from the rollups, whose buckets are whole hours, plus the
+    raw rows the rollup job has not reached yet, so recent searches are
+    included without scanning the raw table. Past MAX_RAW_ROWS of those,
+    older ones are left out until the rollups catch up. With last_seen
+    each entry also has the time of its latest search ('last_seen'),
+    to the hour for searches that were rolled up.
+    """
+    if end is None:
+        end = db_now()
+    last_rolled = _last_rolled_id().value
+    db.session.rollback()  # _last_rolled_id may have added an unsaved row
+
+    # Raw rows not rolled up yet: a few minutes' worth while run_rollups
+    # keeps up, and only the newest MAX_RAW_ROWS when it has fallen behind
+    raw = Counter()
+    names = {}
+    latest = {}
+    for query, query_hash, timestamp in (
+            db.session.query(SearchQuery.query, SearchQuery.query_hash, SearchQuery.timestamp)
+            .filter(SearchQuery.id > last_rolled,
+                    SearchQuery.timestamp >= start, SearchQuery.timestamp < end)
+            .order_by(SearchQuery.id.desc())
+            .limit(MAX_RAW_ROWS)):
+        query_hash = query_hash if query_hash is not None else hash_query(query)
+        raw[query_hash] += 1
+        names.setdefault(query_hash, normalize_query(query))
+        latest[query_hash] = max(latest.get(query_hash, timestamp), timestamp)
+
+    # Any query that can reach the top N is either in the rollup top
+    # (N + number of raw queries) or has raw hits, so fetch both.
+    total = db.func.sum(SearchQueryRollup.count)
+    rollup_query = (db.session.query(SearchQueryRollup.query_hash,
+                                     db.func.max(SearchQueryRollup.query), total,
+                                     db.func.max(SearchQueryRollup.bucket_start))
+                    .filter(SearchQueryRollup.bucket_start >= bucket_start(start),
+                            SearchQueryRollup.bucket_start < end)
+                    .group_by(SearchQueryRollup.query_hash))
+    rows = rollup_query.order_by(total.desc()).limit(limit + len(raw)).all()
+    if raw:
+        rows += rollup_query.filter(SearchQueryRollup.query_hash.in_(list(raw))).all()
+
+    counts = Counter(raw)
+    seen = set()
+    for query_hash, query, count, bucket in rows:
+        if query_hash in seen:
+            continue
+        seen.add(query_hash)
+        counts[query_hash] += int(count)
+        names.setdefault(query_hash, query)
+        if isinstance(bucket, str):  # SQLite returns max() of a datetime as text
+            bucket = datetime.fromisoformat(bucket)
+        latest.setdefault(query_hash, bucket)
+
+    if last_seen:
+        return [{'query': names[query_hash], 'count': count, 'last_seen': latest[query_hash]}
+                for query_hash, count in counts.most_common(limit)]
+    return [{'query': names[query_hash], 'count': count}
+            for query_hash, count in counts.most_common(limit)]
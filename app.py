@@ -1,49 +1,607 @@
 import os
+import hashlib
+import json
 import logging
-import requests
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import DeclarativeBase
+import math
+import tempfile
+import threading
+import time
+from datetime import timedelta, timezone, datetime
+import click
+from flask import (Flask, current_app, render_template, request, redirect, url_for, flash,
+                   jsonify, g, session, Response, stream_template)
+from flask.cli import with_appcontext
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import is_resource_modified
+from werkzeug.local import LocalProxy
 from werkzeug.middleware.proxy_fix import ProxyFix
 from forms import UserDataForm, SearchResultsForm
-from search_engine import GoogleSearchEngine
+from cache import ResultCache, open_shared_store
+from suggest import LocalSuggester, SuggestionCache
+from health import HealthMonitor
+from results import SearchResult, json_default
+from metrics import (CONTENT_TYPE, REGISTRY, REQUEST_SECONDS, SlowRequestProfiler,
+                     cache_collector, time_stage)
 
-# Configure logging for debugging
-logging.basicConfig(level=logging.DEBUG)
+# Settings and their defaults. Each can be overridden by an environment
+# variable of the same name, or by the mapping passed to create_app().
+DEFAULTS = {
+    'SESSION_SECRET': "dev-secret-change-in-production",
+    'LOG_LEVEL': "INFO",
+    'DATABASE_URL': None,
+    # Create and upgrade tables in create_app instead of `flask init-db`
+    'DATABASE_AUTO_MIGRATE': "0",
+    # Import and build the search engine in the background after startup
+    'SEARCH_WARM_UP': "1",
+    
+    # Shared keep-alive connection pools for all upstream fetches
+    'HTTP_POOL_CONNECTIONS': 10,
+    'HTTP_POOL_MAXSIZE': 20,
+    'HTTP_CONNECT_TIMEOUT': 3.05,
+    'HTTP_READ_TIMEOUT': 10.0,
+    # Upstream pages larger than this are refused (0 for no limit)
+    'HTTP_MAX_BODY_BYTES': 2 * 1024 * 1024,
+    # Upstream endpoints, overridden to point at a stub for load tests
+    # (see benchmarks/load_test.py)
+    'SEARCH_GOOGLE_URL': "https://www.google.com/search",
+    'SEARCH_DUCKDUCKGO_URL': "https://html.duckduckgo.com/html/",
+    'SEARCH_AUTOCOMPLETE_URL': "https://duckduckgo.com/ac/",
+    
+    # Search engine and its in-process result cache
+    'SEARCH_PARSER': "auto",
+    'SEARCH_MODE': "fallback",
+    'SEARCH_HEDGE_DELAY': 0.5,
+    'SEARCH_LATENCY_BUDGET': 4.0,
+    'SEARCH_RESULTS_PER_PAGE': 15,
+    'SEARCH_CACHE_MAX_ENTRIES': 1024,
+    'SEARCH_CACHE_MAX_BYTES': 32 * 1024 * 1024,
+    'SEARCH_CACHE_TTL': 300.0,
+    'SEARCH_CACHE_NEGATIVE_TTL': 15.0,
+    # Second cache tier shared by all workers on this host and kept across
+    # restarts ('' keeps caches per process)
+    'SEARCH_SHARED_CACHE': os.path.join(tempfile.gettempdir(), "search-cache.sqlite3"),
+    'SEARCH_SHARED_CACHE_MAX_BYTES': 256 * 1024 * 1024,
+    # Local index of every result fetched, answering when all backends fail
+    # and for instant results; the file is shared by all workers on this
+    # host ('' keeps the index per process, a size of 0 turns it off)
+    'SEARCH_LOCAL_INDEX': os.path.join(tempfile.gettempdir(), "search-index.jsonl"),
+    'SEARCH_LOCAL_INDEX_MAX_DOCS': 50000,
+    # Local results shown on the streamed page while the search runs (0 for none)
+    'SEARCH_INSTANT_RESULTS': 5,
+    # Keep answering with expired results for this long while they are
+    # refreshed in the background (0 turns stale-while-revalidate off)
+    'SEARCH_STALE_TTL': 600.0,
+    # Background refresh of the most searched queries and their prefixes
+    # (needs DATABASE_URL; an interval of 0 turns it off), and the outbound
+    # budget for all background refreshes in requests per second for the
+    # whole host (a rate of 0 turns background refreshing off altogether)
+    'SEARCH_PREWARM_INTERVAL': 60.0,
+    'SEARCH_PREWARM_TOP_N': 50,
+    'SEARCH_PREWARM_PREFIXES': 100,
+    'SEARCH_PREWARM_WINDOW_HOURS': 24.0,
+    'SEARCH_PREWARM_RATE': 0.2,
+    'SEARCH_PREWARM_BURST': 5.0,
+    # Circuit breakers, shared by all workers on this host through a state
+    # file ('' keeps them per process)
+    'SEARCH_BREAKER_STATE': os.path.join(tempfile.gettempdir(), "search-breakers.json"),
+    'SEARCH_BREAKER_FAILURES': 5,
+    'SEARCH_BREAKER_RESET': 30.0,
+    'SEARCH_BREAKER_MAX_RESET': 600.0,
+    # Outbound requests per second and burst per backend, for the whole host
+    # (shared through the breaker state file; a rate of 0 means unlimited),
+    # how many requests may queue for one, and how long a search may wait.
+    # Batch API searches queue behind /search and autocomplete.
+    'SEARCH_RATE_GOOGLE': 1.0,
+    'SEARCH_BURST_GOOGLE': 5.0,
+    'SEARCH_RATE_DUCKDUCKGO': 2.0,
+    'SEARCH_BURST_DUCKDUCKGO': 10.0,
+    'SEARCH_OUTBOUND_QUEUE': 50,
+    'SEARCH_OUTBOUND_WAIT': 2.0,
+    # Serve /search from the asyncio engine ("1", needs the 'async' extra),
+    # or stream it. Under WSGI, Flask runs each async view to completion on
+    # the worker thread that took the request, so the engine shares one
+    # connection pool and event loop per process but does not free workers:
+    # to hold many searches in flight per process, run gunicorn with
+    # threads (e.g. --worker-class gthread --threads 100).
+    'SEARCH_ASYNC': "0",
+    'SEARCH_ASYNC_CONNECTIONS': 200,
+    'SEARCH_STREAM': "0",
+    
+    # Rendered results pages, and how long browsers and CDNs may reuse them
+    'SEARCH_PAGE_CACHE_MAX_ENTRIES': 256,
+    'SEARCH_PAGE_CACHE_MAX_BYTES': 16 * 1024 * 1024,
+    'SEARCH_PAGE_MAX_AGE': 60,
+    'SEARCH_PAGE_CDN_MAX_AGE': 300,
+    
+    # Limits for the batch JSON API
+    'SEARCH_API_MAX_BATCH': 50,
+    'SEARCH_API_CONCURRENCY': 10,
+    'SEARCH_API_DEADLINE': 10.0,
+    
+    # Autocomplete: local index from our own search history, and upstream
+    # suggestions shared by all users typing the same prefixes
+    'AUTOCOMPLETE_SOURCE': "blend",
+    'AUTOCOMPLETE_LOCAL_MIN': 4,
+    'AUTOCOMPLETE_RELOAD_INTERVAL': 0.0,
+    # Days of search history the local index is loaded from
+    'AUTOCOMPLETE_HISTORY_DAYS': 90,
+    'AUTOCOMPLETE_CACHE_MAX_ENTRIES': 20000,
+    'AUTOCOMPLETE_CACHE_MAX_BYTES': 8 * 1024 * 1024,
+    'AUTOCOMPLETE_CACHE_TTL': 600.0,
+    'AUTOCOMPLETE_STALE_TTL': 3600.0,
+    'AUTOCOMPLETE_SHARED_CACHE_MAX_BYTES': 32 * 1024 * 1024,
+    'AUTOCOMPLETE_MAX_AGE': 60,
+    
+    # Write-behind search log
+    'SEARCH_LOG_MAX_QUEUE': 10000,
+    'SEARCH_LOG_BATCH_SIZE': 200,
+    'SEARCH_LOG_FLUSH_INTERVAL': 1.0,
+    # How often each worker folds new search log rows into the hourly
+    # rollups behind popular queries (0 leaves it to compact-search-log)
+    'SEARCH_LOG_ROLLUP_INTERVAL': 300.0,
+    # Raw search log rows compact-search-log keeps, in days (0 keeps all)
+    'SEARCH_LOG_RETENTION_DAYS': 30,
+    
+    # cProfile dumps for a sample of slow requests
+    'SEARCH_PROFILE_SAMPLE_RATE': 0.0,
+    'SEARCH_PROFILE_SLOW_SECONDS': 1.0,
+    'SEARCH_PROFILE_DIR': None,
+}
+
+
+def load_config(environ=None):
+    """DEFAULTS, overridden by environment variables and converted to the defaults' types."""
+    environ = os.environ if environ is None else environ
+    config = {}
+    for name, default in DEFAULTS.items():
+        value = environ.get(name)
+        if value is None:
+            config[name] = default
+        elif default is None or isinstance(default, str):
+            config[name] = value
+        else:
+            config[name] = type(default)(value)
+    return config
+
+
+class SearchJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, also writing SearchResult records as objects."""
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, SearchResult):
+            return o.as_dict()
+        return DefaultJSONProvider.default(o)
+
+
+class lazy:
+    """Cached property that is built once, even when several threads first use it at once."""
+    
+    _lock = threading.RLock()  # re-entrant: services build on each other
+    
+    def __init__(self, build):
+        self.build = build
+        self.name = build.__name__
+        self.__doc__ = build.__doc__
+    
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        with self._lock:
+            if self.name not in obj.__dict__:
+                obj.__dict__[self.name] = self.build(obj)
+        return obj.__dict__[self.name]
+
+
+class Services:
+    """The long-lived objects of one app, built from its config on first use.
+    
+    Nothing here is created by create_app(), so a worker starts serving
+    without importing requests or BeautifulSoup. The first request that
+    needs a service builds it, unless warm_up() got there first.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.config = app.config
+        self.db = None  # set by create_app when DATABASE_URL is configured
+    
+    @lazy
+    def http_client(self):
+        from http_client import configure_http_client
+        config = self.config
+        return configure_http_client(
+            pool_connections=config['HTTP_POOL_CONNECTIONS'],
+            pool_maxsize=config['HTTP_POOL_MAXSIZE'],
+            connect_timeout=config['HTTP_CONNECT_TIMEOUT'],
+            read_timeout=config['HTTP_READ_TIMEOUT'],
+            max_body_bytes=config['HTTP_MAX_BODY_BYTES'],
+        )
+    
+    @lazy
+    def search_cache(self):
+        config = self.config
+        return ResultCache(
+            max_entries=config['SEARCH_CACHE_MAX_ENTRIES'],
+            max_bytes=config['SEARCH_CACHE_MAX_BYTES'],
+            ttl=config['SEARCH_CACHE_TTL'],
+            negative_ttl=config['SEARCH_CACHE_NEGATIVE_TTL'],
+            store=open_shared_store(config['SEARCH_SHARED_CACHE'], 'search',
+                                    max_bytes=config['SEARCH_SHARED_CACHE_MAX_BYTES']),
+            stale_ttl=config['SEARCH_STALE_TTL'],
+            revalidate=self.revalidate if config['SEARCH_PREWARM_RATE'] > 0 else None,
+        )
+    
+    @lazy
+    def backend_health(self):
+        config = self.config
+        return HealthMonitor(
+            state_path=config['SEARCH_BREAKER_STATE'],
+            failure_threshold=config['SEARCH_BREAKER_FAILURES'],
+            reset_timeout=config['SEARCH_BREAKER_RESET'],
+            max_reset_timeout=config['SEARCH_BREAKER_MAX_RESET'],
+        )
+    
+    @lazy
+    def search_engine(self):
+        from search_engine import GoogleSearchEngine
+        config = self.config
+        return GoogleSearchEngine(
+            cache=self.search_cache,
+            http=self.http_client,
+            parser=config['SEARCH_PARSER'],
+            mode=config['SEARCH_MODE'],
+            hedge_delay=config['SEARCH_HEDGE_DELAY'],
+            latency_budget=config['SEARCH_LATENCY_BUDGET'],
+            health=self.backend_health,
+            scheduler=self.scheduler,
+            google_search_url=config['SEARCH_GOOGLE_URL'],
+            duckduckgo_html_url=config['SEARCH_DUCKDUCKGO_URL'],
+            autocomplete_url=config['SEARCH_AUTOCOMPLETE_URL'],
+            local_index=self.local_index,
+        )
+    
+    @lazy
+    def local_index(self):
+        """Local search index of fetched results, or None; the file loads in the background."""
+        config = self.config
+        if config['SEARCH_LOCAL_INDEX_MAX_DOCS'] <= 0:
+            return None
+        from local_index import LocalIndex
+        index = LocalIndex(path=config['SEARCH_LOCAL_INDEX'],
+                           max_docs=config['SEARCH_LOCAL_INDEX_MAX_DOCS'])
+        if index.path is not None:
+            
+            def load():
+                try:
+                    index.load()
+                except Exception as e:
+                    self.app.logger.warning(f"Failed to load local search index: {e}")
+            
+            threading.Thread(target=load, name='local-index-load', daemon=True).start()
+        return index
+    
+    @lazy
+    def scheduler(self):
+        from scheduler import INTERACTIVE, OutboundScheduler
+        config = self.config
+        return OutboundScheduler(
+            limits={
+                'google': (config['SEARCH_RATE_GOOGLE'], config['SEARCH_BURST_GOOGLE']),
+                'duckduckgo': (config['SEARCH_RATE_DUCKDUCKGO'], config['SEARCH_BURST_DUCKDUCKGO']),
+            },
+            store=self.backend_health.store,
+            max_queue=config['SEARCH_OUTBOUND_QUEUE'],
+            max_wait={INTERACTIVE: config['SEARCH_OUTBOUND_WAIT']},
+        )
+    
+    @lazy
+    def async_search_engine(self):
+        """Asyncio engine sharing the cache and settings of search_engine, if enabled."""
+        if self.config['SEARCH_ASYNC'] != "1":
+            return None
+        from async_search_engine import AsyncGoogleSearchEngine
+        return AsyncGoogleSearchEngine(self.search_engine,
+                                       connections=self.config['SEARCH_ASYNC_CONNECTIONS'])
+    
+    @lazy
+    def page_cache(self):
+        """Rendered results pages, keyed by ETag."""
+        config = self.config
+        return ResultCache(
+            max_entries=config['SEARCH_PAGE_CACHE_MAX_ENTRIES'],
+            max_bytes=config['SEARCH_PAGE_CACHE_MAX_BYTES'],
+            ttl=config['SEARCH_CACHE_TTL'],
+        )
+    
+    @lazy
+    def suggester(self):
+        """Local autocomplete index; history loads in the background."""
+        config = self.config
+        suggester = LocalSuggester(mode=config['AUTOCOMPLETE_SOURCE'],
+                                   min_local=config['AUTOCOMPLETE_LOCAL_MIN'],
+                                   load_window=timedelta(days=config['AUTOCOMPLETE_HISTORY_DAYS']))
+        if self.db is not None:
+            def load():
+                try:
+                    with self.app.app_context():
+                        suggester.load()
+                except Exception as e:
+                    self.app.logger.warning(f"Failed to load suggestion index: {e}")
+            
+            threading.Thread(target=load, name='suggest-load', daemon=True).start()
+            if config['AUTOCOMPLETE_RELOAD_INTERVAL'] > 0:
+                suggester.start_reloading(self.app, config['AUTOCOMPLETE_RELOAD_INTERVAL'])
+        return suggester
+    
+    @lazy
+    def suggestion_cache(self):
+        config = self.config
+        return SuggestionCache(ResultCache(
+            max_entries=config['AUTOCOMPLETE_CACHE_MAX_ENTRIES'],
+            max_bytes=config['AUTOCOMPLETE_CACHE_MAX_BYTES'],
+            ttl=config['AUTOCOMPLETE_CACHE_TTL'],
+            store=open_shared_store(config['SEARCH_SHARED_CACHE'], 'suggestions',
+                                    max_bytes=config['AUTOCOMPLETE_SHARED_CACHE_MAX_BYTES']),
+            stale_ttl=config['AUTOCOMPLETE_STALE_TTL'],
+            revalidate=self.revalidate if config['SEARCH_PREWARM_RATE'] > 0 else None,
+        ))
+    
+    @lazy
+    def cache_warmer(self):
+        """Background refresher for popular and stale cache entries."""
+        from prewarm import CacheWarmer
+        from scheduler import TokenBucket
+        config = self.config
+        return CacheWarmer(
+            self.search_engine,
+            TokenBucket('prewarm', config['SEARCH_PREWARM_RATE'], config['SEARCH_PREWARM_BURST'],
+                        store=self.backend_health.store),
+            suggestions=self.suggestion_cache if config['AUTOCOMPLETE_SOURCE'] != 'local' else None,
+            suggester=self.suggester,
+            top_n=config['SEARCH_PREWARM_TOP_N'],
+            prefixes=config['SEARCH_PREWARM_PREFIXES'],
+            window=timedelta(hours=config['SEARCH_PREWARM_WINDOW_HOURS']),
+            interval=config['SEARCH_PREWARM_INTERVAL'],
+            num_results=config['SEARCH_RESULTS_PER_PAGE'],
+        )
+    
+    def revalidate(self, refresh):
+        """Refresh a stale cache entry in the background (ResultCache's revalidate hook)."""
+        return self.cache_warmer.revalidate(refresh)
+    
+    def prewarm(self):
+        """Keep the most searched queries cached; runs forever."""
+        self.cache_warmer.run(self.app, load_popular_queries)
+    
+    def roll_up_search_log(self):
+        """Keep the search log rollups up to date; runs forever."""
+        from analytics import run_rollups
+        run_rollups(self.app, self.config['SEARCH_LOG_ROLLUP_INTERVAL'])
+    
+    @lazy
+    def query_logger(self):
+        """Write-behind SearchQuery logger, or None without a database."""
+        if self.db is None:
+            return None
+        import models
+        from query_log import QueryLogWriter
+        config = self.config
+        return QueryLogWriter(
+            self.app, self.db, models.SearchQuery,
+            max_queue=config['SEARCH_LOG_MAX_QUEUE'],
+            batch_size=config['SEARCH_LOG_BATCH_SIZE'],
+            flush_interval=config['SEARCH_LOG_FLUSH_INTERVAL'],
+        )
+    
+    @lazy
+    def profiler(self):
+        config = self.config
+        return SlowRequestProfiler(
+            sample_rate=config['SEARCH_PROFILE_SAMPLE_RATE'],
+            threshold=config['SEARCH_PROFILE_SLOW_SECONDS'],
+            directory=config['SEARCH_PROFILE_DIR'],
+        )
+    
+    @lazy
+    def template_version(self):
+        """Digest of the templates, so a deploy that changes them changes every ETag."""
+        digest = hashlib.blake2b(digest_size=8)
+        template_dir = os.path.join(self.app.root_path, self.app.template_folder)
+        for name in sorted(os.listdir(template_dir)):
+            with open(os.path.join(template_dir, name), 'rb') as f:
+                digest.update(name.encode() + f.read())
+        return digest.hexdigest()
+    
+    def warm_up(self):
+        """Build the services a search needs, so the first search doesn't wait."""
+        started = time.perf_counter()
+        try:
+            self.search_engine
+            self.async_search_engine
+            self.suggester
+            self.query_logger
+        except Exception as e:
+            self.app.logger.warning(f"Warm-up failed: {e}")
+            return
+        self.app.logger.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s")
+    
+    def built(self, name):
+        return name in self.__dict__
+    
+    def collect_metrics(self):
+        """Metrics of the services built so far; none are built just to report."""
+        for name, attr in (('search', 'search_cache'), ('pages', 'page_cache')):
+            if self.built(attr):
+                yield from cache_collector(name, getattr(self, attr))()
+        if self.built('suggestion_cache'):
+            yield from cache_collector('suggestions', self.suggestion_cache.cache)()
+        if self.built('backend_health'):
+            states = {'closed': 0, 'half-open': 1, 'open': 2}
+            health = self.backend_health.stats()
+            yield ('search_backend_circuit_state', 'gauge',
+                   'Circuit breaker state per backend (0 closed, 1 half-open, 2 open).',
+                   [({'backend': name}, states[stats['state']]) for name, stats in health.items()])
+        if self.built('local_index') and self.local_index is not None:
+            stats = self.local_index.stats()
+            yield ('search_local_index_documents', 'gauge',
+                   'Results in the local search index.', [({}, stats['documents'])])
+            yield ('search_local_index_terms', 'gauge',
+                   'Distinct terms in the local search index.', [({}, stats['terms'])])
+            yield ('search_local_index_searches_total', 'counter',
+                   'Searches answered from the local index.', [({}, stats['searches'])])
+            yield ('search_local_index_evicted_total', 'counter',
+                   'Oldest results forgotten by the full local index.', [({}, stats['evicted'])])
+        if self.built('cache_warmer'):
+            stats = self.cache_warmer.stats()
+            yield ('search_prewarm_queue_length', 'gauge',
+                   'Background cache refreshes waiting to run.', [({}, stats['queued'])])
+            yield ('search_prewarm_refreshes_total', 'counter',
+                   'Background cache refreshes by outcome.',
+                   [({'outcome': outcome}, stats[outcome])
+                    for outcome in ('refreshed', 'dropped', 'deferred', 'failed')])
+        if self.built('scheduler'):
+            queued = self.scheduler.stats()['queued']
+            yield ('search_outbound_queue_length', 'gauge',
+                   'Upstream requests waiting for the outbound rate limiter.',
+                   [({'backend': name}, length) for name, length in queued.items()])
+        if self.built('query_logger') and self.query_logger is not None:
+            stats = self.query_logger.stats()
+            yield ('search_log_queue_rows', 'gauge', 'Search log rows waiting to be written.',
+                   [({}, stats['queued'])])
+            yield ('search_log_rows_total', 'counter', 'Search log rows by outcome.',
+                   [({'outcome': outcome}, stats[outcome])
+                    for outcome in ('written', 'dropped', 'failed')])
 
 
-class Base(DeclarativeBase):
-    pass
+# The current app's Services, for use in views
+services = LocalProxy(lambda: current_app.extensions['search_services'])
 
 
-db = SQLAlchemy(model_class=Base)
+def create_app(config=None):
+    """Build the Flask app from DEFAULTS, the environment and config."""
+    app = Flask(__name__)
+    app.json = SearchJSONProvider(app)
+    app.config.update(load_config())
+    app.config.update(config or {})
+    app.secret_key = app.config['SESSION_SECRET']
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
+    
+    logging.basicConfig(level=app.config['LOG_LEVEL'])
+    logging.getLogger().setLevel(app.config['LOG_LEVEL'])
+    
+    app_services = app.extensions['search_services'] = Services(app)
+    
+    database_url = app.config['DATABASE_URL']
+    if database_url:
+        from database import db
+        app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+            "pool_recycle": 300,
+            "pool_pre_ping": True,
+        }
+        # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
+        db.init_app(app)
+        app_services.db = db
+        if app.config['DATABASE_AUTO_MIGRATE'] == "1":
+            with app.app_context():
+                migrate_database()
+    
+    register_routes(app)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(compact_search_log)
+    
+    if app.config['SEARCH_WARM_UP'] == "1":
+        threading.Thread(target=app_services.warm_up, name='warm-up', daemon=True).start()
+    if (database_url and app.config['SEARCH_PREWARM_INTERVAL'] > 0 and
+            app.config['SEARCH_PREWARM_RATE'] > 0):
+        threading.Thread(target=app_services.prewarm, name='prewarm', daemon=True).start()
+    if database_url and app.config['SEARCH_LOG_ROLLUP_INTERVAL'] > 0:
+        threading.Thread(target=app_services.roll_up_search_log, name='search-rollup',
+                         daemon=True).start()
+    return app
 
-# Create the Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-change-in-production")
-app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
 
-# Initialize the search engine
-search_engine = GoogleSearchEngine()
+def register_routes(app):
+    app.before_request(start_request_timer)
+    app.after_request(record_request_time)
+    
+    # Serve /search and /autocomplete from the asyncio engine when enabled
+    # (needs the 'async' extra: aiohttp and Flask's async support)
+    search_view, autocomplete_view = search, autocomplete
+    if app.config['SEARCH_ASYNC'] == "1":
+        search_view, autocomplete_view = search_async, autocomplete_async
+    elif app.config['SEARCH_STREAM'] == "1":
+        search_view = search_stream
+    
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    app.add_url_rule('/', 'index', index, methods=['GET'])
+    app.add_url_rule('/search', 'search', search_view, methods=['GET'])
+    app.add_url_rule('/autocomplete', 'autocomplete', autocomplete_view, methods=['GET', 'POST'])
+    app.add_url_rule('/api/popular-queries', 'popular_queries', popular_queries)
+    app.add_url_rule('/api/v1/search', 'api_search', api_search, methods=['GET', 'POST'])
+    app.add_url_rule('/api/v1/instant', 'api_instant', api_instant)
+    app.add_url_rule('/debug-search', 'debug_search', debug_search)
 
-# configure the database, relative to the app instance folder
-database_url = os.environ.get("DATABASE_URL")
-if database_url:
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
-    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-        "pool_recycle": 300,
-        "pool_pre_ping": True,
-    }
-    # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
-    db.init_app(app)
 
-@app.route('/', methods=['GET'])
+def load_popular_queries(window, limit):
+    """The most searched queries over the last window, for the cache warmer."""
+    from analytics import db_now, top_queries
+    return top_queries(db_now() - window, limit=limit)
+
+
+def migrate_database():
+    """Create missing tables and bring existing ones up to date."""
+    from database import db
+    # Make sure to import the models here or their tables won't be created
+    import models  # noqa: F401
+    from analytics import upgrade_search_query_schema
+    db.create_all()
+    upgrade_search_query_schema()
+
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.profile = services.profiler.start()
+
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    endpoint = request.endpoint or 'unknown'
+    status = response.status_code
+    profile = g.pop('profile', None)
+    profiler = services.profiler
+    app_logger = current_app.logger
+    
+    def finish():
+        elapsed = time.perf_counter() - started
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, status=status)
+        profiler.finish(profile, elapsed, endpoint)
+    
+    if not response.is_streamed:
+        finish()
+        return response
+    
+    # A streamed body is produced after this hook, e.g. a streamed search
+    # runs inside its template, so time it up to when the server closes it
+    def finish_on_close():
+        try:
+            finish()
+        except Exception as e:
+            app_logger.warning(f"Failed to record streamed request time: {e}")
+    
+    response.call_on_close(finish_on_close)
+    return response
+
+def metrics():
+    """Prometheus text exposition of this worker's metrics."""
+    return REGISTRY.render(services.collect_metrics), 200, {'Content-Type': CONTENT_TYPE}
+
 def index():
     """Homepage with search form."""
     form = UserDataForm()
     return render_template('index.html', form=form)
 
-@app.route('/search', methods=['GET'])
 def search():
     """Search results page."""
     query = request.args.get('q', '').strip()
@@ -52,26 +610,156 @@ def search():
         flash('Please enter a search term.', 'warning')
         return redirect(url_for('index'))
     
-    # Log the search query
-    app.logger.info(f"Search query: {query}")
+    page = results_page()
+    if page == 1:
+        log_search_query(query)
     
-    # Store search query in database if configured
-    if database_url:
+    # Perform Google search
+    search_results = services.search_engine.search(
+        query, num_results=current_app.config['SEARCH_RESULTS_PER_PAGE'], page=page)
+    
+    return render_search_results(query, search_results, page)
+
+async def search_async():
+    """Search results page served by the async search engine."""
+    query = request.args.get('q', '').strip()
+    
+    if not query:
+        flash('Please enter a search term.', 'warning')
+        return redirect(url_for('index'))
+    
+    page = results_page()
+    if page == 1:
+        log_search_query(query)
+    
+    search_results = await services.async_search_engine.search(
+        query, num_results=current_app.config['SEARCH_RESULTS_PER_PAGE'], page=page)
+    
+    return render_search_results(query, search_results, page)
+
+def search_stream():
+    """Search results page streamed to the browser as it is produced.
+    
+    The page head, CSS and search bar go out before the search starts;
+    the result blocks follow as soon as the search returns.
+    """
+    query = request.args.get('q', '').strip()
+    
+    if not query:
+        flash('Please enter a search term.', 'warning')
+        return redirect(url_for('index'))
+    
+    page = results_page()
+    if page == 1:
+        log_search_query(query)
+    
+    search_form = SearchResultsForm()
+    search_form.q.data = query
+    search_engine = services.search_engine
+    config = current_app.config
+    num_results = config['SEARCH_RESULTS_PER_PAGE']
+    search = StreamedSearch(
+        lambda: search_engine.search(query, num_results=num_results, page=page), page)
+    # Local matches go out with the page head unless the search is cached
+    instant = []
+    if (page == 1 and config['SEARCH_INSTANT_RESULTS'] > 0 and
+            search_engine.cache.peek(search_engine.cache_key(query, num_results)) is None):
+        instant = search_engine.search_local(
+            query, config['SEARCH_INSTANT_RESULTS']).get('results', [])
+    chunks = stream_template('search_results_stream.html', query=query,
+                             search_form=search_form, search=search, instant=instant)
+    response = Response(coalesce_stream(chunks), mimetype='text/html')
+    response.headers['X-Accel-Buffering'] = 'no'  # don't let nginx hold it back
+    return response
+
+class StreamedSearch:
+    """A search run lazily from inside a streamed template.
+    
+    The status line has already been sent by the time results() runs, so
+    failures end up in ``error`` and are shown inline instead of raising.
+    """
+    
+    def __init__(self, run, page=1):
+        self._run = run
+        self.page = page
+        self.error = None
+        self.total_results = 0
+        self.count = 0
+        self.has_more = False
+        self.degraded = False
+    
+    def results(self):
         try:
-            from models import SearchQuery
-            search_record = SearchQuery(
-                query=query,
-                user_agent=request.headers.get('User-Agent', ''),
-                ip_address=request.environ.get('HTTP_X_FORWARDED_FOR', request.remote_addr)
-            )
-            db.session.add(search_record)
-            db.session.commit()
+            search_results = self._run()
         except Exception as e:
-            app.logger.warning(f"Failed to store search query: {e}")
+            current_app.logger.error(f"Streamed search failed: {e}")
+            search_results = {'error': 'Search processing failed'}
+        
+        if 'error' in search_results:
+            self.error = search_results['error']
+            return
+        
+        self.total_results = search_results.get('total_results', 0)
+        self.has_more = search_results.get('has_more', self.page == 1)
+        self.degraded = search_results.get('degraded', False)
+        for result in search_results.get('results', []):
+            self.count += 1
+            yield result
+
+# Template marker after which everything rendered so far is sent at once
+STREAM_FLUSH_MARKER = '<!--stream:flush-->'
+
+def coalesce_stream(chunks, min_size=4096):
+    """Join Jinja's many small chunks into fewer, larger writes.
     
-    # Perform Google search
-    search_results = search_engine.search(query, num_results=15)
+    Output is held back until min_size characters are waiting, except at
+    STREAM_FLUSH_MARKER, which is sent right away because the template is
+    about to block on the search.
+    """
+    buffer = []
+    size = 0
+    for chunk in chunks:
+        if STREAM_FLUSH_MARKER in chunk:
+            head, _, tail = chunk.partition(STREAM_FLUSH_MARKER)
+            buffer.append(head)
+            yield ''.join(buffer)
+            buffer = [tail]
+            size = len(tail)
+            continue
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def log_search_query(query):
+    """Log the search query and store it in the database if configured."""
+    current_app.logger.info(f"Search query: {query}")
+    services.suggester.record(query)
     
+    # Stored in the background by the write-behind logger
+    query_logger = services.query_logger
+    if query_logger is not None:
+        # Cut to the column sizes: one oversized row would fail its whole batch
+        forwarded = request.environ.get('HTTP_X_FORWARDED_FOR', '')
+        ip_address = forwarded.split(',')[0].strip() or request.remote_addr
+        query_logger.log(
+            query[:500],
+            user_agent=request.headers.get('User-Agent', '')[:500],
+            ip_address=ip_address[:45] if ip_address else ip_address
+        )
+
+def results_page():
+    """The requested results page, clamped to the pages the engine can serve."""
+    from search_engine import MAX_RESULTS
+    page = request.args.get('page', 1, type=int) or 1
+    return min(max(page, 1), -(-MAX_RESULTS // current_app.config['SEARCH_RESULTS_PER_PAGE']))
+
+def render_search_results(query, search_results, page=1):
+    """Render the results page for a search response dict."""
     # Create the search results form for the header search bar
     search_form = SearchResultsForm()
     search_form.q.data = query  # Pre-populate with current query
@@ -79,42 +767,226 @@ def search():
     # Handle search errors
     if 'error' in search_results:
         flash(f"Search error: {search_results['error']}", 'warning')
-        return render_template('search_results.html', 
-                             query=query, 
-                             search_form=search_form, 
-                             results=[], 
-                             error=search_results['error'])
+        with time_stage('render', 'app'):
+            return render_template('search_results.html',
+                                 query=query,
+                                 search_form=search_form,
+                                 results=[],
+                                 page=page,
+                                 has_more=False,
+                                 error=search_results['error'])
     
     # Display search results
-    return render_template('search_results.html', 
-                         query=query, 
-                         search_form=search_form, 
-                         results=search_results.get('results', []),
-                         total_results=search_results.get('total_results', 0))
+    def render():
+        with time_stage('render', 'app'):
+            return render_template('search_results.html',
+                                 query=query,
+                                 search_form=search_form,
+                                 results=search_results.get('results', []),
+                                 page=page,
+                                 has_more=search_results.get('has_more', page == 1),
+                                 total_results=search_results.get('total_results', 0),
+                                 degraded=search_results.get('degraded', False))
+    
+    if session.get('_flashes') or search_results.get('degraded'):
+        # Pending flash messages make this page one of a kind, and a
+        # stand-in answer should not outlive the outage behind it
+        return render()
+    
+    config = current_app.config
+    etag = search_page_etag(query, search_results, page)
+    response = Response(mimetype='text/html')
+    response.set_etag(etag)
+    response.last_modified = results_timestamp(search_results)
+    response.cache_control.public = True
+    response.cache_control.max_age = config['SEARCH_PAGE_MAX_AGE']
+    response.cache_control.s_maxage = config['SEARCH_PAGE_CDN_MAX_AGE']
+    if not is_resource_modified(request.environ, etag=etag,
+                                last_modified=response.last_modified):
+        response.status_code = 304
+        return response
+    response.set_data(services.page_cache.get_or_compute(etag, render))
+    return response
+
+def search_page_etag(query, search_results, page):
+    """Strong ETag of the results page for this result set."""
+    payload = json.dumps([services.template_version, query, page,
+                          search_results.get('has_more', page == 1),
+                          search_results.get('total_results', 0), search_results.get('results', [])],
+                         sort_keys=True, default=json_default)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+def results_timestamp(search_results):
+    """When the result set was fetched upstream, as an aware datetime."""
+    try:
+        fetched = datetime.fromisoformat(search_results['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    return fetched.astimezone(timezone.utc).replace(microsecond=0)
+
+def autocomplete_query():
+    if request.method == 'GET':
+        return request.args.get('q')
+    return request.form.get('q') or (request.get_json(silent=True) or {}).get('q')
+
+def autocomplete_response(q, suggestions, cacheable=True, complete=False):
+    """JSON suggestions; GET responses get validators and cache headers.
+    
+    X-Suggestions-Complete tells the client that suggestions list every
+    completion of q, so it can filter them for longer prefixes itself.
+    """
+    response = jsonify([q, suggestions])
+    if complete:
+        response.headers['X-Suggestions-Complete'] = '1'
+    if request.method != 'GET':
+        return response
+    if not cacheable:
+        response.cache_control.no_store = True
+        return response
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['AUTOCOMPLETE_MAX_AGE']
+    response.add_etag()
+    return response.make_conditional(request)
 
-@app.route('/autocomplete', methods=['POST'])
 def autocomplete():
-    """Autocomplete endpoint that fetches suggestions from DuckDuckGo API."""
-    q = request.form.get('q') or (request.get_json() or {}).get('q')
+    """Autocomplete endpoint serving local and DuckDuckGo suggestions."""
+    q = autocomplete_query()
     if not q:
         return jsonify(['', []])
     
+    suggester = services.suggester
+    local = suggester.suggest(q)
+    if not suggester.wants_upstream(local):
+        return autocomplete_response(q, local, complete=suggester.is_complete(local))
+    
+    suggestion_cache = services.suggestion_cache
     try:
-        # Make request to DuckDuckGo API
-        response = requests.get('https://duckduckgo.com/ac/', 
-                              params={'q': q, 'type': 'list'}, 
-                              timeout=5)
-        
-        if response.status_code == 200:
-            suggestions = response.json()
-            return jsonify([q, suggestions[1] if len(suggestions) > 1 else []])
-        else:
-            return jsonify([q, []])
+        upstream = suggestion_cache.get_or_fetch(q, services.search_engine.autocomplete)
     except Exception as e:
-        app.logger.error(f"Autocomplete error: {e}")
-        return jsonify([q, []])
+        current_app.logger.error(f"Autocomplete error: {e}")
+        return autocomplete_response(q, local, cacheable=False)
+    suggestions = suggester.blend(local, upstream)
+    complete = suggester.is_complete(suggestions, suggestion_cache.is_complete(q, upstream))
+    return autocomplete_response(q, suggestions, complete=complete)
+
+async def autocomplete_async():
+    """Autocomplete endpoint served by the async search engine."""
+    q = autocomplete_query()
+    if not q:
+        return jsonify(['', []])
+    
+    suggester = services.suggester
+    local = suggester.suggest(q)
+    if not suggester.wants_upstream(local):
+        return autocomplete_response(q, local, complete=suggester.is_complete(local))
+    
+    suggestion_cache = services.suggestion_cache
+    upstream = suggestion_cache.lookup(q)
+    if upstream is None:
+        upstream = suggestion_cache.serve_stale(q, services.search_engine.autocomplete)
+    if upstream is None:
+        try:
+            upstream = await services.async_search_engine.autocomplete(q)
+        except Exception as e:
+            current_app.logger.error(f"Autocomplete error: {e}")
+            return autocomplete_response(q, local, cacheable=False)
+        suggestion_cache.store(q, upstream)
+    suggestions = suggester.blend(local, upstream)
+    complete = suggester.is_complete(suggestions, suggestion_cache.is_complete(q, upstream))
+    return autocomplete_response(q, suggestions, complete=complete)
+
+def popular_queries():
+    """Most searched queries over the last `hours` hours, as JSON."""
+    if services.db is None:
+        return jsonify({'error': 'Search history is not enabled'}), 404
+    from analytics import db_now, top_queries
+    
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 365)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 100)
+    end = db_now()
+    start = end - timedelta(hours=hours)
+    try:
+        queries = top_queries(start, end, limit=limit)
+    except Exception as e:
+        current_app.logger.error(f"Popular queries error: {e}")
+        return jsonify({'error': 'Failed to load popular queries'}), 500
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'queries': queries})
+
+def api_search():
+    """Run one or more searches and return the results as JSON.
+    
+    GET takes one or more `q` parameters; POST takes a JSON object
+    {"queries": [...], "num_results": 10, "deadline": 5}. The searches
+    run concurrently, so a batch costs about one search's latency.
+    
+    The callers are services, not people, so their queries stay out of
+    the search history behind suggestions, popular queries and pre-warming.
+    """
+    from search_engine import MAX_PAGE_SIZE
+    config = current_app.config
+    
+    if request.method == 'GET':
+        payload = {'queries': request.args.getlist('q'),
+                   'num_results': request.args.get('num_results', type=int),
+                   'deadline': request.args.get('deadline', type=float)}
+    else:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+    
+    queries = payload.get('queries')
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify({'error': "'queries' must be a list of strings"}), 400
+    queries = [q.strip()[:500] for q in queries if q.strip()]
+    if not queries:
+        return jsonify({'error': 'No queries given'}), 400
+    if len(queries) > config['SEARCH_API_MAX_BATCH']:
+        return jsonify({'error': f"At most {config['SEARCH_API_MAX_BATCH']} queries per request"}), 400
+    try:
+        num_results = min(max(int(payload.get('num_results') or 10), 1), MAX_PAGE_SIZE)
+        deadline = float(payload.get('deadline') or config['SEARCH_API_DEADLINE'])
+        if not math.isfinite(deadline):
+            raise ValueError(deadline)
+        deadline = min(max(deadline, 0.1), config['SEARCH_API_DEADLINE'])
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({'error': "'num_results' and 'deadline' must be numbers"}), 400
+    
+    current_app.logger.info(f"Batch search of {len(queries)} queries")
+    started = time.perf_counter()
+    items = services.search_engine.search_batch(queries, num_results=num_results,
+                                                concurrency=config['SEARCH_API_CONCURRENCY'],
+                                                deadline=deadline)
+    return jsonify({
+        'version': 1,
+        'count': len(items),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'results': items,
+    })
+
+def api_instant():
+    """Instant results for `q` from the local index, as JSON.
+    
+    Answers in milliseconds without going upstream, so a client can show
+    something while the full search is still loading.
+    """
+    from search_engine import MAX_PAGE_SIZE
+    if services.local_index is None:
+        return jsonify({'error': 'The local index is not enabled'}), 404
+    query = request.args.get('q', '').strip()[:500]
+    if not query:
+        return jsonify({'error': 'No query given'}), 400
+    num_results = min(max(request.args.get('num_results', 5, type=int), 1), MAX_PAGE_SIZE)
+    
+    started = time.perf_counter()
+    results = services.search_engine.search_local(query, num_results).get('results', [])
+    return jsonify({
+        'query': query,
+        'source': 'Local',
+        'total_results': len(results),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+        'results': results,
+    })
 
-@app.route('/debug-search')
 def debug_search():
     """Debug endpoint to test Google search response."""
     # Enable debug for this endpoint in development
@@ -122,25 +994,63 @@ def debug_search():
     #     return "Debug mode only", 403
     
     query = request.args.get('q', 'test')
-    search_results = search_engine.search(query, num_results=5)
+    search_results = services.search_engine.search(query, num_results=5)
+    query_logger = services.query_logger
     
     return f"""
     <h1>Debug Search Results</h1>
     <p>Query: {query}</p>
     <pre>{search_results}</pre>
+    <h2>Cache</h2>
+    <pre>{services.search_cache.stats()}</pre>
+    <h2>Backend health</h2>
+    <pre>{services.backend_health.stats()}</pre>
+    <h2>Outbound rate limits</h2>
+    <pre>{services.scheduler.stats()}</pre>
+    <h2>Local index</h2>
+    <pre>{services.local_index.stats() if services.local_index is not None else 'disabled'}</pre>
+    <h2>Cache warmer</h2>
+    <pre>{services.cache_warmer.stats() if services.built('cache_warmer') else 'idle'}</pre>
+    <h2>Suggestion cache</h2>
+    <pre>{services.suggestion_cache.stats()}</pre>
+    <h2>Search log</h2>
+    <pre>{query_logger.stats() if query_logger else 'disabled'}</pre>
     <hr>
     <a href="/debug-search?q=python">Test with 'python'</a> |
     <a href="/debug-search?q=hello">Test with 'hello'</a> |
     <a href="/">Back to search</a>
     """
 
-# Initialize database tables if database is configured
-if database_url:
-    with app.app_context():
-        # Make sure to import the models here or their tables won't be created
-        import models  # noqa: F401
-        db.create_all()
+@click.command('init-db')
+@with_appcontext
+def init_db_command():
+    """Create the database tables and apply schema upgrades."""
+    if services.db is None:
+        click.echo("DATABASE_URL is not set; nothing to do")
+        return
+    migrate_database()
+    click.echo("Database schema is up to date")
+
+@click.command('compact-search-log')
+@click.option('--retention-days', type=int, default=None,
+              help='Delete raw rows older than this; 0 keeps everything. '
+                   '[default: SEARCH_LOG_RETENTION_DAYS]')
+@click.option('--batch-size', default=10000, show_default=True)
+@with_appcontext
+def compact_search_log(retention_days, batch_size):
+    """Roll search queries up into hourly counts and prune old raw rows."""
+    from analytics import compact_search_queries, roll_up_search_queries
+    
+    if retention_days is None:
+        retention_days = current_app.config['SEARCH_LOG_RETENTION_DAYS']
+    if retention_days > 0:
+        deleted = compact_search_queries(timedelta(days=retention_days), batch_size=batch_size)
+        click.echo(f"Deleted {deleted} raw search queries")
+    else:
+        rolled = roll_up_search_queries(batch_size=batch_size)
+        click.echo(f"Rolled up {rolled} search queries")
 
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    create_app({'DATABASE_AUTO_MIGRATE': "1", 'LOG_LEVEL': "DEBUG"}).run(
+        host='0.0.0.0', port=5000, debug=True)
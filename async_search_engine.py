@@ -0,0 +1,328 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import normalize_query
+from http_client import BODY_CHUNK_SIZE, decode_body
+from metrics import observe_stage
+from search_engine import (BACKOFF, FETCH, UpstreamError, UpstreamTimeout,
+                           parse_suggestions)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncRunner:
+    """A background thread running one event loop for the whole process.
+
+    Flask runs every async view in a fresh event loop, so long-lived
+    connection pools cannot belong to the request's loop. Upstream I/O
+    for all requests is multiplexed on this loop instead.
+    """
+
+    def __init__(self, name='search-io'):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule coro on the runner loop; returns a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run(self, coro):
+        """Await coro on the runner loop from any event loop."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            return await coro
+        return await asyncio.wrap_future(self.submit(coro))
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=5)
+
+
+async def _connection_create_start(session, context, params):
+    context.trace_request_ctx['connect_started'] = time.perf_counter()
+
+
+async def _connection_create_end(session, context, params):
+    timings = context.trace_request_ctx
+    timings['connect'] = time.perf_counter() - timings.pop('connect_started')
+
+
+class _Response:
+    """The parts of an upstream response the engine looks at."""
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+
+class AsyncGoogleSearchEngine:
+    """asyncio front end for a GoogleSearchEngine.
+
+    Searches run the wrapped engine's own plans (google_plan and
+    duckduckgo_plan), so retries, fallbacks and circuit breakers behave
+    exactly as in the sync engine. Only the steps differ: fetches go
+    through a shared aiohttp connection pool on an AsyncRunner loop and
+    parsing runs in a thread pool so the loop stays responsive. The result
+    cache, headers, cookies and search mode are shared with the wrapped
+    engine.
+
+    Flask's async views still hold a WSGI worker thread each until they
+    return; the loop multiplexes upstream I/O, it does not free workers.
+    """
+
+    def __init__(self, engine, runner=None, connections=200,
+                 connections_per_host=50, parse_workers=4):
+        if aiohttp is None:
+            raise RuntimeError("aiohttp is required for the async search engine; "
+                               "install the 'async' extra")
+        self.engine = engine
+        self.runner = runner or AsyncRunner()
+        self.connections = connections
+        self.connections_per_host = connections_per_host
+        self._parse_executor = ThreadPoolExecutor(max_workers=parse_workers,
+                                                  thread_name_prefix='search-parse')
+        self._session = None
+        self._inflight = {}
+
+    async def search(self, query, num_results=15, retry_count=3, page=1):
+        """Async counterpart of GoogleSearchEngine.search."""
+        return await self.runner.run(self._search(query, num_results, retry_count, page))
+
+    async def search_duckduckgo(self, query, num_results=15):
+        return await self.runner.run(self._search_duckduckgo(query, num_results))
+
+    async def autocomplete(self, q, timeout=5):
+        return await self.runner.run(self._autocomplete(q, timeout))
+
+    async def close(self):
+        if self._session is not None:
+            await self.runner.run(self._session.close())
+            self._session = None
+
+    async def _search(self, query, num_results, retry_count, page=1):
+        if not query or len(query.strip()) < 1:
+            return {'error': 'Query cannot be empty'}
+        query = query.strip()[:500]
+        page = max(1, int(page))
+
+        engine = self.engine
+        if engine.is_paged(num_results, page):
+            # Deep pages fan out over the sync engine's page cache and pool
+            return await asyncio.to_thread(engine.search, query, num_results, retry_count, page)
+        key = engine.cache_key(query, num_results, page)
+
+        cached = engine.cache.get(key)
+        if cached is None:
+            cached = engine.cache.serve_stale(
+                key, engine.computation(query, num_results, retry_count, page))
+        if cached is not None:
+            return engine.degraded_response(query, num_results, page, cached)
+
+        if engine.mode != 'fallback':
+            value = await self._coalesce(
+                key, lambda: self._search_federated(query, num_results, retry_count))
+        else:
+            value = await self._coalesce(
+                key, lambda: self._search_google(query, num_results, retry_count))
+        engine.cache.set(key, engine.remember_first_page(query, num_results, value))
+        return engine.degraded_response(query, num_results, page, value)
+
+    async def _coalesce(self, key, make_coro):
+        """Run make_coro() once for all concurrent callers with the same key."""
+        future = self._inflight.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self.runner.loop.create_future()
+        self._inflight[key] = future
+        try:
+            value = await make_coro()
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else is waiting
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _search_federated(self, query, num_results, retry_count):
+        engine = self.engine
+        backends = {
+            'Google': lambda: self._search_google(query, num_results, retry_count,
+                                                  use_fallback=False),
+            'DuckDuckGo': lambda: self._search_duckduckgo(query, num_results),
+        }
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + engine.latency_budget
+        pending = {}
+        responses = {}
+
+        def start(name):
+            pending[asyncio.ensure_future(backends[name]())] = name
+
+        try:
+            start('Google')
+            if engine.mode == 'hedge':
+                done, _ = await asyncio.wait(pending, timeout=engine.hedge_delay)
+                if not done:
+                    logger.info(f"Google slower than {engine.hedge_delay}s, hedging with DuckDuckGo")
+                    start('DuckDuckGo')
+            else:
+                start('DuckDuckGo')
+
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    logger.warning(f"Latency budget exhausted waiting for {sorted(pending.values())}")
+                    break
+                done, _ = await asyncio.wait(pending, timeout=remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = pending.pop(task)
+                    try:
+                        responses[name] = task.result()
+                    except Exception as e:
+                        logger.error(f"{name} backend failed: {e}")
+                        responses[name] = {'error': f'{name} search failed'}
+                    answer = engine.federated_answer(name, responses[name])
+                    if answer is not None:
+                        return answer
+                if not pending and len(responses) < len(backends):
+                    start('DuckDuckGo')
+        finally:
+            for task in pending:
+                task.cancel()
+
+        return engine.federated_response(query, backends, responses)
+
+    async def _search_google(self, query, num_results, retry_count, use_fallback=None):
+        return await self._run_plan(self.engine.google_plan(query, num_results, retry_count,
+                                                            use_fallback))
+
+    async def _search_duckduckgo(self, query, num_results):
+        return await self._run_plan(self.engine.duckduckgo_plan(query, num_results))
+
+    async def _run_plan(self, plan):
+        """Carry out a search plan's steps on the loop; returns its response.
+
+        The plan is the sync engine's own, so both make the same retry and
+        fallback decisions; only the I/O differs.
+        """
+        reply = error = None
+        while True:
+            try:
+                step = plan.send(reply) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            reply = error = None
+            try:
+                reply = await self._perform(step)
+            except Exception as e:
+                error = e
+
+    async def _perform(self, step):
+        kind = step[0]
+        if kind == FETCH:
+            _, backend, url, headers, cookies = step
+            await self._acquire(backend)
+            started = time.monotonic()
+            try:
+                response = await self._fetch(url, backend, headers=headers, cookies=cookies)
+            except asyncio.TimeoutError as e:
+                raise UpstreamTimeout(str(e) or 'timed out', time.monotonic() - started) from e
+            except aiohttp.ClientError as e:
+                raise UpstreamError(str(e), time.monotonic() - started) from e
+            return response.status_code, response.text, time.monotonic() - started
+        if kind == BACKOFF:
+            await asyncio.sleep(step[1])
+            return False
+        return await self._in_executor(step[1], *step[2:])
+
+    async def _autocomplete(self, q, timeout):
+        return await self._coalesce(('autocomplete', normalize_query(q)),
+                                    lambda: self._fetch_suggestions(q, timeout))
+
+    async def _fetch_suggestions(self, q, timeout):
+        await self._acquire('autocomplete')
+        response = await self._fetch(self.engine.autocomplete_url, 'autocomplete',
+                                     params={'q': q, 'type': 'list'}, read_timeout=timeout)
+        if response.status_code != 200:
+            return []
+        return parse_suggestions(json.loads(response.text))
+
+    async def _acquire(self, backend):
+        """Wait for the engine's scheduler off the loop; raises OutboundBusy."""
+        scheduler = self.engine.scheduler
+        if scheduler.is_limited(backend):
+            await asyncio.to_thread(scheduler.acquire, backend)
+
+    async def _fetch(self, url, backend, headers=None, cookies=None, params=None,
+                     read_timeout=None):
+        connect_timeout, default_read_timeout = self.engine.http.timeout
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                        sock_read=read_timeout or default_read_timeout)
+        session = self._get_session()
+        timings = {}
+        started = time.perf_counter()
+        async with session.get(url, headers=headers, cookies=cookies, params=params,
+                               timeout=timeout, trace_request_ctx=timings) as response:
+            headers_received = time.perf_counter()
+            content = await self._read_body(response)
+        connect = timings.get('connect', 0.0)
+        if connect:
+            observe_stage('connect', backend, connect)
+        observe_stage('ttfb', backend, headers_received - started - connect)
+        observe_stage('body', backend, time.perf_counter() - headers_received)
+        return _Response(response.status, decode_body(content, response.charset))
+
+    async def _read_body(self, response):
+        """Read the body in chunks, giving up past the engine's max_body_bytes."""
+        limit = self.engine.http.max_body_bytes
+        if not limit:
+            return await response.read()
+        chunks = []
+        size = 0
+        async for chunk in response.content.iter_chunked(BODY_CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                response.close()
+                raise aiohttp.ClientPayloadError(f"{response.url}: body is over {limit} bytes")
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self.connections,
+                                             limit_per_host=self.connections_per_host)
+            # Times new connections for the connect stage metric
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_create_start.append(_connection_create_start)
+            trace_config.on_connection_create_end.append(_connection_create_end)
+            # A dummy jar keeps upstream cookies from leaking between users
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  cookie_jar=aiohttp.DummyCookieJar(),
+                                                  trace_configs=[trace_config])
+        return self._session
+
+    def _in_executor(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._parse_executor, func, *args)
@@ -0,0 +1,341 @@
+"""End-to-end load test of /search and /autocomplete against stub upstreams.
+
+Starts benchmarks/stub_upstream.py, then for every combination of
+--workers and --concurrency starts the app with its upstream URLs
+pointed at the stub and drives it with a mix of search and autocomplete
+requests for --duration seconds, after --warm-up seconds whose requests
+are not counted. Queries are drawn from a fixed set with Zipf-like
+popularity (--queries, --zipf), so caches see realistic hit rates;
+autocomplete requests type a prefix of one of them, and 'pages'
+requests ask /search for page 2 to MAX_PAGE of one.
+
+Reports, per endpoint, throughput and p50/p95/p99/max latency, plus the
+requests that reached each stub backend. Each run gets fresh breaker
+state and a fresh shared cache. Outbound rate limits are off unless set
+with --env, since the stub does not need protecting.
+
+The app runs under gunicorn when it is installed (--workers processes
+with --threads threads each) and under `flask run` otherwise, which has
+a single process. --url drives an app that is already running instead.
+The load generator is one Python process, so check its own CPU when
+pushing past a few hundred requests per second.
+
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --workers 1,2,4 --concurrency 8,32 --duration 30
+    python -m benchmarks.load_test --latency google=lognormal:0.4:0.6 --captcha-rate google=0.02
+    python -m benchmarks.load_test --env SEARCH_ASYNC=1 --mix search=1
+    python -m benchmarks.load_test --mix search=0.5,pages=0.5
+"""
+import argparse
+import importlib.util
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import defaultdict
+
+import requests
+
+from benchmarks.stub_upstream import StubUpstream, add_profile_arguments, build_profiles, free_port
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+ENDPOINTS = ('search', 'pages', 'autocomplete')
+MAX_PAGE = 5
+PERCENTILES = (50, 95, 99)
+WORDS = ('python', 'flask', 'weather', 'news', 'recipe', 'football', 'translate', 'maps',
+         'music', 'movies', 'bitcoin', 'jobs', 'hotel', 'train', 'login', 'tutorial',
+         'download', 'price', 'review', 'near me', 'history', 'definition', 'time', 'score')
+
+
+def make_queries(count, seed=0):
+    """count distinct, repeatable queries of one to three words."""
+    rng = random.Random(seed)
+    queries = []
+    seen = set()
+    while len(queries) < count:
+        query = ' '.join(rng.sample(WORDS, rng.randint(1, 3)))
+        if query not in seen:
+            seen.add(query)
+            queries.append(query)
+    return queries
+
+
+def parse_mix(text):
+    """{'search': 0.7, 'autocomplete': 0.3} from 'search=0.7,autocomplete=0.3'."""
+    mix = {}
+    for item in text.split(','):
+        endpoint, _, weight = item.partition('=')
+        if endpoint not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint in --mix: {endpoint}")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class LoadDriver:
+    """Closed-loop load: ``concurrency`` threads each send one request at a time."""
+
+    def __init__(self, base_url, queries, mix, zipf=1.1, timeout=30.0, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.queries = queries
+        self.endpoints = list(mix)
+        self.endpoint_weights = list(itertools.accumulate(mix.values()))
+        self.query_weights = list(itertools.accumulate(
+            1 / rank ** zipf for rank in range(1, len(queries) + 1)))
+        self.timeout = timeout
+        self.seed = seed
+
+    def request_for(self, rng):
+        endpoint = rng.choices(self.endpoints, cum_weights=self.endpoint_weights)[0]
+        query = rng.choices(self.queries, cum_weights=self.query_weights)[0]
+        path, params = endpoint, {'q': query}
+        if endpoint == 'autocomplete':
+            params['q'] = query[:rng.randint(1, len(query))]
+        elif endpoint == 'pages':
+            path = 'search'
+            params['page'] = rng.randint(2, MAX_PAGE)
+        return endpoint, f"{self.base_url}/{path}?{urllib.parse.urlencode(params)}"
+
+    def run(self, concurrency, duration, warm_up=0.0):
+        """Return {endpoint: {'latencies': [...], 'errors': n}} and the measured seconds."""
+        started = time.perf_counter()
+        measure_from = started + warm_up
+        stop_at = measure_from + duration
+        samples = defaultdict(lambda: {'latencies': [], 'errors': 0})
+        lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(self.seed * 1000 + index)
+            session = requests.Session()
+            local = []
+            while True:
+                sent = time.perf_counter()
+                if sent >= stop_at:
+                    break
+                endpoint, url = self.request_for(rng)
+                try:
+                    ok = session.get(url, timeout=self.timeout).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                if sent >= measure_from:
+                    local.append((endpoint, time.perf_counter() - sent, ok))
+            session.close()
+            with lock:
+                for endpoint, latency, ok in local:
+                    samples[endpoint]['latencies'].append(latency)
+                    samples[endpoint]['errors'] += not ok
+
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True)
+                   for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # The last requests may finish after stop_at; count their time too
+        return samples, max(duration, time.perf_counter() - measure_from)
+
+
+def summarize(samples, elapsed):
+    report = {}
+    for endpoint, sample in sorted(samples.items()):
+        latencies = sorted(sample['latencies'])
+        entry = {'requests': len(latencies), 'errors': sample['errors'],
+                 'rps': round(len(latencies) / elapsed, 1)}
+        for p in PERCENTILES:
+            entry[f'p{p}_ms'] = round(percentile(latencies, p) * 1000, 1) if latencies else None
+        entry['max_ms'] = round(latencies[-1] * 1000, 1) if latencies else None
+        report[endpoint] = entry
+    return report
+
+
+class AppServer:
+    """The app in a child process, configured through its environment."""
+
+    def __init__(self, server, workers, threads, env, startup_timeout=30.0):
+        self.port = free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        if server == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+                       '--threads', str(threads), '--bind', f'127.0.0.1:{self.port}',
+                       'main:app']
+        else:
+            command = [sys.executable, '-m', 'flask', '--app', 'main', 'run', '--host',
+                       '127.0.0.1', '--port', str(self.port), '--no-reload', '--with-threads']
+        self.process = subprocess.Popen(command, cwd=ROOT, env=env,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._wait_until_ready(startup_timeout)
+
+    def _wait_until_ready(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError("the app exited during startup")
+            if time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError("the app did not answer in time")
+            try:
+                if requests.get(f'{self.url}/', timeout=1).status_code == 200:
+                    return
+            except requests.RequestException:
+                pass
+            time.sleep(0.05)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def app_env(stub, state_dir, overrides, database_url=None):
+    env = dict(os.environ)
+    env.pop('DATABASE_URL', None)
+    env.update({
+        'LOG_LEVEL': 'WARNING',
+        'SEARCH_RATE_GOOGLE': '0',
+        'SEARCH_RATE_DUCKDUCKGO': '0',
+        'SEARCH_SHARED_CACHE': os.path.join(state_dir, 'search-cache.sqlite3'),
+        'SEARCH_BREAKER_STATE': os.path.join(state_dir, 'search-breakers.json'),
+    })
+    env.update(stub.upstream_config())
+    if database_url:
+        env['DATABASE_URL'] = database_url
+    env.update(overrides)
+    return env
+
+
+def upstream_delta(before, after):
+    delta = {}
+    for backend, outcomes in after.items():
+        for outcome, count in outcomes.items():
+            count -= before.get(backend, {}).get(outcome, 0)
+            if count:
+                delta.setdefault(backend, {})[outcome] = count
+    return delta
+
+
+def run_load_tests(stub, server, workers_list, threads, concurrency_list, duration, warm_up,
+                   queries, mix, zipf, overrides, url=None, database_url=None, seed=0):
+    runs = []
+    for workers, concurrency in itertools.product(workers_list, concurrency_list):
+        app = None
+        state_dir = tempfile.mkdtemp(prefix='load-test-')
+        if url is None:
+            app = AppServer(server, workers, threads,
+                            app_env(stub, state_dir, overrides, database_url))
+        try:
+            before = stub.stats()
+            driver = LoadDriver(url or app.url, queries, mix, zipf=zipf, seed=seed)
+            samples, elapsed = driver.run(concurrency, duration, warm_up)
+            runs.append({'server': 'external' if url else server,
+                         'workers': None if url else workers, 'threads': threads,
+                         'concurrency': concurrency, 'duration': round(elapsed, 2),
+                         'endpoints': summarize(samples, elapsed),
+                         'upstream': upstream_delta(before, stub.stats())})
+        finally:
+            if app is not None:
+                app.stop()
+            shutil.rmtree(state_dir, ignore_errors=True)
+    return runs
+
+
+def print_report(runs):
+    for run in runs:
+        if run['server'] == 'external':
+            print(f"\nexternal app, concurrency {run['concurrency']}, {run['duration']}s")
+        elif run['server'] == 'flask':
+            print(f"\nflask run, concurrency {run['concurrency']}, {run['duration']}s")
+        else:
+            print(f"\n{run['server']}, {run['workers']} worker(s) x {run['threads']} thread(s), "
+                  f"concurrency {run['concurrency']}, {run['duration']}s")
+        print(f"  {'endpoint':<13} {'requests':>8} {'errors':>7} {'req/s':>8} "
+              f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}  (ms)")
+        for endpoint, entry in run['endpoints'].items():
+            times = ' '.join(f"{entry[key] if entry[key] is not None else '-':>8}"
+                             for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms'))
+            print(f"  {endpoint:<13} {entry['requests']:>8} {entry['errors']:>7} "
+                  f"{entry['rps']:>8} {times}")
+        upstream = ', '.join(
+            f"{backend} " + '/'.join(f"{count} {outcome}" for outcome, count in sorted(outcomes.items()))
+            for backend, outcomes in sorted(run['upstream'].items()))
+        print(f"  upstream: {upstream or 'none'}")
+
+
+def int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'flask'), default='auto')
+    parser.add_argument('--workers', type=int_list, default=[1],
+                        help='comma-separated gunicorn worker counts to try')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--concurrency', type=int_list, default=[8],
+                        help='comma-separated numbers of concurrent clients to try')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warm-up', type=float, default=2.0)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('search=0.3,autocomplete=0.7'),
+                        help='request mix, e.g. search=0.3,autocomplete=0.7')
+    parser.add_argument('--queries', type=int, default=500, help='number of distinct queries')
+    parser.add_argument('--zipf', type=float, default=1.1, help='query popularity skew')
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help='app setting for the runs, e.g. SEARCH_CACHE_TTL=0')
+    parser.add_argument('--database-url', help='run the app with this DATABASE_URL')
+    parser.add_argument('--url', help='load test an app that is already running here; '
+                                      'point its upstream URLs at --stub-port yourself')
+    parser.add_argument('--stub-port', type=int, default=0,
+                        help='port of the stub upstream (default: any free port)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = args.server
+    if server == 'auto':
+        server = 'gunicorn' if importlib.util.find_spec('gunicorn') else 'flask'
+    if server == 'flask' and max(args.workers) > 1 and not args.url:
+        print("flask run has a single process; install gunicorn to test several workers",
+              file=sys.stderr)
+        args.workers = [1]
+    overrides = dict(item.split('=', 1) for item in args.env)
+
+    random.seed(args.seed)
+    profiles = build_profiles(args.latency, args.error_rate, args.error_status, args.captcha_rate)
+    stub = StubUpstream(port=args.stub_port, profiles=profiles, fixtures_dir=args.fixtures)
+    stub.start()
+    try:
+        runs = run_load_tests(stub, server, args.workers, args.threads, args.concurrency,
+                              args.duration, args.warm_up, make_queries(args.queries, args.seed),
+                              args.mix, args.zipf, overrides, url=args.url,
+                              database_url=args.database_url, seed=args.seed)
+    finally:
+        stub.stop()
+
+    if args.json:
+        print(json.dumps(runs, indent=2))
+    else:
+        print_report(runs)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""Offline benchmark of the result page parsers.
+
+Runs every stage of Google and DuckDuckGo result extraction against the
+HTML pages in benchmarks/fixtures and reports, per page and stage, the
+best and median wall time and the peak traced memory. Results are
+compared with benchmarks/baseline.json and the run fails when a stage
+got slower or hungrier than the baseline by more than the threshold, or
+when a page yields a different number of results.
+
+Fixture names decide how a page is parsed: google_*.html goes through
+the Google path, duckduckgo*.html through the DuckDuckGo one. The pages
+shipped here are trimmed, deterministic stand-ins for the three layouts;
+--record replaces them with live captures when a network is available.
+
+    python -m benchmarks.parser_bench
+    python -m benchmarks.parser_bench --parser lxml --repeat 50
+    python -m benchmarks.parser_bench --update-baseline
+    python -m benchmarks.parser_bench --record "python tutorial"
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+from search_engine import (DUCKDUCKGO_RESULT_STRAINER, GOOGLE_RESULT_STRAINER,
+                           PARSER_BACKENDS, GoogleSearchEngine)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(HERE, 'fixtures')
+BASELINE_PATH = os.path.join(HERE, 'baseline.json')
+
+DEFAULT_THRESHOLD = 0.5
+# Differences below these are noise, whatever the ratio
+MIN_TIME_DELTA_MS = 0.2
+MIN_MEMORY_DELTA_KB = 64
+
+
+def page_kind(name):
+    if name.startswith('google'):
+        return 'google'
+    if name.startswith('duckduckgo'):
+        return 'duckduckgo'
+    return None
+
+
+def load_fixtures(directory=FIXTURES_DIR):
+    """Return [(name, kind, content bytes)] for every known fixture page."""
+    fixtures = []
+    for filename in sorted(os.listdir(directory)):
+        name, ext = os.path.splitext(filename)
+        if ext != '.html' or page_kind(name) is None:
+            continue
+        with open(os.path.join(directory, filename), 'rb') as f:
+            fixtures.append((name, page_kind(name), f.read()))
+    return fixtures
+
+
+def google_stages(engine, content):
+    """Stage name -> (setup, run) pairs; setup builds run's argument untimed."""
+    parser = engine.parser
+    soup = parser.parse(content)
+    hrefs = [a['href'] for a in soup.find_all('a', href=True)]
+    texts = [s.strip() for s in soup.find_all(string=True) if s.strip()]
+    return {
+        'parse': (lambda: content,
+                  lambda c: parser.parse(c, GOOGLE_RESULT_STRAINER)),
+        'extract_search_results': (lambda: parser.parse(content, GOOGLE_RESULT_STRAINER),
+                                   engine.extract_search_results),
+        'filter_html_content': (lambda: parser.parse(content),
+                                engine.filter_html_content),
+        'clean_url': (lambda: hrefs,
+                      lambda urls: [engine.clean_url(url) for url in urls]),
+        'has_ad_content': (lambda: texts,
+                           lambda strings: [engine.has_ad_content(s) for s in strings]),
+        'total': (lambda: content, engine.google_results_from_page),
+    }
+
+
+def duckduckgo_stages(engine, content):
+    parser = engine.parser
+    soup = parser.parse(content)
+    hrefs = [a['href'] for a in soup.find_all('a', href=True)]
+    texts = [s.strip() for s in soup.find_all(string=True) if s.strip()]
+    return {
+        'parse': (lambda: content,
+                  lambda c: parser.parse(c, DUCKDUCKGO_RESULT_STRAINER)),
+        'clean_url': (lambda: hrefs,
+                      lambda urls: [engine.clean_url(url) for url in urls]),
+        'has_ad_content': (lambda: texts,
+                           lambda strings: [engine.has_ad_content(s) for s in strings]),
+        'total': (lambda: content,
+                  lambda c: engine.duckduckgo_response('benchmark', c)),
+    }
+
+
+def count_results(engine, kind, content):
+    if kind == 'google':
+        return len(engine.google_results_from_page(content))
+    return len(engine.duckduckgo_response('benchmark', content).get('results', []))
+
+
+def measure(setup, run, repeat):
+    """Best and median milliseconds over repeat runs, and peak KiB of one traced run.
+
+    Regressions are judged on the best time, which is far less noisy than
+    the median on a shared machine.
+    """
+    run(setup())  # warm up caches and lazy imports
+    timings = []
+    for _ in range(repeat):
+        arg = setup()
+        # Like timeit, keep the cyclic GC out of the timed section
+        gc.collect()
+        gc.disable()
+        try:
+            started = time.perf_counter()
+            run(arg)
+            timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            gc.enable()
+
+    arg = setup()
+    tracemalloc.start()
+    try:
+        run(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'ms': round(min(timings), 3), 'median_ms': round(statistics.median(timings), 3),
+            'peak_kb': round(peak / 1024, 1)}
+
+
+def _calibration_workload():
+    total = 0
+    for i in range(50000):
+        total += len(str(i).strip().lower())
+    return total
+
+
+def calibrate(repeat=20):
+    """Best time of a fixed pure-Python workload on this machine, in ms.
+
+    Stage times are compared relative to it, so a baseline recorded on
+    one machine (or a slower moment of a shared one) still applies.
+    """
+    return measure(lambda: None, lambda _: _calibration_workload(), repeat)['ms']
+
+
+def run_benchmarks(parser='auto', repeat=30, fixtures=None):
+    engine = GoogleSearchEngine(parser=parser)
+    report = {'parser': repr(engine.parser), 'repeat': repeat, 'pages': {}}
+    calibration = [calibrate()]
+    for name, kind, content in fixtures if fixtures is not None else load_fixtures():
+        stages = (google_stages if kind == 'google' else duckduckgo_stages)(engine, content)
+        report['pages'][name] = {
+            'kind': kind,
+            'bytes': len(content),
+            'results': count_results(engine, kind, content),
+            'stages': {stage: measure(setup, run, repeat)
+                       for stage, (setup, run) in stages.items()},
+        }
+        calibration.append(calibrate())
+    report['calibration_ms'] = min(calibration)
+    return report
+
+
+def relative_speed(report, baseline):
+    """Factor that scales baseline times to the machine speed of report."""
+    if not baseline or not baseline.get('calibration_ms'):
+        return 1.0
+    return report['calibration_ms'] / baseline['calibration_ms']
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return a list of human-readable regressions against baseline."""
+    regressions = []
+    speed = relative_speed(report, baseline)
+    for name, page in report['pages'].items():
+        expected = baseline.get('pages', {}).get(name)
+        if expected is None:
+            continue
+        if page['results'] != expected['results']:
+            regressions.append(f"{name}: {page['results']} results, baseline has "
+                               f"{expected['results']}")
+        for stage, current in page['stages'].items():
+            base = expected['stages'].get(stage)
+            if base is None:
+                continue
+            base_ms = base['ms'] * speed
+            if (current['ms'] > base_ms * (1 + threshold) and
+                    current['ms'] - base_ms > MIN_TIME_DELTA_MS):
+                regressions.append(f"{name}/{stage}: {current['ms']:.3f} ms, baseline "
+                                   f"{base_ms:.3f} ms (scaled)")
+            if (current['peak_kb'] > base['peak_kb'] * (1 + threshold) and
+                    current['peak_kb'] - base['peak_kb'] > MIN_MEMORY_DELTA_KB):
+                regressions.append(f"{name}/{stage}: peak {current['peak_kb']:.1f} KiB, "
+                                   f"baseline {base['peak_kb']:.1f} KiB")
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"parser: {report['parser']}, {report['repeat']} runs per stage, "
+          f"calibration {report['calibration_ms']:.3f} ms")
+    speed = relative_speed(report, baseline)
+    for name, page in report['pages'].items():
+        print(f"\n{name} ({page['kind']}, {page['bytes']} bytes, {page['results']} results)")
+        expected = (baseline or {}).get('pages', {}).get(name, {}).get('stages', {})
+        for stage, current in page['stages'].items():
+            line = (f"  {stage:<24} {current['ms']:>9.3f} ms (median {current['median_ms']:>8.3f})"
+                    f" {current['peak_kb']:>9.1f} KiB")
+            base = expected.get(stage)
+            if base and base['ms']:
+                line += f"   {current['ms'] / (base['ms'] * speed):>5.2f}x time"
+            if base and base['peak_kb']:
+                line += f" {current['peak_kb'] / base['peak_kb']:>5.2f}x memory"
+            print(line)
+
+
+def record_fixtures(query, directory=FIXTURES_DIR):
+    """Capture live Google (normal and gbv=1) and DuckDuckGo pages for query."""
+    engine = GoogleSearchEngine()
+    pages = {
+        'google_normal': (engine.google_url(query, 15), engine.headers, engine.cookies),
+        'google_gbv1': (engine.google_url(query, 15, gbv=True), engine.headers, engine.cookies),
+        'duckduckgo': (engine.duckduckgo_url(query), engine.ddg_headers, None),
+    }
+    for name, (url, headers, cookies) in pages.items():
+        response = engine.http.get(url, headers=headers, cookies=cookies)
+        response.raise_for_status()
+        with open(os.path.join(directory, f'{name}.html'), 'wb') as f:
+            f.write(response.content)
+        print(f"Recorded {name}: {len(response.content)} bytes from {url}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--parser', default='auto', choices=PARSER_BACKENDS)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--threshold', type=float, default=None,
+                        help=f'allowed slowdown ratio (default: baseline value or {DEFAULT_THRESHOLD})')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the new baseline')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    parser.add_argument('--record', metavar='QUERY',
+                        help='refresh the fixtures from the live upstreams (needs network)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.ERROR)
+
+    if args.record:
+        record_fixtures(args.record)
+        return 0
+
+    report = run_benchmarks(parser=args.parser, repeat=args.repeat)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, baseline)
+
+    if args.update_baseline:
+        report['threshold'] = args.threshold or (baseline or {}).get('threshold', DEFAULT_THRESHOLD)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("\nNo baseline to compare against; run with --update-baseline to create one")
+        return 0
+    if baseline.get('parser') != report['parser']:
+        print(f"\nWarning: baseline was recorded with {baseline.get('parser')}")
+
+    threshold = args.threshold or baseline.get('threshold', DEFAULT_THRESHOLD)
+    regressions = compare(report, baseline, threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions over {threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,244 @@
+"""Cold start benchmark for the web app.
+
+Starts fresh processes and reports, as the best and median over the
+runs, how long a worker takes from exec to serving its first request,
+broken down into interpreter start, importing the app, create_app() and
+the first request, plus the worker's resident memory after the first
+request and once the background warm-up has finished. Results are
+compared with benchmarks/startup_baseline.json like parser_bench does.
+
+The default mode runs the app in-process through Flask's test client.
+--gunicorn starts a real gunicorn server instead and measures from
+launch until / answers, and the RSS of its worker.
+
+    python -m benchmarks.startup_bench
+    python -m benchmarks.startup_bench --runs 10 --update-baseline
+    python -m benchmarks.startup_bench --gunicorn
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+BASELINE_PATH = os.path.join(HERE, 'startup_baseline.json')
+
+DEFAULT_THRESHOLD = 0.5
+# Differences below these are noise, whatever the ratio
+MIN_TIME_DELTA_MS = 20
+MIN_MEMORY_DELTA_KB = 2048
+
+# Runs in the child process; prints one JSON line of timings
+CHILD = r"""
+import json, sys, threading, time
+started = time.perf_counter()
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+status = app.test_client().get('/').status_code
+served = time.perf_counter()
+report = {'status': status, 'import_ms': (imported - started) * 1000,
+          'create_app_ms': (created - imported) * 1000,
+          'first_request_ms': (served - created) * 1000,
+          'rss_kb': rss_kb()}
+for thread in threading.enumerate():
+    if thread.name == 'warm-up':
+        thread.join()
+report['warm_up_ms'] = (time.perf_counter() - served) * 1000
+report['warm_rss_kb'] = rss_kb()
+print(json.dumps(report), flush=True)
+"""
+
+
+def child_env(database_url=None):
+    env = dict(os.environ)
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    env.pop('DATABASE_URL', None)
+    if database_url:
+        env['DATABASE_URL'] = database_url
+    return env
+
+
+def run_in_process(database_url=None):
+    """Time one fresh interpreter importing the app and serving /."""
+    launched = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=ROOT, env=child_env(database_url),
+                            capture_output=True, text=True, check=True).stdout
+    total = (time.perf_counter() - launched) * 1000
+    report = json.loads(output.strip().splitlines()[-1])
+    if report.pop('status') != 200:
+        raise RuntimeError("GET / failed in the child process")
+    # Everything before the app import started: interpreter and site startup
+    report['interpreter_ms'] = total - report['warm_up_ms'] - sum(
+        report[k] for k in ('import_ms', 'create_app_ms', 'first_request_ms'))
+    report['time_to_first_request_ms'] = total - report['warm_up_ms']
+    return report
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _rss_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def run_gunicorn(database_url=None, timeout=30):
+    """Time a one-worker gunicorn from launch until / answers."""
+    port = _free_port()
+    url = f'http://127.0.0.1:{port}/'
+    launched = time.perf_counter()
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--workers', '1',
+                               '--bind', f'127.0.0.1:{port}', 'main:app'],
+                              cwd=ROOT, env=child_env(database_url),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            if time.perf_counter() - launched > timeout:
+                raise RuntimeError("gunicorn did not answer in time")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    response.read()
+                break
+            except OSError:
+                time.sleep(0.005)
+        report = {'time_to_first_request_ms': (time.perf_counter() - launched) * 1000}
+        workers = _children(server.pid)
+        report['rss_kb'] = _rss_kb(workers[0]) if workers else None
+        return report
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def run_benchmarks(runs=5, gunicorn=False, database_url=None):
+    run = run_gunicorn if gunicorn else run_in_process
+    samples = [run(database_url=database_url) for _ in range(runs)]
+    metrics = {}
+    for name in samples[0]:
+        values = [sample[name] for sample in samples if sample[name] is not None]
+        if values:
+            metrics[name] = {'best': round(min(values), 1),
+                             'median': round(statistics.median(values), 1)}
+    return {'mode': 'gunicorn' if gunicorn else 'in-process', 'runs': runs,
+            'python': sys.version.split()[0], 'database': bool(database_url),
+            'metrics': metrics}
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """Return a list of human-readable regressions against baseline."""
+    regressions = []
+    if baseline.get('mode') != report['mode'] or baseline.get('database') != report['database']:
+        return regressions
+    for name, current in report['metrics'].items():
+        base = baseline.get('metrics', {}).get(name)
+        if base is None:
+            continue
+        # Memory is stable from run to run, time only at its best
+        key = 'median' if name.endswith('_kb') else 'best'
+        floor = MIN_MEMORY_DELTA_KB if name.endswith('_kb') else MIN_TIME_DELTA_MS
+        if (current[key] > base[key] * (1 + threshold) and
+                current[key] - base[key] > floor):
+            regressions.append(f"{name}: {current[key]:.1f}, baseline {base[key]:.1f}")
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"{report['mode']}, {report['runs']} runs, Python {report['python']}, "
+          f"database {'on' if report['database'] else 'off'}")
+    expected = (baseline or {}).get('metrics', {})
+    for name, current in report['metrics'].items():
+        unit = 'KiB' if name.endswith('_kb') else 'ms'
+        line = f"  {name:<26} {current['best']:>10.1f} {unit:<3} (median {current['median']:>10.1f})"
+        base = expected.get(name)
+        key = 'median' if name.endswith('_kb') else 'best'
+        if base and base[key]:
+            line += f"   {current[key] / base[key]:>5.2f}x"
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--gunicorn', action='store_true',
+                        help='measure a real gunicorn worker instead of the test client')
+    parser.add_argument('--database-url', help='start with this DATABASE_URL set')
+    parser.add_argument('--threshold', type=float, default=None,
+                        help=f'allowed slowdown ratio (default: baseline value or {DEFAULT_THRESHOLD})')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store this run as the new baseline')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(runs=args.runs, gunicorn=args.gunicorn,
+                            database_url=args.database_url)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report, baseline)
+
+    if args.update_baseline:
+        report['threshold'] = args.threshold or (baseline or {}).get('threshold', DEFAULT_THRESHOLD)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+
+    if baseline is None:
+        print("\nNo baseline to compare against; run with --update-baseline to create one")
+        return 0
+
+    threshold = args.threshold or baseline.get('threshold', DEFAULT_THRESHOLD)
+    regressions = compare(report, baseline, threshold)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nNo regressions over {threshold:.0%}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
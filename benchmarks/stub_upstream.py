@@ -0,0 +1,297 @@
+"""Stub Google, DuckDuckGo and autocomplete upstreams for load tests.
+
+Serves the recorded result pages in benchmarks/fixtures (see
+parser_bench --record) in place of the real backends, so the app can be
+load tested without being blocked. Later pages (Google's start=,
+DuckDuckGo's s= from the Next form the stub adds) get the same page with
+every result URL moved to a host of their own, such as p30.example.com,
+so each offset has distinct results; past MAX_RESULTS there are none. Each backend gets its own latency
+distribution, error rate and, for Google, CAPTCHA rate. Point the app at
+it with SEARCH_GOOGLE_URL, SEARCH_DUCKDUCKGO_URL and
+SEARCH_AUTOCOMPLETE_URL; load_test.py does this for you.
+
+    /search    Google (gbv=1 gets the basic HTML page)
+    /html/     DuckDuckGo HTML results
+    /ac/       DuckDuckGo autocomplete
+    /_stats    JSON request counts per backend and outcome
+
+Latency specs are fixed:S, uniform:MIN:MAX, normal:MEAN:SD,
+lognormal:MEDIAN:SIGMA or exponential:MEAN, in seconds.
+
+    python -m benchmarks.stub_upstream --port 8900
+    python -m benchmarks.stub_upstream --latency google=lognormal:0.3:0.5 \\
+        --error-rate duckduckgo=0.05 --captcha-rate google=0.01
+"""
+import argparse
+import html
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(HERE, 'fixtures')
+
+BACKENDS = ('google', 'duckduckgo', 'autocomplete')
+ROUTES = {'/search': 'google', '/html': 'duckduckgo', '/html/': 'duckduckgo',
+          '/ac': 'autocomplete', '/ac/': 'autocomplete'}
+
+CAPTCHA_PAGE = (b'<html><body><form id="captcha-form" action="index" method="post">'
+                b'<div class="g-recaptcha"></div></form></body></html>')
+GOOGLE_NO_MATCH_PAGE = (b'<html><body><div id="topstuff">Your search did not match any '
+                        b'documents.</div></body></html>')
+DUCKDUCKGO_NO_RESULTS_PAGE = b'<html><body><div class="no-results">No results.</div></body></html>'
+DUCKDUCKGO_NEXT_BUTTON = b'<input type="submit" class="btn btn--alt" value="Next">'
+# Results per DuckDuckGo fixture page, and how deep either backend goes
+DUCKDUCKGO_PAGE_SIZE = 15
+MAX_RESULTS = 100
+SUGGESTION_WORDS = ('tutorial', 'download', 'documentation', 'example', 'vs', 'meaning',
+                    'near me', 'price', 'review', 'login')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512  # the app opens many connections at once under load
+
+
+def page_at(page, offset):
+    """page with every result URL moved to its own host for offset."""
+    if not offset:
+        return page
+    host = f'p{offset}.'.encode()
+    return (page.replace(b'https://', b'https://' + host)
+                .replace(b'https%3A%2F%2F', b'https%3A%2F%2F' + host))
+
+
+def duckduckgo_page_at(page, query, offset):
+    """The DuckDuckGo page for offset, with a Next form leading on to the next one."""
+    if offset >= MAX_RESULTS:
+        return DUCKDUCKGO_NO_RESULTS_PAGE
+    page = page_at(page, offset)
+    next_offset = offset + DUCKDUCKGO_PAGE_SIZE
+    if next_offset >= MAX_RESULTS:
+        return page.replace(DUCKDUCKGO_NEXT_BUTTON, b'')
+    fields = (f'<input type="hidden" name="q" value="{html.escape(query)}">'
+              f'<input type="hidden" name="s" value="{next_offset}">').encode()
+    return page.replace(DUCKDUCKGO_NEXT_BUTTON, fields + DUCKDUCKGO_NEXT_BUTTON)
+
+
+def query_offset(query, name):
+    try:
+        return max(0, int(query.get(name, ['0'])[0]))
+    except ValueError:
+        return 0
+
+
+def parse_latency(spec):
+    """Turn a latency spec such as 'lognormal:0.2:0.5' into a sampler."""
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(':')] if params else []
+    samplers = {
+        'fixed': lambda s: lambda: s,
+        'uniform': lambda low, high: lambda: random.uniform(low, high),
+        'normal': lambda mean, sd: lambda: max(0.0, random.gauss(mean, sd)),
+        'lognormal': lambda median, sigma: lambda: random.lognormvariate(math.log(median), sigma),
+        'exponential': lambda mean: lambda: random.expovariate(1 / mean),
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution: {kind}")
+    try:
+        return samplers[kind](*values)
+    except TypeError:
+        raise ValueError(f"Wrong number of parameters in latency spec: {spec}") from None
+
+
+class BackendProfile:
+    """How one stub backend behaves."""
+
+    def __init__(self, latency='fixed:0', error_rate=0.0, error_status=503, captcha_rate=0.0):
+        self.latency_spec = latency
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.captcha_rate = captcha_rate
+
+    def __repr__(self):
+        return (f"BackendProfile({self.latency_spec!r}, error_rate={self.error_rate}, "
+                f"captcha_rate={self.captcha_rate})")
+
+
+class StubUpstream:
+    """The stub server; profiles maps backend names to BackendProfile."""
+
+    def __init__(self, host='127.0.0.1', port=0, profiles=None, fixtures_dir=FIXTURES_DIR):
+        self.profiles = {name: BackendProfile() for name in BACKENDS}
+        self.profiles.update(profiles or {})
+        self.pages = {}
+        for name in ('google_normal', 'google_gbv1', 'duckduckgo'):
+            with open(os.path.join(fixtures_dir, f'{name}.html'), 'rb') as f:
+                self.pages[name] = f.read()
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self.server = _Server((host, port), self._handler())
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def upstream_config(self):
+        """App settings that send every upstream request here."""
+        return {'SEARCH_GOOGLE_URL': f'{self.url}/search',
+                'SEARCH_DUCKDUCKGO_URL': f'{self.url}/html/',
+                'SEARCH_AUTOCOMPLETE_URL': f'{self.url}/ac/'}
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='stub-upstream', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for (backend, outcome), count in self.counts.items():
+                stats.setdefault(backend, {})[outcome] = count
+            return stats
+
+    def respond(self, backend, query):
+        """Return (outcome, status, content type, body) for a request to backend."""
+        profile = self.profiles[backend]
+        time.sleep(profile.latency())
+        if random.random() < profile.error_rate:
+            return 'error', profile.error_status, 'text/plain', b'Service unavailable'
+        if random.random() < profile.captcha_rate:
+            return 'captcha', 429, 'text/html; charset=UTF-8', CAPTCHA_PAGE
+        q = query.get('q', [''])[0]
+        if backend == 'google':
+            offset = query_offset(query, 'start')
+            if offset >= MAX_RESULTS:
+                return 'ok', 200, 'text/html; charset=UTF-8', GOOGLE_NO_MATCH_PAGE
+            page = 'google_gbv1' if query.get('gbv') == ['1'] else 'google_normal'
+            return 'ok', 200, 'text/html; charset=UTF-8', page_at(self.pages[page], offset)
+        if backend == 'duckduckgo':
+            page = duckduckgo_page_at(self.pages['duckduckgo'], q, query_offset(query, 's'))
+            return 'ok', 200, 'text/html; charset=UTF-8', page
+        body = json.dumps([q, [f'{q} {word}' for word in SUGGESTION_WORDS[:8]]]).encode()
+        return 'ok', 200, 'application/json', body
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like the real upstreams
+
+            def do_GET(self):
+                parsed = urllib.parse.urlsplit(self.path)
+                if parsed.path == '/_stats':
+                    self._send(200, 'application/json', json.dumps(stub.stats()).encode())
+                    return
+                backend = ROUTES.get(parsed.path)
+                if backend is None:
+                    self._send(404, 'text/plain', b'Not found')
+                    return
+                outcome, status, content_type, body = stub.respond(
+                    backend, urllib.parse.parse_qs(parsed.query))
+                with stub._lock:
+                    stub.counts[(backend, outcome)] += 1
+                self._send(status, content_type, body)
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_assignments(values, convert):
+    """{'google': value} from ['google=value', 'all=value', ...]."""
+    settings = {}
+    for item in values or ():
+        backend, sep, value = item.partition('=')
+        if not sep or backend not in BACKENDS + ('all',):
+            raise ValueError(f"Expected BACKEND=VALUE with BACKEND one of {BACKENDS}: {item}")
+        for name in (BACKENDS if backend == 'all' else (backend,)):
+            settings[name] = convert(value)
+    return settings
+
+
+def build_profiles(latency=None, error_rate=None, error_status=None, captcha_rate=None):
+    """BackendProfiles from the command line style lists of BACKEND=VALUE."""
+    options = {
+        'latency': parse_assignments(latency, str),
+        'error_rate': parse_assignments(error_rate, float),
+        'error_status': parse_assignments(error_status, int),
+        'captcha_rate': parse_assignments(captcha_rate, float),
+    }
+    for name, spec in options['latency'].items():
+        parse_latency(spec)  # fail early on a bad spec
+    return {name: BackendProfile(**{option: values[name] for option, values in options.items()
+                                    if name in values})
+            for name in BACKENDS}
+
+
+def add_profile_arguments(parser):
+    parser.add_argument('--latency', action='append', metavar='BACKEND=SPEC',
+                        help='latency distribution of a backend (or all)')
+    parser.add_argument('--error-rate', action='append', metavar='BACKEND=P',
+                        help='fraction of requests answered with an error status')
+    parser.add_argument('--error-status', action='append', metavar='BACKEND=CODE',
+                        help='status of injected errors (default 503)')
+    parser.add_argument('--captcha-rate', action='append', metavar='BACKEND=P',
+                        help='fraction of requests answered with a CAPTCHA page')
+    parser.add_argument('--fixtures', default=FIXTURES_DIR,
+                        help='directory with google_normal, google_gbv1 and duckduckgo pages')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--seed', type=int, help='seed for latency and error sampling')
+    add_profile_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    profiles = build_profiles(args.latency, args.error_rate, args.error_status, args.captcha_rate)
+    stub = StubUpstream(args.host, args.port, profiles, fixtures_dir=args.fixtures)
+    for name, profile in profiles.items():
+        print(f"{name:<13} {profile}")
+    for name, value in stub.upstream_config().items():
+        print(f"{name}={value}")
+    sys.stdout.flush()
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,497 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from results import json_default, json_object_hook
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Normalize a query for use in cache keys (case and whitespace insensitive)."""
+    return ' '.join((query or '').lower().split())
+
+
+def estimate_size(value):
+    """Rough byte size of a result dict, used for the byte-size bound."""
+    try:
+        return len(json.dumps(value, default=json_default))
+    except (TypeError, ValueError):
+        return len(repr(value))
+
+
+class _Flight:
+    """An in-progress computation that concurrent callers can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SharedStore:
+    """Cache tier in a SQLite file shared by every process on the host.
+
+    Entries outlive the process, so a restarted or newly started worker
+    finds the results its predecessors fetched. Values are stored as
+    zlib-compressed JSON under a ``namespace`` so several caches can share
+    one file. Expiry uses the wall clock, which all processes agree on.
+
+    The file is opened in WAL mode, so readers never block the writer.
+    Every ``prune_interval`` writes, expired entries are deleted and, when
+    the namespace is over ``max_bytes``, the entries closest to expiry
+    go first. Database errors are logged and treated as misses; the
+    shared tier must never fail a search.
+    """
+
+    def __init__(self, path, namespace='default', max_bytes=256 * 1024 * 1024,
+                 prune_interval=200):
+        self.path = path
+        self.namespace = namespace
+        self.max_bytes = max_bytes
+        self.prune_interval = prune_interval
+        self._local = threading.local()
+        self._writes = 0
+
+        self.reads = 0
+        self.hits = 0
+        self.writes = 0
+        self.evictions = 0
+        self.errors = 0
+
+        connection = self._connection()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache_entries ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL NOT NULL,"
+            " size INTEGER NOT NULL, value BLOB NOT NULL,"
+            " PRIMARY KEY (namespace, key)) WITHOUT ROWID")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_entries_expiry"
+            " ON cache_entries (namespace, expires_at)")
+
+    def _connection(self):
+        # One connection per thread, and a fresh one after a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    @staticmethod
+    def encode_key(key):
+        return json.dumps(key, separators=(',', ':'), ensure_ascii=False, default=str)
+
+    @staticmethod
+    def dumps(value):
+        data = json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=json_default)
+        return zlib.compress(data.encode('utf-8'))
+
+    @staticmethod
+    def loads(blob):
+        return json.loads(zlib.decompress(blob).decode('utf-8'), object_hook=json_object_hook)
+
+    def get(self, key):
+        """Return (value, seconds left) for key, or None if missing or expired."""
+        self.reads += 1
+        try:
+            row = self._connection().execute(
+                "SELECT expires_at, value FROM cache_entries"
+                " WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, self.encode_key(key), time.time())).fetchone()
+            if row is None:
+                return None
+            value = self.loads(row[1])
+        except (sqlite3.Error, ValueError, zlib.error) as e:
+            self.errors += 1
+            logger.warning(f"Shared cache read failed: {e}")
+            return None
+        self.hits += 1
+        return value, row[0] - time.time()
+
+    def set(self, key, value, ttl):
+        blob = self.dumps(value)
+        if len(blob) > self.max_bytes:
+            return
+        try:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, expires_at, size, value)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, self.encode_key(key), time.time() + ttl, len(blob), blob))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Shared cache write failed: {e}")
+            return
+        self.writes += 1
+        self._writes += 1
+        if self._writes >= self.prune_interval:
+            self._writes = 0
+            self.prune()
+
+    def delete(self, key):
+        try:
+            self._connection().execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, self.encode_key(key)))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Shared cache delete failed: {e}")
+
+    def clear(self):
+        try:
+            self._connection().execute("DELETE FROM cache_entries WHERE namespace = ?",
+                                       (self.namespace,))
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Shared cache clear failed: {e}")
+
+    def prune(self):
+        """Delete expired entries, then the soonest-expiring ones over max_bytes."""
+        connection = self._connection()
+        try:
+            connection.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?",
+                               (self.namespace, time.time()))
+            total = connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                (self.namespace,)).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # Free a little more than needed so the next writes don't prune again
+            excess = total - int(self.max_bytes * 0.9)
+            doomed = []
+            for key, size in connection.execute(
+                    "SELECT key, size FROM cache_entries WHERE namespace = ?"
+                    " ORDER BY expires_at", (self.namespace,)):
+                doomed.append((self.namespace, key))
+                excess -= size
+                if excess <= 0:
+                    break
+            connection.executemany("DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                                   doomed)
+            self.evictions += len(doomed)
+        except sqlite3.Error as e:
+            self.errors += 1
+            logger.warning(f"Shared cache prune failed: {e}")
+
+    def stats(self):
+        stats = {'reads': self.reads, 'hits': self.hits, 'writes': self.writes,
+                 'evictions': self.evictions, 'errors': self.errors}
+        try:
+            entries, size = self._connection().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries WHERE namespace = ?",
+                (self.namespace,)).fetchone()
+            stats.update(entries=entries, bytes=size)
+        except sqlite3.Error as e:
+            logger.warning(f"Shared cache stats failed: {e}")
+        return stats
+
+
+def open_shared_store(path, namespace, max_bytes=256 * 1024 * 1024):
+    """SharedStore at path, or None when path is empty or unusable."""
+    if not path:
+        return None
+    try:
+        return SharedStore(path, namespace, max_bytes=max_bytes)
+    except sqlite3.Error as e:
+        logger.warning(f"Shared cache {path} unavailable, caching per process: {e}")
+        return None
+
+
+class ResultCache:
+    """Thread-safe TTL/LRU cache with request coalescing.
+
+    Entries are evicted least-recently-used first once either the entry
+    count or the total estimated byte size goes over its bound. Values
+    that contain an 'error' key are cached for ``negative_ttl`` seconds
+    only, so a failing upstream is not hammered but recovers quickly.
+    Errors marked 'transient' (a request we chose not to send, such as
+    one refused by the rate limiter) are not cached at all.
+
+    With a ``store`` (a SharedStore), successful values are also written
+    there, and local misses are looked up there before computing. peek()
+    stays local, so it never touches the disk.
+
+    With ``stale_ttl`` and ``revalidate``, get_or_compute() keeps
+    answering with an expired value for up to stale_ttl seconds while
+    revalidate(refresh) recomputes it in the background
+    (stale-while-revalidate). revalidate returns False when it cannot
+    take the work, and the caller is then served stale anyway.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024,
+                 ttl=300, negative_ttl=15, store=None, stale_ttl=0, revalidate=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+        self.stale_ttl = stale_ttl
+        self.revalidate = revalidate
+
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._flights = {}
+        self._queued = set()  # keys with a refresh queued by serve_stale
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+        self.stale_hits = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None if missing or expired."""
+        with self._lock:
+            value = self._get_locked(key)
+        if value is None and self.store is not None:
+            value = self._load_shared(key)
+        return value
+
+    def peek(self, key):
+        """Like get, but without touching the counters or the LRU order."""
+        with self._lock:
+            return self._peek_locked(key)
+
+    def ttl_left(self, key):
+        """Seconds until key expires, or None if it is not cached at all.
+
+        A later expiry in the shared store, where another process has
+        refreshed the entry, is copied into this cache.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            left = entry[0] - time.monotonic() if entry is not None else None
+        if self.store is not None:
+            shared = self.store.get(key)
+            if shared is not None and (left is None or shared[1] > left + 1):
+                self._set_local(key, *shared)
+                left = shared[1]
+        return left
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting old entries if needed."""
+        if ttl is None:
+            if self._is_error(value):
+                ttl = 0 if value.get('transient') else self.negative_ttl
+            else:
+                ttl = self.ttl
+        if ttl <= 0:
+            return
+        self._set_local(key, value, ttl)
+        if self.store is not None and not self._is_error(value):
+            self.store.set(key, value, ttl)
+
+    def _set_local(self, key, value, ttl):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            logger.debug(f"Not caching oversized entry ({size} bytes)")
+            return
+        with self._lock:
+            self._pop_locked(key)
+            self._entries[key] = (time.monotonic() + ttl, size, value)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or
+                                     self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._pop_locked(oldest)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """Return the cached value for key, computing it at most once.
+
+        Concurrent callers asking for the same missing key share a single
+        call to ``compute``; the others block until it finishes. A stale
+        value is returned straight away when stale-while-revalidate is on.
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not None:
+                return value
+        stale = self.serve_stale(key, compute, ttl)
+        if stale is not None:
+            return stale
+
+        with self._lock:
+            # Filled by another caller since the first look
+            value = self._peek_locked(key)
+            if value is not None:
+                return value
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        return self._fill(key, compute, ttl, flight)
+
+    def serve_stale(self, key, compute, ttl=None):
+        """Return the stale value of key and queue a background refresh, or None.
+
+        Each key is queued at most once. The refresh only becomes a flight
+        that get_or_compute() callers wait on when it starts running, so
+        nobody is held up behind a backlog of queued refreshes; it is
+        skipped if a caller has filled or is filling the key by then.
+        For callers that fill the cache themselves, get_or_compute() does
+        this already.
+        """
+        if self.revalidate is None or self.stale_ttl <= 0:
+            return None
+        with self._lock:
+            stale = self._stale_locked(key)
+            if stale is None:
+                return None
+            self.stale_hits += 1
+            queue = key not in self._flights and key not in self._queued
+            if queue:
+                self._queued.add(key)
+
+        if queue:
+            try:
+                scheduled = self.revalidate(lambda: self._run_queued(key, compute, ttl))
+            except Exception as e:
+                logger.warning(f"Could not schedule a cache refresh: {e}")
+                scheduled = False
+            if not scheduled:
+                with self._lock:
+                    self._queued.discard(key)
+        return stale
+
+    def _run_queued(self, key, compute, ttl):
+        """Run a refresh queued by serve_stale, unless it is no longer needed."""
+        with self._lock:
+            self._queued.discard(key)
+            if key in self._flights or self._peek_locked(key) is not None:
+                return None
+            flight = self._flights[key] = _Flight()
+        return self._fill(key, compute, ttl, flight, keep_on_error=True)
+
+    def refresh(self, key, compute, ttl=None):
+        """Recompute key now, unless another caller already is.
+
+        Returns the new value, or None when a computation for key was
+        already under way. An error result never replaces a cached value.
+        """
+        with self._lock:
+            if key in self._flights:
+                return None
+            flight = self._flights[key] = _Flight()
+        return self._fill(key, compute, ttl, flight, shared=False, keep_on_error=True)
+
+    def _fill(self, key, compute, ttl, flight, shared=True, keep_on_error=False):
+        """Compute key as the leader of flight and store the result."""
+        try:
+            value = self._load_shared(key) if shared and self.store is not None else None
+            if value is None:
+                value = compute()
+                if not (keep_on_error and self._is_error(value)):
+                    self.set(key, value, ttl=ttl)
+            flight.value = value
+            return value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            self._land(key, flight)
+
+    def _land(self, key, flight):
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.event.set()
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop_locked(key)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.store is not None:
+            self.store.clear()
+
+    def stats(self):
+        """Return a snapshot of the cache counters."""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'coalesced': self.coalesced,
+                'shared_hits': self.shared_hits,
+                'stale_hits': self.stale_hits,
+                'refreshes_queued': len(self._queued),
+            }
+
+    def _load_shared(self, key):
+        """Copy key from the shared store into this cache; return it or None."""
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        value, ttl = entry
+        self._set_local(key, value, ttl)
+        with self._lock:
+            self.shared_hits += 1
+        return value
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, _, value = entry
+        if expires_at <= time.monotonic():
+            # Expired entries stay around for stale_ttl to be served stale
+            if expires_at + self.stale_ttl <= time.monotonic() or self._is_error(value):
+                self._pop_locked(key)
+                self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def _peek_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[2]
+
+    def _stale_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None or self._is_error(entry[2]):
+            return None
+        now = time.monotonic()
+        if entry[0] <= now < entry[0] + self.stale_ttl:
+            return entry[2]
+        return None
+
+    def _pop_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    @staticmethod
+    def _is_error(value):
+        return isinstance(value, dict) and 'error' in value
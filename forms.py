@@ -20,6 +20,11 @@ class UserDataForm(FlaskForm):
 class SearchResultsForm(FlaskForm):
     """Form for search input on search results page."""
     
+    class Meta:
+        # A GET form: a CSRF token would only end up in the URL, and a
+        # per-session token would make every results page unique
+        csrf = False
+    
     q = StringField(
         'Search',
         render_kw={
@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import BACKEND_CALLS
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class MemoryBreakerStore:
+    """Circuit breaker state for a single process."""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def read(self, name):
+        return dict(self._states.get(name, {}))
+
+    def update(self, name, change):
+        """Apply change(state) atomically and return its result."""
+        with self._lock:
+            state = self._states.setdefault(name, {})
+            return change(state)
+
+
+class FileBreakerStore:
+    """Circuit breaker state in a JSON file shared by all worker processes.
+
+    Updates take an exclusive flock on a side lock file and replace the
+    state file atomically, so readers never need the lock. Reads are
+    cached until the file is replaced, which keeps the per-request check
+    down to a stat call.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError("fcntl is required for the shared breaker store")
+        self.path = path
+        self._lock_path = f"{path}.lock"
+        self._lock = threading.Lock()
+        self._cached_key = None
+        self._cached = {}
+
+    def read(self, name):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return {}
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self._cached_key:
+            self._cached = self._load()
+            self._cached_key = key
+        return dict(self._cached.get(name, {}))
+
+    def update(self, name, change):
+        """Apply change(state) atomically across processes and return its result."""
+        with self._lock, open(self._lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            states = self._load()
+            state = states.setdefault(name, {})
+            before = dict(state)
+            result = change(state)
+            if state != before:
+                tmp_path = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(states, f)
+                os.replace(tmp_path, self.path)
+            return result
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            logger.warning(f"Ignoring unreadable breaker state {self.path}: {e}")
+            return {}
+
+
+class CircuitBreaker:
+    """Closed/open/half-open circuit breaker over a shared state store.
+
+    The breaker opens after ``failure_threshold`` consecutive failures, or
+    at once for failures that are certain to repeat (a CAPTCHA page). While
+    open, calls are refused until ``reset_timeout`` has passed; then a
+    single probe call is let through. A successful probe closes the
+    breaker, a failed one reopens it for twice as long, up to
+    ``max_reset_timeout``. A probe that never reports back (its worker
+    died) expires after ``probe_timeout`` and the next caller probes.
+    """
+
+    def __init__(self, name, store=None, failure_threshold=5, reset_timeout=30.0,
+                 max_reset_timeout=600.0, probe_timeout=15.0):
+        self.name = name
+        self.store = store if store is not None else MemoryBreakerStore()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe_timeout = probe_timeout
+
+    @property
+    def state(self):
+        return self.store.read(self.name).get('state', CLOSED)
+
+    def allow(self):
+        """Return True if a call may go through now."""
+        now = time.time()
+        state = self.store.read(self.name)
+        if state.get('state', CLOSED) == CLOSED:
+            return True
+        if state['state'] == OPEN and now < state['retry_at']:
+            return False
+        if state['state'] == HALF_OPEN and now < state['probe_until']:
+            return False
+
+        def take_probe(state):
+            if state.get('state', CLOSED) == CLOSED:
+                return True
+            if state['state'] == OPEN and now < state['retry_at']:
+                return False
+            if state['state'] == HALF_OPEN and now < state['probe_until']:
+                return False
+            if state['state'] == OPEN:
+                logger.info(f"Circuit {self.name} half-open, probing")
+            state['state'] = HALF_OPEN
+            state['probe_until'] = now + self.probe_timeout
+            return True
+
+        return self.store.update(self.name, take_probe)
+
+    def record_success(self):
+        state = self.store.read(self.name)
+        if state.get('state', CLOSED) == CLOSED and not state.get('failures'):
+            return
+
+        def close(state):
+            if state.get('state', CLOSED) != CLOSED:
+                logger.info(f"Circuit {self.name} closed")
+            state.clear()
+            state['state'] = CLOSED
+
+        self.store.update(self.name, close)
+
+    def record_failure(self, trip=False):
+        """Count a failure; trip=True opens the breaker straight away."""
+        now = time.time()
+
+        def fail(state):
+            current = state.get('state', CLOSED)
+            if current == OPEN:
+                return
+            if current == HALF_OPEN:
+                timeout = min(state.get('timeout', self.reset_timeout) * 2, self.max_reset_timeout)
+            else:
+                state['failures'] = state.get('failures', 0) + 1
+                if not trip and state['failures'] < self.failure_threshold:
+                    return
+                timeout = self.reset_timeout
+            logger.warning(f"Circuit {self.name} open for {timeout:.0f}s")
+            state.update(state=OPEN, timeout=timeout, retry_at=now + timeout, failures=0)
+            state.pop('probe_until', None)
+
+        self.store.update(self.name, fail)
+
+
+class BackendHealth:
+    """Health counters for one upstream backend, plus its circuit breaker.
+
+    Counters and latencies are kept per process over the last ``window``
+    calls; the breaker state is whatever its store shares.
+    """
+
+    def __init__(self, name, breaker, window=500):
+        self.name = name
+        self.breaker = breaker
+        self._outcomes = deque(maxlen=window)  # True for failures
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.failures = 0
+        self.captchas = 0
+        self.rejected = 0
+
+    def allow(self):
+        if self.breaker.allow():
+            return True
+        self.rejected += 1
+        BACKEND_CALLS.inc(backend=self.name, outcome='rejected')
+        return False
+
+    def record_success(self, latency=None):
+        with self._lock:
+            self.requests += 1
+            self._outcomes.append(False)
+            if latency is not None:
+                self._latencies.append(latency)
+        BACKEND_CALLS.inc(backend=self.name, outcome='success')
+        self.breaker.record_success()
+
+    def record_failure(self, latency=None, captcha=False, trip=False):
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self._outcomes.append(True)
+            if captcha:
+                self.captchas += 1
+            if latency is not None:
+                self._latencies.append(latency)
+        BACKEND_CALLS.inc(backend=self.name, outcome='captcha' if captcha else 'failure')
+        self.breaker.record_failure(trip=trip or captcha)
+
+    def stats(self):
+        with self._lock:
+            outcomes = list(self._outcomes)
+            latencies = sorted(self._latencies)
+        stats = {
+            'state': self.breaker.state,
+            'requests': self.requests,
+            'failures': self.failures,
+            'captchas': self.captchas,
+            'rejected': self.rejected,
+            'error_rate': round(sum(outcomes) / len(outcomes), 3) if outcomes else 0.0,
+        }
+        for label, q in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+            value = None
+            if latencies:
+                value = round(latencies[min(int(q * len(latencies)), len(latencies) - 1)], 3)
+            stats[f'latency_{label}'] = value
+        return stats
+
+
+class HealthMonitor:
+    """BackendHealth for every backend, created on first use.
+
+    With ``state_path`` the breakers of all processes using that path are
+    shared, so a block one worker sees stops the others from hitting it.
+    """
+
+    def __init__(self, state_path=None, window=500, **breaker_options):
+        self.store = MemoryBreakerStore()
+        if state_path:
+            try:
+                self.store = FileBreakerStore(state_path)
+            except RuntimeError as e:
+                logger.warning(f"Breaker state not shared between processes: {e}")
+        self.window = window
+        self.breaker_options = breaker_options
+        self._backends = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        backend = self._backends.get(name)
+        if backend is None:
+            with self._lock:
+                backend = self._backends.get(name)
+                if backend is None:
+                    breaker = CircuitBreaker(name, self.store, **self.breaker_options)
+                    backend = self._backends[name] = BackendHealth(name, breaker, self.window)
+        return backend
+
+    def stats(self):
+        return {name: backend.stats() for name, backend in sorted(self._backends.items())}
@@ -0,0 +1,230 @@
+import logging
+import threading
+import time
+import urllib.parse
+from http.cookiejar import DefaultCookiePolicy
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# Time this thread spent opening connections (TCP and TLS) during a request
+_connect_time = threading.local()
+
+BODY_CHUNK_SIZE = 64 * 1024
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """An upstream body was bigger than the client's max_body_bytes."""
+
+
+def charset_of(content_type):
+    """The charset parameter of a Content-Type header, or None."""
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset':
+            return value.strip('"\' ') or None
+    return None
+
+
+def decode_body(content, charset=None):
+    """Decode a body once: its declared charset, else UTF-8, replacing bad bytes.
+
+    Unlike requests' Response.text this never runs charset detection over
+    the whole body, and the result is meant to be kept and reused.
+    """
+    try:
+        return str(content, charset or 'utf-8', errors='replace')
+    except LookupError:
+        return str(content, 'utf-8', errors='replace')
+
+
+class _TimedConnectionMixin:
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            super().connect()
+        finally:
+            _connect_time.seconds = (getattr(_connect_time, 'seconds', 0.0) +
+                                     time.perf_counter() - started)
+
+
+class _TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record how long connecting took."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class HttpClient:
+    """Shared keep-alive HTTP sessions with one connection pool per host.
+
+    Each upstream host gets its own ``requests.Session`` so connections
+    (and their TLS handshakes) are reused across requests and threads.
+    Sessions never store cookies from responses, which keeps them safe
+    to share between concurrent users; pass per-request cookies instead.
+    Compressed bodies are decoded transparently by urllib3.
+
+    Every fetch is timed into the search_stage_seconds metric as connect
+    (only when a new connection was opened), ttfb and body stages.
+
+    Bodies are streamed in, and a body over ``max_body_bytes`` (after
+    decompression) is abandoned with ResponseTooLarge as soon as it goes
+    over, so one oversized page cannot balloon a worker's memory.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=20,
+                 connect_timeout=3.05, read_timeout=10, max_retries=0,
+                 max_body_bytes=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.max_body_bytes = max_body_bytes
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, url):
+        """Return the pooled session for the scheme and host of url."""
+        parsed = urllib.parse.urlsplit(url)
+        host = f"{parsed.scheme}://{parsed.netloc}"
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._new_session()
+                self._sessions[host] = session
+                logger.debug(f"Created HTTP pool for {host}")
+            return session
+
+    def get(self, url, backend=None, max_bytes=None, **kwargs):
+        """GET url through the pooled session for its host.
+
+        backend labels the timing metrics; it defaults to the host name.
+        max_bytes overrides the client's max_body_bytes.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs.pop('stream', None)
+        if backend is None:
+            backend = urllib.parse.urlsplit(url).hostname or 'unknown'
+        if max_bytes is None:
+            max_bytes = self.max_body_bytes
+        _connect_time.seconds = 0.0
+        started = time.perf_counter()
+        response = self.session_for(url).get(url, stream=True, **kwargs)
+        headers_received = time.perf_counter()
+        if max_bytes:
+            self._read_body(response, max_bytes)
+        else:
+            response.content  # read the whole body, as a non-streaming get would
+        connect = _connect_time.seconds
+        if connect:
+            observe_stage('connect', backend, connect)
+        observe_stage('ttfb', backend, headers_received - started - connect)
+        observe_stage('body', backend, time.perf_counter() - headers_received)
+        return response
+
+    def get_text(self, url, backend=None, **kwargs):
+        """GET url and return (status code, body decoded once as text).
+
+        The raw body is dropped as soon as it is decoded, so the caller
+        holds a single copy of the page.
+        """
+        response = self.get(url, backend=backend, **kwargs)
+        return response.status_code, decode_body(
+            response.content, charset_of(response.headers.get('Content-Type')))
+
+    @staticmethod
+    def _read_body(response, limit):
+        """Read the body into response.content, giving up past limit bytes."""
+        length = response.headers.get('Content-Length', '')
+        # Content-Length counts compressed bytes, so only an uncompressed
+        # length can be refused before reading
+        if (length.isdigit() and int(length) > limit and
+                not response.headers.get('Content-Encoding')):
+            response.close()
+            raise ResponseTooLarge(f"{response.url}: {length} byte body is over {limit} bytes")
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(BODY_CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                response.close()
+                raise ResponseTooLarge(f"{response.url}: body is over {limit} bytes")
+            chunks.append(chunk)
+        response._content = b''.join(chunks)
+        response._content_consumed = True
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _new_session(self):
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+        adapter = _TimedHTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize,
+                              max_retries=self.max_retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_http_client():
+    """Return the process-wide shared HttpClient."""
+    global _default_client
+    if _default_client is None:
+        with _default_lock:
+            if _default_client is None:
+                _default_client = HttpClient()
+    return _default_client
+
+
+def configure_http_client(**kwargs):
+    """Replace the process-wide HttpClient with one built from kwargs."""
+    global _default_client
+    with _default_lock:
+        if _default_client is not None:
+            _default_client.close()
+        _default_client = HttpClient(**kwargs)
+    return _default_client
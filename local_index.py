@@ -0,0 +1,366 @@
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from operator import itemgetter
+
+from results import SearchResult
+from search_engine import canonical_url
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# A term counts this many times per occurrence in each field
+FIELD_WEIGHTS = (('title', 3), ('url', 2), ('description', 1))
+
+TOKEN_PATTERN = re.compile(r'[^\W_]+')
+MAX_TOKEN_LENGTH = 40
+# URL parts that say nothing about a page
+URL_NOISE = frozenset(('http', 'https', 'www', 'com', 'org', 'net', 'html', 'htm', 'php'))
+
+# Postings pack (doc id << TF_BITS | term frequency) into one unsigned int
+TF_BITS = 4
+TF_MAX = (1 << TF_BITS) - 1
+MAX_DOC_ID = (1 << (32 - TF_BITS)) - 1
+
+# A full index forgets this fraction of its documents, oldest first
+EVICT_FRACTION = 0.1
+# The file is cut back to the newest max_docs lines once it holds this
+# many times as much
+COMPACT_FACTOR = 2
+LINE_BYTES_GUESS = 300
+
+READ_BATCH_BYTES = 256 * 1024
+
+
+def tokenize(text):
+    """Lower-cased words of text, as the index stores them."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower())
+            if 1 < len(token) <= MAX_TOKEN_LENGTH]
+
+
+def url_tokens(url):
+    return [token for token in tokenize(url) if token not in URL_NOISE]
+
+
+class LocalIndex:
+    """BM25 inverted index over search results already fetched upstream.
+
+    Titles, URLs and descriptions are tokenized into weighted term counts
+    (FIELD_WEIGHTS). Each term's postings are one array of unsigned ints
+    in document order, so an indexed result costs a few bytes per term
+    plus the SearchResult itself. Documents are only ever appended and a
+    URL already indexed is skipped. Once ``max_docs`` are indexed, the
+    oldest tenth (EVICT_FRACTION) are forgotten: documents, lengths and
+    the head of every postings array go, so the index keeps following
+    what is searched now.
+
+    A search scans at most the ``max_scan`` newest postings of each term.
+    Older documents of a very common term only count when a rarer query
+    term found them, which keeps the search to a few milliseconds.
+
+    With a ``path`` every new document is also appended to that file as a
+    JSON line. The file is replayed by load() and read on from where it
+    was left whenever it grows, so all workers on the host answer from the
+    same documents and the index survives restarts. Appends take an
+    exclusive flock on a side lock file; readers need no lock and leave a
+    line that is still being written for next time. Once the file is
+    COMPACT_FACTOR times the size of max_docs lines, the appending worker
+    rewrites it to the newest max_docs lines. Readers notice the new file
+    and read it again from the start, skipping the documents they have.
+    """
+
+    def __init__(self, path=None, max_docs=50000, k1=1.2, b=0.75, max_scan=5000):
+        self.path = path or None
+        self.max_docs = min(max_docs, MAX_DOC_ID // 2)
+        self.k1 = k1
+        self.b = b
+        self.max_scan = max_scan
+        self._lock_path = f"{self.path}.lock" if self.path else None
+        self._base = 0             # doc id of the oldest document
+        self._docs = []            # doc id - base -> SearchResult
+        self._lengths = array('H')  # doc id - base -> weighted term count
+        self._total_length = 0
+        self._norms = array('f')    # doc id - base -> BM25 length normalization
+        self._norm_average = None   # average length the norms were built for
+        self._postings = {}        # term -> array('I')
+        self._seen = set()         # hashes of canonical URLs
+        self._inode = None         # the file being read; compaction replaces it
+        self._offset = 0           # bytes of the file already indexed
+        self._line_bytes = LINE_BYTES_GUESS  # average line length seen
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()    # reading the file and _offset
+        self._append_lock = threading.Lock()
+
+        self.added = 0
+        self.duplicates = 0
+        self.evicted = 0
+        self.compactions = 0
+        self.searches = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, results):
+        """Index results (SearchResults or result dicts); returns how many were new."""
+        docs = [result if isinstance(result, SearchResult) else
+                SearchResult(result['title'], result['url'], result.get('description', ''))
+                for result in results]
+        self.catch_up()  # so results other workers already added are skipped
+        with self._lock:
+            added = self._add_locked(docs)
+        if added and self.path is not None:
+            self._append(added)
+        return len(added)
+
+    def catch_up(self, wait=False):
+        """Index what other workers appended to the file; returns how many were new.
+
+        Unless wait is set, this returns straight away while another
+        thread is reading the file, such as load() at startup.
+        """
+        if self.path is None:
+            return 0
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return 0
+        if stat.st_ino == self._inode and stat.st_size <= self._offset:
+            return 0
+        if not self._file_lock.acquire(blocking=wait):
+            return 0
+        try:
+            return self._read_new()
+        except OSError as e:
+            logger.warning(f"Could not read local index {self.path}: {e}")
+            return 0
+        finally:
+            self._file_lock.release()
+
+    def load(self):
+        """Replay the whole file, in batches so searches can run meanwhile."""
+        added = self.catch_up(wait=True)
+        if added:
+            logger.info(f"Loaded {added} documents into the local index from {self.path}")
+        return added
+
+    def search(self, query, limit=10):
+        """The best matches for query, best first, as SearchResults.
+
+        Documents are scored with BM25 and must contain at least half of
+        the query's distinct terms.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        self.catch_up()
+        with self._lock:
+            self.searches += 1
+            count = len(self._docs)
+            if not count:
+                return []
+            self._update_norms_locked()
+            factor = self.k1 + 1
+            norms = self._norms
+            base = self._base
+            scores = {}
+            matched = {}
+            needed = (len(terms) + 1) // 2
+            # Rarest terms first, so common ones can add to their matches
+            for term in sorted(terms, key=lambda t: len(self._postings.get(t, ()))):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                frequency = len(postings)
+                idf = math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                older = max(0, frequency - self.max_scan)
+                if older and scores:
+                    oldest = postings[older] >> TF_BITS
+                    for doc in [doc for doc in scores if doc < oldest]:
+                        i = bisect_left(postings, doc << TF_BITS, 0, older)
+                        if i < older and postings[i] >> TF_BITS == doc:
+                            tf = postings[i] & TF_MAX
+                            scores[doc] += idf * tf * factor / (tf + norms[doc - base])
+                            matched[doc] += 1
+                for entry in postings[older:] if older else postings:
+                    doc = entry >> TF_BITS
+                    tf = entry & TF_MAX
+                    score = idf * tf * factor / (tf + norms[doc - base])
+                    if doc in scores:
+                        scores[doc] += score
+                        matched[doc] += 1
+                    else:
+                        scores[doc] = score
+                        matched[doc] = 1
+            if needed > 1:
+                scores = {doc: score for doc, score in scores.items() if matched[doc] >= needed}
+            best = heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+            return [self._docs[doc - base] for doc, _ in best]
+
+    def stats(self):
+        with self._lock:
+            return {'documents': len(self._docs), 'terms': len(self._postings),
+                    'postings': sum(len(p) for p in self._postings.values()),
+                    'added': self.added, 'duplicates': self.duplicates,
+                    'evicted': self.evicted, 'compactions': self.compactions,
+                    'searches': self.searches}
+
+    def _add_locked(self, docs, replay=False):
+        """Index docs not seen yet and return them."""
+        added = []
+        for doc in docs:
+            key = hash(canonical_url(doc.url))
+            if key in self._seen:
+                # Other workers may have appended the same result
+                if not replay:
+                    self.duplicates += 1
+                continue
+            if len(self._docs) >= self.max_docs:
+                self._evict_locked(max(1, int(self.max_docs * EVICT_FRACTION)))
+            self._seen.add(key)
+            self._index_locked(doc)
+            added.append(doc)
+        self.added += len(added)
+        return added
+
+    def _append(self, docs):
+        lines = ''.join(json.dumps([doc.title, doc.url, doc.description],
+                                   ensure_ascii=False, separators=(',', ':')) + '\n'
+                        for doc in docs)
+        data = lines.encode('utf-8')
+        self._line_bytes += (len(data) / len(docs) - self._line_bytes) / 10
+        try:
+            with self._append_lock, open(self._lock_path, 'a') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                with open(self.path, 'ab') as f:
+                    inode = os.fstat(f.fileno()).st_ino
+                    start = f.tell()
+                    f.write(data)
+                    end = f.tell()
+                # No need to read these lines back unless something before
+                # them is still unread
+                if self._file_lock.acquire(blocking=False):
+                    if self._inode == inode and self._offset == start:
+                        self._offset = end
+                    self._file_lock.release()
+                if end > COMPACT_FACTOR * self.max_docs * self._line_bytes:
+                    self._compact_file()
+        except OSError as e:
+            logger.warning(f"Could not append to local index {self.path}: {e}")
+
+    def _compact_file(self):
+        """Cut the file back to its newest max_docs lines; the caller holds the flock."""
+        with open(self.path, 'rb') as f:
+            lines = f.readlines()
+        # Keep no more than a full index holds after an eviction, so readers
+        # have all of them already
+        kept = lines[-(self.max_docs - int(self.max_docs * EVICT_FRACTION)):]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.writelines(kept)
+        os.replace(tmp_path, self.path)
+        self.compactions += 1
+        logger.info(f"Compacted local index {self.path} from {len(lines)} to {len(kept)} lines")
+
+    def _evict_locked(self, count):
+        """Forget the count oldest documents."""
+        for doc in self._docs[:count]:
+            self._seen.discard(hash(canonical_url(doc.url)))
+        del self._docs[:count]
+        self._total_length -= sum(self._lengths[:count])
+        del self._lengths[:count]
+        del self._norms[:count]
+        self._base += count
+        # Renumber from 0 well before doc ids run out of bits
+        shift = self._base if self._base >= MAX_DOC_ID // 2 else 0
+        first = self._base << TF_BITS
+        for term, postings in list(self._postings.items()):
+            if postings[0] < first:
+                del postings[:bisect_left(postings, first)]
+                if not postings:
+                    del self._postings[term]
+                    continue
+            if shift:
+                self._postings[term] = array('I', (entry - (shift << TF_BITS)
+                                                   for entry in postings))
+        self._base -= shift
+        self.evicted += count
+
+    def _index_locked(self, doc):
+        tokens = []
+        for field, weight in FIELD_WEIGHTS:
+            text = getattr(doc, field) or ''
+            tokens += (url_tokens(text) if field == 'url' else tokenize(text)) * weight
+        counts = Counter(tokens)
+        doc_id = self._base + len(self._docs)
+        self._docs.append(doc)
+        length = min(len(tokens), 0xFFFF)
+        self._lengths.append(length)
+        self._total_length += length
+        self._norms.append(self._norm(length, self._norm_average or length or 1))
+        for term, tf in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = array('I')
+            postings.append(doc_id << TF_BITS | min(tf, TF_MAX))
+
+    def _norm(self, length, average):
+        return self.k1 * (1 - self.b + self.b * length / average)
+
+    def _update_norms_locked(self):
+        """Rebuild the length norms once the average length has drifted by a tenth."""
+        average = self._total_length / len(self._docs) or 1
+        if self._norm_average and abs(average - self._norm_average) <= self._norm_average / 10:
+            return
+        self._norm_average = average
+        self._norms = array('f', (self._norm(length, average) for length in self._lengths))
+
+    def _read_new(self):
+        """Index complete lines past the offset; the caller holds _file_lock."""
+        added = 0
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self._inode:
+                # A new or compacted file: read it all, skipping what is indexed
+                self._inode = inode
+                self._offset = 0
+            f.seek(self._offset)
+            while True:
+                lines = f.readlines(READ_BATCH_BYTES)
+                if not lines:
+                    break
+                partial = not lines[-1].endswith(b'\n')
+                if partial:
+                    lines.pop()  # still being written
+                if lines:
+                    size = sum(len(line) for line in lines)
+                    self._line_bytes += (size / len(lines) - self._line_bytes) / 10
+                docs = []
+                for line in lines:
+                    try:
+                        title, url, description = json.loads(line)
+                    except (TypeError, ValueError):
+                        logger.warning(f"Skipping unreadable line in local index {self.path}")
+                        continue
+                    docs.append(SearchResult(title, url, description))
+                with self._lock:
+                    added += len(self._add_locked(docs, replay=True))
+                self._offset += sum(len(line) for line in lines)
+                if partial:
+                    break
+        return added
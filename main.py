@@ -1 +1,3 @@
-from app import app  # noqa: F401
+from app import create_app
+
+app = create_app()
@@ -0,0 +1,278 @@
+import bisect
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, '') for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels.
+
+    An observation is a bisect and three additions under a lock, cheap
+    enough to wrap every stage of every request.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels):
+        series = self._series.get(tuple(labels.get(name, '') for name in self.labelnames))
+        return sum(series[:-1]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(values[-1])}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Registry:
+    """A set of metrics rendered together in the Prometheus text format.
+
+    Collectors are callables returning (name, kind, help, [(labels, value)])
+    tuples, for numbers that already live elsewhere such as cache stats.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self, *collectors):
+        """Render every metric, plus collectors given for this call only.
+
+        Collectors that belong to one app, like its services' stats, are
+        passed here rather than added for good: a process may build more
+        than one app, and each must only report its own.
+        """
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        # Collectors may report the same family (e.g. several caches), and
+        # each family must appear exactly once
+        families = {}
+        for collector in list(self._collectors) + list(collectors):
+            try:
+                collected = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, help, samples in collected:
+                family = families.setdefault(name, (kind, help, []))
+                for labels, value in samples:
+                    names = tuple(labels)
+                    family[2].append(f"{name}{_format_labels(names, [labels[n] for n in names])} "
+                                     f"{_format_value(value)}")
+        for name, (kind, help, samples) in families.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'search_stage_seconds',
+    'Time spent per stage of a search (connect, ttfb, body, parse, filter, '
+    'extract, render, log_write).',
+    ('stage', 'backend'))
+
+BACKEND_CALLS = REGISTRY.counter(
+    'search_backend_calls_total',
+    'Upstream backend calls by outcome (success, failure, captcha, rejected).',
+    ('backend', 'outcome'))
+
+OUTBOUND_WAIT = REGISTRY.histogram(
+    'search_outbound_wait_seconds',
+    'Time upstream requests waited for the outbound rate limiter.',
+    ('backend', 'priority'))
+
+OUTBOUND_REJECTED = REGISTRY.counter(
+    'search_outbound_rejected_total',
+    'Upstream requests refused by the outbound rate limiter (queue_full, deadline).',
+    ('backend', 'reason'))
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'search_http_request_seconds',
+    'Time to handle an HTTP request, by endpoint and status code.',
+    ('endpoint', 'status'))
+
+
+def observe_stage(stage, backend, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage, backend=backend)
+
+
+def time_stage(stage, backend):
+    """Context manager timing one stage into search_stage_seconds."""
+    return STAGE_SECONDS.time(stage=stage, backend=backend)
+
+
+def cache_collector(name, cache):
+    """Collector exposing a ResultCache's counters under cache=name."""
+    def collect():
+        stats = cache.stats()
+        labels = {'cache': name}
+        yield ('search_cache_entries', 'gauge', 'Entries in the cache.', [(labels, stats['entries'])])
+        yield ('search_cache_bytes', 'gauge', 'Estimated size of the cache.', [(labels, stats['bytes'])])
+        for counter in ('hits', 'misses', 'evictions', 'expirations', 'coalesced', 'shared_hits',
+                        'stale_hits'):
+            yield (f'search_cache_{counter}_total', 'counter', f'Cache {counter}.',
+                   [(labels, stats[counter])])
+    return collect
+
+
+class SlowRequestProfiler:
+    """Profile a random sample of requests and keep the slow ones.
+
+    ``start()`` enables cProfile for about ``sample_rate`` of the calls;
+    ``finish()`` writes the profile to ``directory`` when the request
+    took at least ``threshold`` seconds. Only one request per process is
+    profiled at a time, since the interpreter allows a single profiler.
+    """
+
+    def __init__(self, sample_rate=0.0, threshold=1.0, directory=None):
+        self.sample_rate = sample_rate
+        self.threshold = threshold
+        self.directory = directory or os.path.join(os.getcwd(), 'profiles')
+        self._active = threading.Lock()
+        self.saved = 0
+
+    def start(self):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._active.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is running
+            self._active.release()
+            return None
+        return profile
+
+    def finish(self, profile, elapsed, name='request'):
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+            if elapsed < self.threshold:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            safe_name = ''.join(c if c.isalnum() else '_' for c in name)
+            path = os.path.join(self.directory,
+                                f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe_name}.prof")
+            profile.dump_stats(path)
+            self.saved += 1
+            logger.warning(f"Slow request {name} took {elapsed:.2f}s, profile saved to {path}")
+            return path
+        finally:
+            self._active.release()
@@ -1,4 +1,17 @@
-from app import db
+import hashlib
+
+from database import db
+from cache import normalize_query
+
+
+def hash_query(query):
+    """Signed 64-bit hash of the normalized query, for compact indexing."""
+    digest = hashlib.blake2b(normalize_query(query).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def _default_query_hash(context):
+    return hash_query(context.get_current_parameters()['query'])
 
 
 class User(db.Model):
@@ -11,16 +24,45 @@ class User(db.Model):
 
 class SearchQuery(db.Model):
     """Model to store search queries for analytics and history."""
+    __table_args__ = (
+        db.Index('ix_search_query_hash_timestamp', 'query_hash', 'timestamp'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     query = db.Column(db.String(500), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    query_hash = db.Column(db.BigInteger, default=_default_query_hash)
+    timestamp = db.Column(db.DateTime, nullable=False, default=db.func.now(), index=True)
     user_agent = db.Column(db.String(500))
     ip_address = db.Column(db.String(45))  # IPv6 compatible
     
     def __init__(self, query=None, user_agent=None, ip_address=None):
         self.query = query
+        self.query_hash = hash_query(query) if query else None
         self.user_agent = user_agent
         self.ip_address = ip_address
     
     def __repr__(self):
-        return f'<SearchQuery {self.query}>'
\ No newline at end of file
+        return f'<SearchQuery {self.query}>'
+
+
+class SearchQueryRollup(db.Model):
+    """Hourly search counts per normalized query, rolled up from SearchQuery."""
+    __table_args__ = (
+        db.UniqueConstraint('query_hash', 'bucket_start', name='uq_search_query_rollup_bucket'),
+        db.Index('ix_search_query_rollup_bucket_count', 'bucket_start', 'count'),
+    )
+    
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    query_hash = db.Column(db.BigInteger, nullable=False)
+    query = db.Column(db.String(500), nullable=False)  # normalized form
+    bucket_start = db.Column(db.DateTime, nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SearchQueryRollup {self.query} @ {self.bucket_start}: {self.count}>'
+
+
+class RollupState(db.Model):
+    """Bookkeeping for the rollup job, e.g. the last rolled-up SearchQuery id."""
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+
+from cache import normalize_query
+from scheduler import BACKGROUND, OutboundBusy, OutboundScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class CacheWarmer:
+    """Refreshes cache entries in the background, before users need them.
+
+    Every ``interval`` seconds warm() re-fetches the ``top_n`` most
+    popular queries whose cache entry is missing or due to expire within
+    two intervals, most popular first, and the ``prefixes`` most common
+    autocomplete prefixes of those queries. ResultCache also hands it
+    expired entries to refresh while they are served stale.
+
+    All refreshes run one at a time on a single thread, each taking a
+    token from ``budget`` (a TokenBucket, shared by every worker on the
+    host) and going out at BACKGROUND priority, so live requests are
+    always sent first. Work beyond ``max_pending`` queued refreshes is
+    dropped.
+    """
+
+    def __init__(self, engine, budget, suggestions=None, suggester=None, top_n=50,
+                 prefixes=100, window=timedelta(hours=24), interval=60.0, num_results=15,
+                 min_prefix=2, max_pending=200):
+        self.engine = engine
+        self.budget = budget
+        self.suggestions = suggestions
+        self.suggester = suggester
+        self.top_n = top_n
+        self.prefixes = prefixes
+        self.window = window
+        self.interval = interval
+        self.num_results = num_results
+        self.min_prefix = min_prefix
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cache-warmer')
+        self._queued = set()
+        self._lock = threading.Lock()
+
+        self.refreshed = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.failed = 0
+
+    def revalidate(self, refresh, key=None):
+        """Queue refresh() to run in the background; False if it was not queued.
+
+        A key already waiting in the queue is not queued twice.
+        """
+        with self._lock:
+            if key is not None and key in self._queued:
+                return False
+            if len(self._queued) >= self.max_pending:
+                self.dropped += 1
+                return False
+            token = key if key is not None else object()
+            self._queued.add(token)
+        try:
+            self._executor.submit(self._run, refresh, token)
+        except RuntimeError:  # shut down
+            with self._lock:
+                self._queued.discard(token)
+            return False
+        return True
+
+    def _run(self, refresh, token):
+        try:
+            self._wait_for_budget()
+            with OutboundScheduler.priority(BACKGROUND):
+                refresh()
+            self.refreshed += 1
+        except OutboundBusy as e:
+            self.deferred += 1
+            logger.debug(f"Background refresh deferred: {e}")
+        except Exception as e:
+            self.failed += 1
+            logger.warning(f"Background refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._queued.discard(token)
+
+    def _wait_for_budget(self):
+        while True:
+            wait = self.budget.take()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def warm(self, popular):
+        """Queue refreshes for popular queries, [{'query': ..., 'count': ...}]."""
+        engine = self.engine
+        ahead = 2 * self.interval
+        for item in popular[:self.top_n]:
+            query = item['query']
+            key = engine.cache_key(query, self.num_results)
+            ttl_left = engine.cache.ttl_left(key)
+            if ttl_left is None or ttl_left < ahead:
+                compute = engine.computation(query, self.num_results)
+                self.revalidate(partial(engine.cache.refresh, key, compute), key)
+
+        if self.suggestions is None or self.prefixes <= 0:
+            return
+        for prefix in self.hot_prefixes(popular):
+            if self.suggester is not None:
+                if not self.suggester.wants_upstream(self.suggester.suggest(prefix)):
+                    continue
+            ttl_left = self.suggestions.ttl_left(prefix)
+            if ttl_left is None or ttl_left < ahead:
+                self.revalidate(partial(self.suggestions.refresh, prefix, engine.autocomplete),
+                                ('suggestions', prefix))
+
+    def hot_prefixes(self, popular):
+        """The prefixes typed most often on the way to popular queries."""
+        counts = Counter()
+        for item in popular:
+            query = normalize_query(item['query'])
+            prefixes = {query[:end].rstrip() for end in range(self.min_prefix, len(query))}
+            for prefix in prefixes:
+                if len(prefix) >= self.min_prefix:
+                    counts[prefix] += item['count']
+        return [prefix for prefix, _ in counts.most_common(self.prefixes)]
+
+    def run(self, app, load_popular):
+        """Call warm(load_popular(window, top_n)) in app's context every interval seconds.
+
+        Runs forever, so give it a thread of its own.
+        """
+        while True:
+            try:
+                with app.app_context():
+                    popular = load_popular(self.window, self.top_n)
+                self.warm(popular)
+            except Exception as e:
+                logger.warning(f"Failed to warm the search cache: {e}")
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            queued = len(self._queued)
+        return {'queued': queued, 'refreshed': self.refreshed, 'dropped': self.dropped,
+                'deferred': self.deferred, 'failed': self.failed}
@@ -0,0 +1,180 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class QueryLogWriter:
+    """Write-behind logger that batches SearchQuery inserts off the request path.
+
+    Requests only put a row on a bounded in-memory queue. A background
+    thread drains it and bulk-inserts a batch once ``batch_size`` rows
+    are waiting or ``flush_interval`` seconds have passed. When the queue
+    is full a request waits up to ``block_timeout`` seconds (0 means not
+    at all) and the row is then dropped and counted. A batch that fails
+    is retried row by row, so only the rows the database rejects are
+    lost. Rows left in the queue are flushed at interpreter exit.
+
+    The timestamp column keeps its database default, so a row's time is
+    when its batch was written: at most about flush_interval late.
+    """
+
+    def __init__(self, app, db, model, max_queue=10000, batch_size=200,
+                 flush_interval=1.0, block_timeout=0):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._exit_registered = False
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+
+    def log(self, query, user_agent=None, ip_address=None):
+        """Queue a row for writing; returns False if it was dropped."""
+        self._ensure_started()
+        row = {'query': query, 'user_agent': user_agent, 'ip_address': ip_address}
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Search log queue full, {self.dropped} rows dropped so far")
+            return False
+        self.enqueued += 1
+        return True
+
+    def stop(self, timeout=10):
+        """Flush queued rows and stop the writer thread."""
+        thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed,
+            'batches': self.batches,
+        }
+
+    def _ensure_started(self):
+        # Started lazily so each forked worker gets its own thread
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='search-log-writer',
+                                            daemon=True)
+            self._thread.start()
+            if not self._exit_registered:
+                atexit.register(self.stop)
+                self._exit_registered = True
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            self._write(batch)
+            if stopping:
+                self._drain()
+                return
+
+    def _drain(self):
+        batch = []
+        while True:
+            try:
+                row = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not _STOP:
+                batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            self._insert(batch)
+        except Exception as e:
+            self._rollback()
+            logger.warning(f"Failed to store {len(batch)} search queries: {e}")
+            if len(batch) > 1:
+                self._write_singly(batch)
+            else:
+                self.failed += 1
+            return
+        observe_stage('log_write', 'db', time.perf_counter() - started)
+        self.written += len(batch)
+        self.batches += 1
+
+    def _write_singly(self, batch):
+        # One bad row must not cost the rest of its batch
+        failed = 0
+        for row in batch:
+            try:
+                self._insert([row])
+            except Exception:
+                self._rollback()
+                failed += 1
+        self.written += len(batch) - failed
+        self.failed += failed
+        if failed:
+            logger.warning(f"Dropped {failed} of {len(batch)} search queries after retrying singly")
+
+    def _insert(self, batch):
+        with self.app.app_context():
+            self.db.session.execute(self.db.insert(self.model), batch)
+            self.db.session.commit()
+
+    def _rollback(self):
+        try:
+            with self.app.app_context():
+                self.db.session.rollback()
+        except Exception:
+            pass
@@ -0,0 +1,65 @@
+from collections.abc import Mapping
+
+RESULT_FIELDS = ('title', 'url', 'description')
+_RESULT_KEYS = frozenset(RESULT_FIELDS)
+
+
+class SearchResult(Mapping):
+    """One search result: title, url and description.
+
+    A slotted record takes about a third of the memory of the equivalent
+    dict, which adds up over thousands of cached result sets. It is a
+    read-only Mapping, so result['url'], result.get('description') and
+    dict(result) work as before, and templates can use result.title.
+    Its fields cannot be assigned either, as cached results are shared
+    by every request that hits the cache.
+    json.dumps needs default=json_default, and json.loads turns them back
+    into records with object_hook=json_object_hook.
+    """
+    __slots__ = RESULT_FIELDS
+
+    def __init__(self, title, url, description=''):
+        _set = object.__setattr__
+        _set(self, 'title', title)
+        _set(self, 'url', url)
+        _set(self, 'description', description)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"SearchResult is read-only; cannot set {name!r}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"SearchResult is read-only; cannot delete {name!r}")
+
+    def __reduce__(self):
+        return SearchResult, (self.title, self.url, self.description)
+
+    def __getitem__(self, key):
+        if key not in _RESULT_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(RESULT_FIELDS)
+
+    def __len__(self):
+        return len(RESULT_FIELDS)
+
+    def __repr__(self):
+        return f"SearchResult({self.title!r}, {self.url!r}, {self.description!r})"
+
+    def as_dict(self):
+        return {'title': self.title, 'url': self.url, 'description': self.description}
+
+
+def json_default(value):
+    """json.dumps default= that writes SearchResults as dicts and anything else as str."""
+    if isinstance(value, SearchResult):
+        return value.as_dict()
+    return str(value)
+
+
+def json_object_hook(data):
+    """json.loads object_hook= that turns result dicts back into SearchResults."""
+    if len(data) == len(RESULT_FIELDS) and data.keys() == _RESULT_KEYS:
+        return SearchResult(**data)
+    return data
@@ -0,0 +1,222 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from health import MemoryBreakerStore
+from metrics import OUTBOUND_REJECTED, OUTBOUND_WAIT
+
+logger = logging.getLogger(__name__)
+
+# Request priorities, most urgent first
+INTERACTIVE = 0
+AUTOCOMPLETE = 1
+BATCH = 2
+BACKGROUND = 3
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', AUTOCOMPLETE: 'autocomplete',
+                  BATCH: 'batch', BACKGROUND: 'background'}
+
+# How long a request of each priority may wait for a slot by default
+DEFAULT_MAX_WAIT = {INTERACTIVE: 2.0, AUTOCOMPLETE: 0.5, BATCH: 5.0, BACKGROUND: 30.0}
+
+# Backend labels that draw on another backend's rate limit, and the
+# priority their requests get unless the caller says otherwise
+BACKEND_BUCKETS = {'autocomplete': 'duckduckgo'}
+BACKEND_PRIORITIES = {'autocomplete': AUTOCOMPLETE}
+
+# Seconds a worker may keep tokens taken from a shared bucket
+LEASE_TTL = 1.0
+
+_context = threading.local()
+
+
+class OutboundBusy(Exception):
+    """An upstream request was refused by the outbound scheduler."""
+
+    def __init__(self, backend, reason):
+        super().__init__(f"{backend} is over its rate limit ({reason})")
+        self.backend = backend
+        self.reason = reason
+
+
+class TokenBucket:
+    """Token bucket whose state lives in a shared store.
+
+    ``rate`` tokens per second are added up to ``burst``. With a
+    FileBreakerStore every process on the host draws from the same
+    bucket, so the configured rate holds for the host, not per worker.
+
+    Tokens are taken from the store up to ``lease`` at a time and then
+    spent from memory, so a busy worker writes the shared state about
+    once per lease instead of once per request. Leased tokens not spent
+    within LEASE_TTL seconds are dropped, so an idle worker cannot save
+    them up for a burst on top of everyone else's.
+    """
+
+    def __init__(self, name, rate, burst, store=None, lease=None):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.store = store if store is not None else MemoryBreakerStore()
+        if lease is None:
+            lease = min(self.burst / 4, rate * LEASE_TTL / 2)
+        self.lease = max(1, int(lease))
+        self._tokens = 0
+        self._leased_at = 0.0
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token; return 0, or the seconds until one is available."""
+        with self._lock:
+            if self._tokens and time.monotonic() - self._leased_at < LEASE_TTL:
+                self._tokens -= 1
+                return 0.0
+            granted, wait = self._take_lease()
+            if granted:
+                self._tokens = granted - 1
+                self._leased_at = time.monotonic()
+            return wait
+
+    def _take_lease(self):
+        """Take up to lease tokens from the store; return (tokens, seconds to wait)."""
+        now = time.time()
+
+        def take(state):
+            tokens = state.get('tokens', self.burst)
+            tokens = min(self.burst, tokens + max(0.0, now - state.get('updated', now)) * self.rate)
+            state['updated'] = now
+            if tokens >= 1:
+                granted = min(self.lease, int(tokens))
+                state['tokens'] = tokens - granted
+                return granted, 0.0
+            state['tokens'] = tokens
+            return 0, (1 - tokens) / self.rate
+
+        return self.store.update(f'rate:{self.name}', take)
+
+
+class OutboundScheduler:
+    """Admission control for upstream requests.
+
+    Each rate-limited backend has a token bucket and a bounded queue of
+    waiting requests, served in priority order (INTERACTIVE before
+    AUTOCOMPLETE before BATCH before BACKGROUND) and first come, first
+    served within a priority. A request is refused straight away when
+    ``max_queue`` requests of its priority or higher are already waiting
+    or when the requests ahead of it alone would outlast its deadline,
+    and gives up when the deadline passes; callers then fall back to
+    another backend or fail fast instead of piling up. Waiting requests
+    of lower priority never crowd out a more urgent one.
+
+    ``limits`` maps backend names to (requests per second, burst).
+    Backends without a limit are never delayed.
+    """
+
+    def __init__(self, limits=None, store=None, max_queue=50, max_wait=None):
+        self.store = store if store is not None else MemoryBreakerStore()
+        self.buckets = {name: TokenBucket(name, rate, burst, self.store)
+                        for name, (rate, burst) in (limits or {}).items() if rate > 0}
+        self.max_queue = max_queue
+        self.max_wait = {**DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self._queues = {}  # bucket name -> heap of [priority, sequence]
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+        self.admitted = 0
+        self.rejected = 0
+
+    def bucket_for(self, backend):
+        return self.buckets.get(BACKEND_BUCKETS.get(backend, backend))
+
+    def is_limited(self, backend):
+        return self.bucket_for(backend) is not None
+
+    def acquire(self, backend, priority=None, timeout=None):
+        """Wait for a slot to send a request to backend.
+
+        priority and timeout default to the caller's priority() context,
+        then to the backend's usual priority and that priority's
+        max_wait. Raises OutboundBusy when no slot comes in time.
+        """
+        bucket = self.bucket_for(backend)
+        if bucket is None:
+            return
+        context_priority, context_timeout = getattr(_context, 'value', (None, None))
+        if priority is None:
+            priority = context_priority
+        if priority is None:
+            priority = BACKEND_PRIORITIES.get(backend, INTERACTIVE)
+        if timeout is None:
+            timeout = context_timeout
+        if timeout is None:
+            timeout = self.max_wait.get(priority, self.max_wait[INTERACTIVE])
+
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            queue = self._queues.setdefault(bucket.name, [])
+            waiting = sum(1 for waiter in queue if waiter[0] <= priority)
+            if waiting >= self.max_queue:
+                self._reject(bucket.name, 'queue_full')
+            # Even if the bucket is full, this many requests go first
+            ahead = waiting - bucket.burst + 1
+            if ahead / bucket.rate > timeout:
+                self._reject(bucket.name, 'deadline')
+            waiter = [priority, next(self._sequence)]
+            heapq.heappush(queue, waiter)
+            try:
+                while True:
+                    wait = None
+                    if queue[0] is waiter:
+                        wait = bucket.take()
+                        if not wait:
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or (wait is not None and wait > remaining):
+                        self._reject(bucket.name, 'deadline')
+                    self._cond.wait(remaining if wait is None else wait)
+            finally:
+                queue.remove(waiter)
+                heapq.heapify(queue)
+                self._cond.notify_all()
+        self.admitted += 1
+        OUTBOUND_WAIT.observe(time.monotonic() - started, backend=bucket.name,
+                              priority=PRIORITY_NAMES.get(priority, str(priority)))
+
+    def _reject(self, bucket, reason):
+        self.rejected += 1
+        OUTBOUND_REJECTED.inc(backend=bucket, reason=reason)
+        logger.info(f"Outbound request to {bucket} refused: {reason}")
+        raise OutboundBusy(bucket, reason)
+
+    @staticmethod
+    @contextmanager
+    def priority(priority, timeout=None):
+        """Run upstream requests made by this thread at priority."""
+        previous = getattr(_context, 'value', (None, None))
+        _context.value = (priority, timeout)
+        try:
+            yield
+        finally:
+            _context.value = previous
+
+    @classmethod
+    def bind(cls, func):
+        """Wrap func to run with the calling thread's priority, e.g. on a pool."""
+        priority, timeout = getattr(_context, 'value', (None, None))
+        if priority is None:
+            return func
+
+        def run(*args, **kwargs):
+            with cls.priority(priority, timeout):
+                return func(*args, **kwargs)
+        return run
+
+    def stats(self):
+        with self._cond:
+            queued = {name: len(queue) for name, queue in self._queues.items()}
+        return {'admitted': self.admitted, 'rejected': self.rejected, 'queued': queued,
+                'limits': {name: {'rate': bucket.rate, 'burst': bucket.burst}
+                           for name, bucket in self.buckets.items()}}
@@ -1,47 +1,402 @@
 import requests
 import urllib.parse
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, CData, NavigableString, SoupStrainer, Tag
 import logging
 import time
 import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from itertools import islice
+from cache import ResultCache, normalize_query
+from health import HealthMonitor
+from http_client import ACCEPT_ENCODING, get_http_client
+from metrics import observe_stage, time_stage
+from results import SearchResult
+from scheduler import BATCH, OutboundBusy, OutboundScheduler
 
 logger = logging.getLogger(__name__)
 
+AD_KEYWORDS = (
+    'ad', 'ads', 'anuncio', 'annuncio', 'annonce', 'Anzeige', '广告', '廣告',
+    'Reklama', 'Реклама', 'Anunț', '광고', 'annons', 'Annonse', 'Iklan',
+    '広告', 'Augl.', 'Mainos', 'Advertentie', 'إعلان', 'Գովազդ', 'विज्ञापन',
+    'Reklam', 'آگهی', 'Reklāma', 'Reklaam', 'Διαφήμιση', 'מודעה', 'Hirdetés',
+    'Anúncio', 'Quảng cáo', 'โฆษณา', 'sponsored', 'patrocinado', 'gesponsert',
+    'Sponzorováno', '스폰서', 'Gesponsord', 'Sponsorisé'
+)
+
+FOOTER_TERMS = ('privacy', 'terms', 'mumbai', 'maharashtra')
+FOOTER_MAX_LEN = 200
+
+# String types that Tag.get_text() includes for ordinary tags like div/span
+TEXT_STRING_TYPES = (NavigableString, CData)
+
+
+class ResultStrainer(SoupStrainer):
+    """SoupStrainer that only builds the subtrees of result containers.
+    
+    A top-level tag is kept when it has one of ``classes`` or any of
+    ``attrs``; everything inside a kept tag is parsed as usual.
+    """
+    
+    def __init__(self, name, classes=(), attrs=()):
+        super().__init__()
+        self.tag_name = name
+        self.classes = frozenset(classes)
+        self.attr_names = tuple(attrs)
+    
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        if name != self.tag_name or not attrs:
+            return False
+        if any(attr in attrs for attr in self.attr_names):
+            return True
+        classes = attrs.get('class') or ()
+        if isinstance(classes, str):
+            classes = classes.split()
+        return not self.classes.isdisjoint(classes)
+    
+    def allow_string_creation(self, string):
+        return False
+
+
+GOOGLE_RESULT_STRAINER = ResultStrainer(
+    'div', classes=('g', 'tF2Cxc', 'yuRUbf', 'Gx5Zad'), attrs=('data-ved',))
+DUCKDUCKGO_RESULT_STRAINER = ResultStrainer('div', classes=('result', 'nav-link'))
+
+
+def lxml_available():
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class ParserBackend:
+    """Turns upstream HTML into a BeautifulSoup tree.
+    
+    ``features`` picks the tree builder. With ``partial`` set, callers
+    that pass a strainer get a tree holding only the result containers.
+    """
+    
+    def __init__(self, features='html.parser', partial=False):
+        self.features = features
+        self.partial = partial
+    
+    def parse(self, content, strainer=None):
+        if self.partial and strainer is not None:
+            return BeautifulSoup(content, self.features, parse_only=strainer)
+        return BeautifulSoup(content, self.features)
+    
+    def __repr__(self):
+        return f"<ParserBackend {self.features}{' partial' if self.partial else ''}>"
+
+
+PARSER_BACKENDS = ('auto', 'html.parser', 'lxml', 'partial')
+
+
+def get_parser_backend(name='auto'):
+    """Return a ParserBackend by name.
+    
+    'lxml' is the C-backed builder, 'partial' strains the fastest available
+    builder down to result containers, 'auto' uses lxml when installed.
+    """
+    if name not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown parser backend: {name}")
+    fast = 'lxml' if lxml_available() else 'html.parser'
+    if name == 'lxml' and fast != 'lxml':
+        logger.warning("lxml is not installed, using html.parser instead")
+    if name == 'html.parser':
+        return ParserBackend('html.parser')
+    return ParserBackend(fast, partial=(name == 'partial'))
+
+
+# Upstream endpoints; GoogleSearchEngine can point each elsewhere (e.g. at
+# the load test stub, benchmarks/stub_upstream.py)
+GOOGLE_SEARCH_URL = 'https://www.google.com/search'
+AUTOCOMPLETE_URL = 'https://duckduckgo.com/ac/'
+DUCKDUCKGO_HTML_URL = 'https://html.duckduckgo.com/html/'
+
+# Largest page fetched from Google in one request; deeper result sets are
+# assembled from GOOGLE_PAGE_SIZE pages fetched concurrently
+MAX_PAGE_SIZE = 20
+GOOGLE_PAGE_SIZE = 10
+# Deepest result offered through pagination
+MAX_RESULTS = 100
+
+SEARCH_MODES = ('fallback', 'race', 'hedge', 'merge')
+
+# Returned by google_page_error() when the page should be refetched with gbv=1
+JAVASCRIPT_REQUIRED = object()
+
+# What google_page_error() looks for in a page without results
+BLOCKED_PAGE_PATTERN = re.compile(r'captcha|blocked|automated', re.IGNORECASE)
+NOSCRIPT_PATTERN = re.compile(r'noscript', re.IGNORECASE)
+
+GOOGLE_BLOCKED_ERROR = 'Search blocked by Google. Please try again later.'
+GOOGLE_NO_MATCH_ERROR = 'No matching results found for this query.'
+GOOGLE_UNAVAILABLE_ERROR = 'Search temporarily blocked. Please try again later.'
+BUSY_ERROR = 'Search is busy right now. Please try again in a moment.'
+LOCAL_NO_RESULTS_ERROR = 'No saved results match this query.'
+NO_RESULTS_ERROR = 'No results found'
+NO_MORE_RESULTS_ERROR = 'No more results for this query.'
+DUCKDUCKGO_NO_RESULTS_ERROR = 'No results found on DuckDuckGo'
+
+# Errors that are a backend's answer to the query rather than a failure
+NO_RESULTS_ERRORS = frozenset((GOOGLE_NO_MATCH_ERROR, NO_RESULTS_ERROR, NO_MORE_RESULTS_ERROR,
+                               DUCKDUCKGO_NO_RESULTS_ERROR))
+
+
+# Steps the search plans (GoogleSearchEngine.google_plan and duckduckgo_plan)
+# yield to the code driving them, and the reply each step expects back:
+#   (FETCH, backend, url, headers, cookies) -> (status_code, text, latency),
+#       after waiting for the outbound scheduler; raises OutboundBusy,
+#       UpstreamTimeout or UpstreamError into the plan
+#   (BACKOFF, seconds) -> True if the search was cancelled meanwhile
+#   (PARSE, func, *args) -> func(*args)
+# All retry and fallback decisions live in the plans, so the sync engine and
+# AsyncGoogleSearchEngine only differ in how they carry out the steps.
+FETCH = 'fetch'
+BACKOFF = 'backoff'
+PARSE = 'parse'
+
+
+class UpstreamError(Exception):
+    """An upstream fetch failed in transport, whichever HTTP client made it."""
+    
+    def __init__(self, message, latency=0.0):
+        super().__init__(message)
+        self.latency = latency
+
+
+class UpstreamTimeout(UpstreamError):
+    """An upstream fetch timed out."""
+
+
+def release_soup(soup):
+    """Tear down a parse tree now instead of leaving its cycles to the GC.
+    
+    BeautifulSoup.decompose() only clears the soup object itself, so each
+    top-level node is decomposed, which wipes everything below it.
+    """
+    for child in list(soup.contents):
+        child.decompose()
+    soup.decompose()
+
+
+def canonical_url(url):
+    """Normalize a result URL for de-duplication across backends."""
+    try:
+        parsed = urllib.parse.urlsplit(url)
+    except ValueError:
+        return url
+    host = parsed.netloc.lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    path = parsed.path.rstrip('/') or '/'
+    return urllib.parse.urlunsplit(('', host, path, parsed.query, ''))
+
+
+def results_response(query, results, source=None):
+    """Build the response dict returned by a successful search."""
+    response = {
+        'query': query,
+        'results': results,
+        'total_results': len(results),
+        'timestamp': datetime.now().isoformat()
+    }
+    if source:
+        response['source'] = source
+    return response
+
+
+def dedupe_results(results):
+    """Drop results whose URL was already seen, keeping rank order."""
+    unique = []
+    seen = set()
+    for result in results:
+        key = canonical_url(result['url'])
+        if key not in seen:
+            seen.add(key)
+            unique.append(result)
+    return unique
+
+
+def parse_suggestions(data):
+    """Pull the suggestion list out of an autocomplete API response."""
+    return data[1] if len(data) > 1 else []
+
+
+def merge_results(*result_lists):
+    """Interleave ranked result lists, dropping duplicate URLs."""
+    merged = []
+    seen = set()
+    for rank in range(max((len(r) for r in result_lists), default=0)):
+        for results in result_lists:
+            if rank >= len(results):
+                continue
+            key = canonical_url(results[rank]['url'])
+            if key not in seen:
+                seen.add(key)
+                merged.append(results[rank])
+    return merged
+
+
+class _TextSummary:
+    """Facts about a tag's get_text() computed without building the text.
+
+    ``short`` holds the text only while it is shorter than FOOTER_MAX_LEN
+    and ``alpha`` holds its letters only while they could still equal an
+    ad keyword; both are None once the text is too long for that.
+    """
+    __slots__ = ('length', 'lead', 'trail', 'short', 'alpha', 'info', 'ad')
+
+    def __init__(self, length=0, lead=0, trail=0, short='', alpha='', info=False, ad=False):
+        self.length = length
+        self.lead = lead      # leading whitespace characters
+        self.trail = trail    # trailing whitespace characters
+        self.short = short
+        self.alpha = alpha
+        self.info = info      # contains the 'ⓘ' ad marker
+        self.ad = ad          # subtree contains a span with ad content
+
+    @property
+    def stripped_length(self):
+        if self.lead == self.length:
+            return 0
+        return self.length - self.lead - self.trail
+
 class GoogleSearchEngine:
-    def __init__(self, use_fallback=True):
-        self.AD_KEYWORDS = [
-            'ad', 'ads', 'anuncio', 'annuncio', 'annonce', 'Anzeige', '广告', '廣告',
-            'Reklama', 'Реклама', 'Anunț', '광고', 'annons', 'Annonse', 'Iklan',
-            '広告', 'Augl.', 'Mainos', 'Advertentie', 'إعلان', 'Գովազդ', 'विज्ञापन',
-            'Reklam', 'آگهی', 'Reklāma', 'Reklaam', 'Διαφήμιση', 'מודעה', 'Hirdetés',
-            'Anúncio', 'Quảng cáo', 'โฆษณา', 'sponsored', 'patrocinado', 'gesponsert',
-            'Sponzorováno', '스폰서', 'Gesponsord', 'Sponsorisé'
-        ]
+    def __init__(self, use_fallback=True, cache=None, http=None, parser='auto',
+                 mode='fallback', hedge_delay=0.5, latency_budget=4.0, max_workers=8,
+                 health=None, scheduler=None, google_search_url=GOOGLE_SEARCH_URL,
+                 duckduckgo_html_url=DUCKDUCKGO_HTML_URL, autocomplete_url=AUTOCOMPLETE_URL,
+                 local_index=None):
+        self.AD_KEYWORDS = list(AD_KEYWORDS)
+        self._ad_keywords_upper = frozenset(k.upper() for k in self.AD_KEYWORDS)
+        self._ad_keyword_max_len = max(len(k) for k in self._ad_keywords_upper)
         
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'identity',  # Disable compression to avoid encoding issues
+            'Accept-Encoding': ACCEPT_ENCODING,
             'DNT': '1',
             'Connection': 'keep-alive',
             'Upgrade-Insecure-Requests': '1'
         }
         
+        self.ddg_headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        
         self.cookies = {
             'CONSENT': 'PENDING+987',
             'SOCS': 'CAESHAgBEhIaAB'
         }
         
         self.use_fallback = use_fallback
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode: {mode}")
+        self.mode = mode
+        self.hedge_delay = hedge_delay
+        self.latency_budget = latency_budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='search-backend')
+        self.cache = cache if cache is not None else ResultCache()
+        self.http = http if http is not None else get_http_client()
+        self.parser = get_parser_backend(parser) if isinstance(parser, str) else parser
+        # Circuit breakers for 'google', 'google-noscript' and 'duckduckgo'
+        self.health = health if health is not None else HealthMonitor()
+        # Outbound rate limits; the default scheduler has none
+        self.scheduler = scheduler if scheduler is not None else OutboundScheduler()
+        self.google_search_url = google_search_url
+        self.duckduckgo_html_url = duckduckgo_html_url
+        self.autocomplete_url = autocomplete_url
+        # LocalIndex of every result extracted so far, or None
+        self.local_index = local_index
     
     def has_ad_content(self, text):
         """Check if text contains ad-related content."""
         if not text:
             return False
         clean_text = ''.join(filter(str.isalpha, text))
-        return (clean_text.upper() in [k.upper() for k in self.AD_KEYWORDS] or 'ⓘ' in text)
+        return (clean_text.upper() in self._ad_keywords_upper or 'ⓘ' in text)
+    
+    def _summarize_string(self, text):
+        """Build the _TextSummary for a single string node."""
+        length = len(text)
+        stripped = text.lstrip()
+        lead = length - len(stripped)
+        trail = length - len(text.rstrip()) if stripped else length
+        alpha = ''.join(filter(str.isalpha, text))
+        return _TextSummary(
+            length, lead, trail,
+            short=text if length < FOOTER_MAX_LEN else None,
+            alpha=alpha if len(alpha) <= self._ad_keyword_max_len else None,
+            info='ⓘ' in text
+        )
+    
+    def _summarize_text(self, root):
+        """Summarize get_text() of root and every tag below it in one pass.
+        
+        Tags are visited in reverse document order, so each tag's children
+        are already summarized when it is reached and every node is only
+        looked at once. Returns a dict keyed by id(tag).
+        """
+        summaries = {}
+        tags = [root]
+        tags.extend(el for el in root.descendants if isinstance(el, Tag))
+        for tag in reversed(tags):
+            summary = _TextSummary()
+            shorts, alphas = [], []
+            alpha_len = 0
+            for child in tag.contents:
+                if isinstance(child, Tag):
+                    part = summaries[id(child)]
+                elif type(child) in TEXT_STRING_TYPES:
+                    part = self._summarize_string(child)
+                else:
+                    continue
+                
+                if summary.lead == summary.length:
+                    summary.lead += part.lead
+                if part.lead == part.length:
+                    summary.trail += part.length
+                else:
+                    summary.trail = part.trail
+                summary.length += part.length
+                
+                if summary.length < FOOTER_MAX_LEN:
+                    shorts.append(part.short)
+                if alphas is not None:
+                    if part.alpha is None or alpha_len + len(part.alpha) > self._ad_keyword_max_len:
+                        alphas = None
+                    else:
+                        alpha_len += len(part.alpha)
+                        alphas.append(part.alpha)
+                summary.info = summary.info or part.info
+                summary.ad = summary.ad or part.ad
+            
+            summary.short = ''.join(shorts) if summary.length < FOOTER_MAX_LEN else None
+            summary.alpha = ''.join(alphas) if alphas is not None else None
+            if tag.name == 'span' and not summary.ad:
+                summary.ad = summary.info or (
+                    summary.alpha is not None and
+                    summary.alpha.upper() in self._ad_keywords_upper
+                )
+            summaries[id(tag)] = summary
+        return summaries
+    
+    def _is_filtered_div(self, summary):
+        """Whether a div is an ad container or a short privacy/terms footer."""
+        if summary.ad:
+            return True
+        if summary.short is None:
+            return False
+        text = summary.short.lower()
+        return len(text) < FOOTER_MAX_LEN and any(term in text for term in FOOTER_TERMS)
     
     def clean_url(self, url):
         """Remove Google redirect tracking from URLs."""
@@ -78,30 +433,28 @@ class GoogleSearchEngine:
             return url
     
     def filter_html_content(self, soup):
-        """Remove ads, tracking, and unwanted content from HTML."""
-        
-        # Remove all JavaScript
-        for script in soup.find_all('script'):
-            script.decompose()
-        
-        # Remove Google logos and branding images
-        for img in soup.find_all('img'):
-            src = img.get('src', '')
-            if 'googlelogo' in src or 'google.com/images/branding' in src:
-                img.decompose()
-        
-        # Remove ad containers
-        for div in soup.find_all('div', recursive=True):
-            ad_spans = [span for span in div.find_all('span', recursive=True) 
-                       if self.has_ad_content(span.get_text())]
-            if ad_spans:
-                div.decompose()
+        """Remove ads, tracking, and unwanted content from HTML.
         
-        # Remove privacy/terms footer elements
-        for div in soup.find_all('div'):
-            text = div.get_text().lower()
-            if len(text) < 200 and any(term in text for term in ['privacy', 'terms', 'mumbai', 'maharashtra']):
-                div.decompose()
+        Subtree text facts are computed bottom-up once, keeping the
+        filtering linear in the size of the document.
+        """
+        started = time.perf_counter()
+        summaries = self._summarize_text(soup)
+        
+        # Remove JavaScript, Google branding images, ad containers and
+        # privacy/terms footer divs in one document-order walk. Outer
+        # divs are visited first, so only the outermost match is removed.
+        for element in list(soup.descendants):
+            if not isinstance(element, Tag) or element.decomposed:
+                continue
+            if element.name == 'script':
+                element.decompose()
+            elif element.name == 'img':
+                src = element.get('src', '')
+                if 'googlelogo' in src or 'google.com/images/branding' in src:
+                    element.decompose()
+            elif element.name == 'div' and self._is_filtered_div(summaries[id(element)]):
+                element.decompose()
         
         # Remove image sections with 'Images' and 'View all'
         for div in soup.find_all('div', class_='ezO2md'):
@@ -117,12 +470,15 @@ class GoogleSearchEngine:
                 if parent and len(parent.get_text()) < 100:
                     parent.decompose()
         
+        observe_stage('filter', 'google', time.perf_counter() - started)
         return soup
     
-    def extract_search_results(self, soup):
-        """Extract clean search results from filtered HTML."""
-        results = []
+    def extract_search_results(self, soup, limit=None):
+        """Extract clean search results from filtered HTML.
         
+        Containers are read in page order and extraction stops once
+        ``limit`` results have been collected.
+        """
         # Multiple selectors to find search result containers in different Google layouts
         result_containers = (
             soup.find_all('div', class_='g') or
@@ -143,6 +499,14 @@ class GoogleSearchEngine:
         
         logger.debug(f"Found {len(result_containers)} potential result containers")
         
+        results = list(islice(self._iter_search_results(result_containers), limit))
+        logger.info(f"Successfully extracted {len(results)} search results")
+        return results
+    
+    def _iter_search_results(self, result_containers):
+        """Yield a SearchResult for each container that holds a real result."""
+        summaries = {}
+        
         for container in result_containers:
             try:
                 # Multiple ways to find title
@@ -162,7 +526,7 @@ class GoogleSearchEngine:
                 # Multiple ways to find URL
                 link_elem = (
                     container.find('a', href=True) or
-                    title_elem if title_elem.name == 'a' else None
+                    (title_elem if title_elem.name == 'a' else None)
                 )
                 
                 if not link_elem:
@@ -187,13 +551,20 @@ class GoogleSearchEngine:
                     description = desc_elem.get_text().strip()
                 else:
                     # Strategy 2: Look for text content in divs
+                    # Text lengths are precomputed so only candidates of
+                    # the right size have their text built; containers are
+                    # summarized as they are reached, not the whole page
+                    if id(container) not in summaries:
+                        summaries.update(self._summarize_text(container))
+                    title_lower = title.lower()
                     desc_divs = container.find_all(['div', 'span', 'p'])
                     for div in desc_divs:
+                        if not 30 < summaries[id(div)].stripped_length < 400:
+                            continue
                         text = div.get_text().strip()
                         # Look for description-like content
-                        if (30 < len(text) < 400 and 
-                            not self.has_ad_content(text) and
-                            title.lower() not in text.lower()):
+                        if (not self.has_ad_content(text) and
+                            title_lower not in text.lower()):
                             description = text
                             break
                 
@@ -205,152 +576,494 @@ class GoogleSearchEngine:
                 if not url.startswith('http'):
                     continue
                 
-                results.append({
-                    'title': title,
-                    'url': url,
-                    'description': description
-                })
-                
                 logger.debug(f"Extracted result: {title[:50]}... -> {url[:50]}...")
                 
             except Exception as e:
                 logger.debug(f"Error extracting result: {e}")
                 continue
-        
-        logger.info(f"Successfully extracted {len(results)} search results")
-        return results
+            
+            yield SearchResult(title, url, description)
     
-    def search(self, query, num_results=15, retry_count=3):
-        """Perform Google search and return clean results."""
+    def search(self, query, num_results=15, retry_count=3, page=1):
+        """Perform Google search and return clean results.
+        
+        Results are served from the result cache when possible; concurrent
+        identical queries share a single upstream fetch.
+        
+        ``page`` selects results (page - 1) * num_results onwards. Later
+        pages, and more than MAX_PAGE_SIZE results, are assembled from
+        several upstream pages, see _search_paged.
+        """
         
         if not query or len(query.strip()) < 1:
             return {'error': 'Query cannot be empty'}
         
         # Sanitize query
         query = query.strip()[:500]  # Limit query length
+        page = max(1, int(page))
+        
+        compute = self.computation(query, num_results, retry_count, page)
+        response = self.cache.get_or_compute(self.cache_key(query, num_results, page), compute)
+        return self.degraded_response(query, num_results, page, response)
+    
+    def degraded_response(self, query, num_results, page, response):
+        """Stand in for a failed search with matches from the local index.
+        
+        Only backend failures are replaced; a backend finding nothing for
+        the query (NO_RESULTS_ERRORS) is an answer and passed on as is.
+        The upstream error stays in the result cache, so the index is asked
+        again on every request until a backend answers.
+        """
+        if ('error' not in response or response['error'] in NO_RESULTS_ERRORS or
+                self.local_index is None):
+            return response
+        local = self.search_local(query, num_results, page)
+        if not local.get('results'):
+            return response
+        logger.info(f"Serving local results for {query!r}: {response['error']}")
+        local['degraded'] = True
+        local['upstream_error'] = response['error']
+        return local
+    
+    def search_local(self, query, num_results=15, page=1):
+        """Answer from the local index of results fetched before.
+        
+        Takes milliseconds and never goes upstream, for outages and for
+        instant results shown while the real search runs.
+        """
+        if self.local_index is None or not query.strip():
+            return {'error': LOCAL_NO_RESULTS_ERROR}
+        start = (page - 1) * num_results
+        with time_stage('search', 'local'):
+            # One extra result tells whether there is a next page
+            hits = self.local_index.search(query, start + num_results + 1)
+        window = hits[start:start + num_results]
+        if not window:
+            return {'error': LOCAL_NO_RESULTS_ERROR}
+        response = results_response(query, window, source='Local')
+        response['page'] = page
+        response['has_more'] = len(hits) > start + num_results
+        return response
+    
+    def index_results(self, results):
+        """Add freshly extracted results to the local index."""
+        if self.local_index is None or not results:
+            return
+        try:
+            self.local_index.add(results)
+        except Exception as e:
+            logger.warning(f"Failed to index results locally: {e}")
+    
+    def computation(self, query, num_results=15, retry_count=3, page=1):
+        """The uncached fetch behind search(), as a function of no arguments."""
+        if self.is_paged(num_results, page):
+            return lambda: self._search_paged(query, num_results, page, retry_count)
+        if self.mode != 'fallback':
+            return lambda: self.remember_first_page(
+                query, num_results, self._search_federated(query, num_results, retry_count))
+        return lambda: self.remember_first_page(
+            query, num_results, self._search_google(query, num_results, retry_count))
+    
+    def cache_key(self, query, num_results, page=1):
+        """Result cache key for a search response."""
+        if self.mode != 'fallback':
+            backend = f"federated:{self.mode}"
+        else:
+            backend = 'google+duckduckgo' if self.use_fallback else 'google'
+        return (normalize_query(query), num_results, backend, page)
+    
+    @staticmethod
+    def is_paged(num_results, page):
+        return page > 1 or num_results > MAX_PAGE_SIZE
+    
+    @staticmethod
+    def page_key(backend, query, size, start):
+        """Result cache key for one upstream results page."""
+        return ('page', backend, normalize_query(query), size, start)
+    
+    def remember_first_page(self, query, num_results, response):
+        """Keep a first page from Google in the page cache for page 2 to build on."""
+        if response.get('results') and response.get('source', 'Google') == 'Google':
+            self.cache.set(self.page_key('google', query, num_results, 0), response)
+        return response
+    
+    def _search_paged(self, query, num_results, page, retry_count):
+        """Serve one page of a deep result set, bypassing the result cache.
+        
+        Every Google page up to the requested one is fetched concurrently
+        through the page cache, so moving on to the next page only fetches
+        what is new. Pages are joined in rank order and de-duplicated by
+        canonical URL. DuckDuckGo pages fill in when Google has nothing,
+        or are interleaved in 'merge' mode.
+        """
+        start = (page - 1) * num_results
+        end = min(start + num_results, MAX_RESULTS)
+        if start >= end:
+            return {'error': NO_MORE_RESULTS_ERROR}
+        size = num_results if num_results <= MAX_PAGE_SIZE else GOOGLE_PAGE_SIZE
+        
+        fetch_page = OutboundScheduler.bind(self._google_page)
+        futures = [self._executor.submit(fetch_page, query, size, offset, retry_count)
+                   for offset in range(0, end, size)]
+        results = []
+        error = None
+        for future in futures:
+            try:
+                response = future.result()
+            except Exception as e:
+                logger.error(f"Google page fetch failed: {e}")
+                response = {'error': 'Search processing failed'}
+            if not response.get('results'):
+                # A missing page would shift the rank of every later result
+                error = response
+                break
+            results.extend(response['results'])
+        # Filtering drops a few results from every page, so a page at least
+        # half full is taken to mean Google has more
+        more = error is None and len(response['results']) * 2 >= size
+        
+        source = 'Google'
+        if self.mode == 'merge' or (not results and (self.use_fallback or self.mode != 'fallback')):
+            ddg_results, ddg_more = self._duckduckgo_results(query, end)
+            more = more or ddg_more
+            if results and ddg_results:
+                results = merge_results(results, ddg_results)
+                source = 'Google+DuckDuckGo'
+            elif ddg_results:
+                results = ddg_results
+                source = 'DuckDuckGo'
+        
+        results = dedupe_results(results)
+        if not results:
+            return error or {'error': NO_RESULTS_ERROR}
+        window = results[start:end]
+        if not window:
+            return {'error': NO_MORE_RESULTS_ERROR}
+        response = results_response(query, window, source=source)
+        response['page'] = page
+        response['has_more'] = end < MAX_RESULTS and (len(results) > end or more)
+        return response
+    
+    def _google_page(self, query, size, start, retry_count):
+        return self.cache.get_or_compute(
+            self.page_key('google', query, size, start),
+            lambda: self._search_google(query, size, retry_count, use_fallback=False, start=start))
+    
+    def _duckduckgo_results(self, query, wanted):
+        """About wanted DuckDuckGo results, following its Next form.
+        
+        Each page's form carries the token for the next one, so unlike
+        Google's these pages can only be fetched one after another.
+        Returns the results and whether there is a further page.
+        """
+        results = []
+        next_page = None
+        while len(results) < wanted:
+            offset = int(next_page.get('s') or 0) if next_page else 0
+            # Bind this page's form: a stale entry is refreshed after the loop is over
+            response = self.cache.get_or_compute(
+                self.page_key('duckduckgo', query, 0, offset),
+                lambda next_page=next_page: self.search_duckduckgo(
+                    query, None, next_page=next_page, with_next=True))
+            if not response.get('results'):
+                break
+            results.extend(response['results'])
+            next_page = response.get('next_page')
+            if not next_page:
+                break
+        return dedupe_results(results), bool(next_page)
+    
+    def search_batch(self, queries, num_results=10, concurrency=8, deadline=10.0):
+        """Run several searches concurrently and report on each, in order.
+        
+        At most ``concurrency`` searches run at once, on a pool of their
+        own so they never queue behind the backend fan-out on the engine
+        pool. Their upstream requests go out at BATCH priority, behind
+        interactive searches and autocomplete, and wait for the outbound
+        scheduler no longer than the batch has left. Searches still
+        running after ``deadline`` seconds are reported as timed out; they
+        finish in the background and land in the cache for the next caller.
+        """
+        if not queries:
+            return []
+        ends = time.monotonic() + deadline
+        max_wait = self.scheduler.max_wait[BATCH]
+        
+        def run(query):
+            started = time.monotonic()
+            cached = self.cache.peek(self.cache_key(query.strip()[:500], num_results)) is not None
+            with OutboundScheduler.priority(BATCH, max(0.0, min(max_wait, ends - started))):
+                response = self.search(query, num_results)
+            return response, cached, time.monotonic() - started
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(queries))),
+                                      thread_name_prefix='search-batch')
+        futures = [executor.submit(run, query) for query in queries]
+        wait(futures, timeout=deadline)
+        executor.shutdown(wait=False, cancel_futures=True)
+        
+        items = []
+        for query, future in zip(queries, futures):
+            item = {'query': query}
+            if not future.done() or future.cancelled():
+                item.update(status='timeout', error='Search did not finish before the deadline')
+                items.append(item)
+                continue
+            try:
+                response, cached, elapsed = future.result()
+            except Exception as e:
+                logger.error(f"Batch search for {query!r} failed: {e}")
+                item.update(status='error', error='Search processing failed')
+                items.append(item)
+                continue
+            if 'error' in response:
+                item.update(status='error', error=response['error'])
+            else:
+                item.update(status='ok', source=response.get('source', 'Google'),
+                            total_results=response.get('total_results', 0),
+                            results=response['results'])
+                if response.get('degraded'):
+                    item['degraded'] = True
+            item.update(cached=cached, elapsed_ms=round(elapsed * 1000, 1))
+            items.append(item)
+        return items
+    
+    def _search_federated(self, query, num_results, retry_count):
+        """Query Google and DuckDuckGo concurrently, bypassing the cache.
+        
+        'race' starts both backends at once and 'hedge' starts DuckDuckGo
+        only if Google has not answered within hedge_delay; both return the
+        first non-empty result set. 'merge' waits for both, up to the
+        latency budget, and interleaves their results. Once an answer is
+        chosen the slower backend is told to stop retrying.
+        """
+        cancel = threading.Event()
+        deadline = time.monotonic() + self.latency_budget
+        backends = {
+            'Google': lambda: self._search_google(query, num_results, retry_count,
+                                                  use_fallback=False, cancel=cancel),
+            'DuckDuckGo': lambda: self.search_duckduckgo(query, num_results),
+        }
+        pending = {}
+        responses = {}
+        
+        def start(name):
+            pending[self._executor.submit(OutboundScheduler.bind(backends[name]))] = name
+        
+        try:
+            start('Google')
+            if self.mode == 'hedge':
+                done, _ = wait(pending, timeout=self.hedge_delay)
+                if not done:
+                    logger.info(f"Google slower than {self.hedge_delay}s, hedging with DuckDuckGo")
+                    start('DuckDuckGo')
+            else:
+                start('DuckDuckGo')
+            
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Latency budget exhausted waiting for {sorted(pending.values())}")
+                    break
+                done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    try:
+                        responses[name] = future.result()
+                    except Exception as e:
+                        logger.error(f"{name} backend failed: {e}")
+                        responses[name] = {'error': f'{name} search failed'}
+                    answer = self.federated_answer(name, responses[name])
+                    if answer is not None:
+                        return answer
+                # A hedged Google that failed fast still gets its hedge
+                if not pending and len(responses) < len(backends):
+                    start('DuckDuckGo')
+        finally:
+            cancel.set()
+        
+        return self.federated_response(query, backends, responses)
+    
+    def federated_answer(self, name, response):
+        """The response to return as soon as backend name answers, or None to wait on."""
+        if self.mode != 'merge' and response.get('results'):
+            return self._tag_source(response, name)
+        return None
+    
+    def federated_response(self, query, backends, responses):
+        """Choose or merge an answer from the backends that have responded."""
+        # Rank order favours Google, whichever backend finished first
+        good = {name: responses[name] for name in backends
+                if name in responses and responses[name].get('results')}
+        if len(good) > 1:
+            results = merge_results(*(r['results'] for r in good.values()))
+            return results_response(query, results, source='+'.join(good))
+        if good:
+            name, response = good.popitem()
+            return self._tag_source(response, name)
+        for name in backends:
+            if name in responses:
+                return responses[name]
+        return {'error': 'Search request timed out'}
+    
+    @staticmethod
+    def _tag_source(response, name):
+        response.setdefault('source', name)
+        return response
+    
+    @staticmethod
+    def _backoff(seconds, cancel):
+        """Sleep between retries; returns True if the search was cancelled."""
+        if cancel is None:
+            time.sleep(seconds)
+            return False
+        return cancel.wait(seconds)
+    
+    def _search_google(self, query, num_results, retry_count, use_fallback=None, cancel=None,
+                       start=0):
+        """Fetch and parse Google results, bypassing the cache.
+        
+        When ``cancel`` is set, retries and backoff sleeps stop early.
+        """
+        return self._run_plan(
+            self.google_plan(query, num_results, retry_count, use_fallback, cancel, start), cancel)
+    
+    def _run_plan(self, plan, cancel=None):
+        """Carry out a search plan's steps on this thread; returns its response."""
+        reply = error = None
+        while True:
+            try:
+                step = plan.send(reply) if error is None else plan.throw(error)
+            except StopIteration as stop:
+                return stop.value
+            reply = error = None
+            try:
+                reply = self._perform(step, cancel)
+            except Exception as e:
+                error = e
+    
+    def _perform(self, step, cancel):
+        kind = step[0]
+        if kind == FETCH:
+            _, backend, url, headers, cookies = step
+            self.scheduler.acquire(backend)
+            started = time.monotonic()
+            try:
+                # The page is decoded once and that text is all we keep
+                status_code, text = self.http.get_text(url, backend=backend, headers=headers,
+                                                       cookies=cookies)
+            except requests.exceptions.Timeout as e:
+                raise UpstreamTimeout(str(e), time.monotonic() - started) from e
+            except requests.exceptions.RequestException as e:
+                raise UpstreamError(str(e), time.monotonic() - started) from e
+            return status_code, text, time.monotonic() - started
+        if kind == BACKOFF:
+            return self._backoff(step[1], cancel)
+        return step[1](*step[2:])
+    
+    def google_plan(self, query, num_results, retry_count, use_fallback=None, cancel=None,
+                    start=0):
+        """Search Google, as a generator of steps for _run_plan or the async engine."""
+        if use_fallback is None:
+            use_fallback = self.use_fallback
+        
+        google = self.health.get('google')
+        if not google.allow():
+            logger.info("Google circuit open, skipping Google")
+            if use_fallback:
+                return (yield from self.duckduckgo_plan(query, num_results))
+            return {'error': GOOGLE_UNAVAILABLE_ERROR}
         
-        # Build search URL - try different parameters
-        encoded_query = urllib.parse.quote_plus(query)
         # Try without gbv=1 first, as it might be causing the JavaScript requirement
-        search_url = f"https://www.google.com/search?num={num_results}&q={encoded_query}"
+        basic_html = self.use_basic_html()
+        search_url = self.google_url(query, num_results, gbv=basic_html, start=start)
         
         for attempt in range(retry_count):
+            if cancel is not None and cancel.is_set():
+                return {'error': 'Search cancelled'}
             try:
                 logger.info(f"Searching Google for: {query} (attempt {attempt + 1})")
                 
-                response = requests.get(
-                    search_url,
-                    headers=self.headers,
-                    cookies=self.cookies,
-                    timeout=10
-                )
+                status_code, page, latency = yield (FETCH, 'google', search_url,
+                                                    self.headers, self.cookies)
                 
                 # Check for CAPTCHA
-                if 'captcha-form' in response.text:
+                if 'captcha-form' in page:
                     logger.warning("CAPTCHA detected")
-                    return {'error': 'Search temporarily blocked. Please try again later.'}
+                    google.record_failure(latency, captcha=True)
+                    return {'error': GOOGLE_UNAVAILABLE_ERROR}
                 
                 # Check response status
-                if response.status_code != 200:
-                    logger.warning(f"HTTP {response.status_code} response")
+                if status_code != 200:
+                    logger.warning(f"HTTP {status_code} response")
+                    google.record_failure(latency, trip=status_code == 429)
                     if attempt < retry_count - 1:
-                        time.sleep(2 ** attempt)  # Exponential backoff
+                        if (yield (BACKOFF, 2 ** attempt)):  # Exponential backoff
+                            return {'error': 'Search cancelled'}
                         continue
                     return {'error': 'Search service unavailable'}
                 
-                # Parse HTML
-                soup = BeautifulSoup(response.content, 'html.parser')
-                
                 # Log some debug info about the response
-                logger.debug(f"Response content length: {len(response.content)}")
-                logger.debug(f"Response contains 'did not match': {'did not match' in response.text}")
-                
-                # Extract results before heavy filtering to preserve structure
-                results = self.extract_search_results(soup)
+                logger.debug(f"Response content length: {len(page)}")
                 
-                # If no results found, try with minimal filtering
-                if not results:
-                    logger.warning("No results found, trying with minimal filtering")
-                    # Just remove scripts but keep structure for debugging
-                    for script in soup.find_all('script'):
-                        script.decompose()
-                    results = self.extract_search_results(soup)
+                results = yield (PARSE, self.google_results_from_page, page, num_results)
+                if results:
+                    self.record_google_success(google, latency, basic_html)
+                    return results_response(query, results)
                 
                 # If still no results, let's debug what we're getting
-                if not results:
-                    logger.error("Still no results found, debugging response")
-                    # Check if this is a CAPTCHA or blocked response
-                    try:
-                        response_text = response.text
-                    except UnicodeDecodeError:
-                        # Handle encoding issues
-                        response_text = response.content.decode('utf-8', errors='ignore')
-                    
-                    if any(keyword in response_text.lower() for keyword in ['captcha', 'blocked', 'automated']):
-                        return {'error': 'Search blocked by Google. Please try again later.'}
-                    
-                    # Check for JavaScript requirement
-                    if 'noscript' in response_text.lower() and 'enablejs' in response_text:
-                        logger.warning("Google requires JavaScript, trying with gbv=1")
-                        # Try with gbv=1 parameter
-                        alt_search_url = f"https://www.google.com/search?gbv=1&num={num_results}&q={encoded_query}"
-                        if search_url != alt_search_url:
-                            logger.info("Retrying with gbv=1 parameter")
-                            alt_response = requests.get(
-                                alt_search_url,
-                                headers=self.headers,
-                                cookies=self.cookies,
-                                timeout=10
-                            )
-                            if alt_response.status_code == 200:
-                                alt_soup = BeautifulSoup(alt_response.content, 'html.parser')
-                                alt_results = self.extract_search_results(alt_soup)
-                                if alt_results:
-                                    return {
-                                        'query': query,
-                                        'results': alt_results,
-                                        'total_results': len(alt_results),
-                                        'timestamp': datetime.now().isoformat()
-                                    }
-                        # If Google isn't working and fallback is enabled, try DuckDuckGo
-                        if self.use_fallback:
-                            logger.info("Google failed, falling back to DuckDuckGo")
-                            return self.search_duckduckgo(query, num_results)
-                        return {'error': 'Google requires JavaScript which is not supported.'}
-                    
-                    # Check for "did not match" message
-                    if 'did not match' in response_text:
-                        return {'error': 'No matching results found for this query.'}
-                    
-                    # Check if response is compressed/garbled
-                    if len(response_text) < 1000 or response_text.count('�') > 10:
-                        logger.warning("Response appears to be compressed or corrupted")
-                        return {'error': 'Received corrupted response from Google. Please try again.'}
-                    
-                    # Debug: save first 500 readable chars of response
-                    readable_content = ''.join(c for c in response_text[:500] if ord(c) < 128)
-                    logger.debug(f"Readable response preview: {readable_content}")
-                    
-                    return {'error': 'Could not extract results from Google response. The page structure may have changed.'}
+                logger.error("Still no results found, debugging response")
+                error = self.google_page_error(page)
+                page = None  # not needed while the gbv=1 page is fetched
+                if error is not JAVASCRIPT_REQUIRED:
+                    self.record_page_error(google, error, latency)
+                    return error
+                
+                # Try with gbv=1 parameter
+                alt_search_url = self.google_url(query, num_results, gbv=True, start=start)
+                if search_url == alt_search_url:
+                    google.record_failure(latency)
+                elif not (cancel and cancel.is_set()):
+                    # Other requests go straight to gbv=1 for a while
+                    self.health.get('google-noscript').record_failure(trip=True)
+                    logger.info("Retrying with gbv=1 parameter")
+                    alt_status, alt_page, latency = yield (FETCH, 'google', alt_search_url,
+                                                           self.headers, self.cookies)
+                    if alt_status == 200:
+                        alt_results = yield (PARSE, self.google_results_from_page,
+                                             alt_page, num_results)
+                        if alt_results:
+                            google.record_success(latency)
+                            return results_response(query, alt_results)
+                    google.record_failure(latency, trip=alt_status == 429)
+                # If Google isn't working and fallback is enabled, try DuckDuckGo
+                if use_fallback:
+                    logger.info("Google failed, falling back to DuckDuckGo")
+                    return (yield from self.duckduckgo_plan(query, num_results))
+                return {'error': 'Google requires JavaScript which is not supported.'}
                 
-                return {
-                    'query': query,
-                    'results': results,
-                    'total_results': len(results),
-                    'timestamp': datetime.now().isoformat()
-                }
+            except OutboundBusy:
+                # Not Google's fault, so the breaker is left alone
+                if use_fallback:
+                    logger.info("Google rate limit reached, using DuckDuckGo")
+                    return (yield from self.duckduckgo_plan(query, num_results))
+                return {'error': BUSY_ERROR, 'transient': True}
                 
-            except requests.exceptions.Timeout:
+            except UpstreamTimeout as e:
                 logger.warning(f"Search timeout (attempt {attempt + 1})")
+                google.record_failure(e.latency)
                 if attempt < retry_count - 1:
-                    time.sleep(1)
+                    if (yield (BACKOFF, 1)):
+                        return {'error': 'Search cancelled'}
                     continue
                 return {'error': 'Search request timed out'}
                 
-            except requests.exceptions.RequestException as e:
+            except UpstreamError as e:
                 logger.error(f"Search request failed: {e}")
+                google.record_failure(e.latency)
                 if attempt < retry_count - 1:
-                    time.sleep(2 ** attempt)
+                    if (yield (BACKOFF, 2 ** attempt)):
+                        return {'error': 'Search cancelled'}
                     continue
                 return {'error': 'Network error occurred'}
                 
@@ -359,76 +1072,217 @@ class GoogleSearchEngine:
                 return {'error': 'Search processing failed'}
         
         # Final fallback to DuckDuckGo if Google completely fails
-        if self.use_fallback:
+        if use_fallback:
             logger.info("Google search failed completely, trying DuckDuckGo as fallback")
-            return self.search_duckduckgo(query, num_results)
+            return (yield from self.duckduckgo_plan(query, num_results))
         
         return {'error': 'Search failed after multiple attempts'}
     
-    def search_duckduckgo(self, query, num_results=15):
-        """Fallback search using DuckDuckGo HTML search."""
+    def use_basic_html(self):
+        """True while Google keeps answering the normal page with a JavaScript wall."""
+        return not self.health.get('google-noscript').allow()
+    
+    def record_google_success(self, google, latency, basic_html):
+        google.record_success(latency)
+        if not basic_html:
+            self.health.get('google-noscript').record_success()
+    
+    @staticmethod
+    def record_page_error(backend, error, latency):
+        """A page without results counts as a failure unless nothing matched."""
+        if error['error'] == GOOGLE_NO_MATCH_ERROR:
+            backend.record_success(latency)
+        else:
+            backend.record_failure(latency, captcha=error['error'] == GOOGLE_BLOCKED_ERROR)
+    
+    def google_url(self, query, num_results, gbv=False, start=0):
+        encoded_query = urllib.parse.quote_plus(query)
+        offset = f"&start={start}" if start else ''
+        if gbv:
+            return f"{self.google_search_url}?gbv=1&num={num_results}{offset}&q={encoded_query}"
+        return f"{self.google_search_url}?num={num_results}{offset}&q={encoded_query}"
+    
+    def duckduckgo_url(self, query, next_page=None):
+        if next_page:
+            return f"{self.duckduckgo_html_url}?{urllib.parse.urlencode(next_page)}"
+        encoded_query = urllib.parse.quote_plus(query)
+        return f"{self.duckduckgo_html_url}?q={encoded_query}"
+    
+    def google_results_from_page(self, content, limit=None):
+        """Parse a Google results page and extract up to limit results.
+        
+        The parse tree is torn down as soon as the results are out, rather
+        than left for the garbage collector to find among its cycles.
+        """
+        with time_stage('parse', 'google'):
+            soup = self.parser.parse(content, GOOGLE_RESULT_STRAINER)
         try:
-            logger.info(f"Searching DuckDuckGo for: {query}")
+            # Extract results before heavy filtering to preserve structure
+            with time_stage('extract', 'google'):
+                results = self.extract_search_results(soup, limit)
             
-            # DuckDuckGo search URL
-            encoded_query = urllib.parse.quote_plus(query)
-            ddg_url = f"https://html.duckduckgo.com/html/?q={encoded_query}"
+            # Partial parses only know the usual result containers
+            if not results and self.parser.partial:
+                logger.debug("No results in partial parse, parsing full page")
+                release_soup(soup)
+                with time_stage('parse', 'google'):
+                    soup = self.parser.parse(content)
+                with time_stage('extract', 'google'):
+                    results = self.extract_search_results(soup, limit)
             
-            ddg_headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
+            # If no results found, try with minimal filtering
+            if not results:
+                logger.warning("No results found, trying with minimal filtering")
+                # Just remove scripts but keep structure for debugging
+                with time_stage('filter', 'google'):
+                    for script in soup.find_all('script'):
+                        script.decompose()
+                with time_stage('extract', 'google'):
+                    results = self.extract_search_results(soup, limit)
+        finally:
+            release_soup(soup)
+        
+        self.index_results(results)
+        return results
+    
+    def google_page_error(self, response_text):
+        """Explain why a Google page yielded no results.
+        
+        Returns an error dict, or JAVASCRIPT_REQUIRED when the page should
+        be retried with gbv=1.
+        """
+        # Check if this is a CAPTCHA or blocked response; the patterns
+        # ignore case so no lower-cased copy of the page is made
+        if BLOCKED_PAGE_PATTERN.search(response_text):
+            return {'error': GOOGLE_BLOCKED_ERROR}
+        
+        # Check for JavaScript requirement
+        if NOSCRIPT_PATTERN.search(response_text) and 'enablejs' in response_text:
+            logger.warning("Google requires JavaScript, trying with gbv=1")
+            return JAVASCRIPT_REQUIRED
+        
+        # Check for "did not match" message
+        if 'did not match' in response_text:
+            return {'error': GOOGLE_NO_MATCH_ERROR}
+        
+        # Check if response is compressed/garbled
+        if len(response_text) < 1000 or response_text.count('�') > 10:
+            logger.warning("Response appears to be compressed or corrupted")
+            return {'error': 'Received corrupted response from Google. Please try again.'}
+        
+        # Debug: save first 500 readable chars of response
+        readable_content = ''.join(c for c in response_text[:500] if ord(c) < 128)
+        logger.debug(f"Readable response preview: {readable_content}")
+        
+        return {'error': 'Could not extract results from Google response. The page structure may have changed.'}
+    
+    def search_duckduckgo(self, query, num_results=15, next_page=None, with_next=False):
+        """Fallback search using DuckDuckGo HTML search.
+        
+        next_page holds the fields of a previous page's Next form; with
+        with_next the response carries this page's as 'next_page'.
+        """
+        return self._run_plan(self.duckduckgo_plan(query, num_results, next_page, with_next))
+    
+    def duckduckgo_plan(self, query, num_results=15, next_page=None, with_next=False):
+        """Search DuckDuckGo, as a generator of steps like google_plan."""
+        duckduckgo = self.health.get('duckduckgo')
+        if not duckduckgo.allow():
+            logger.info("DuckDuckGo circuit open, skipping DuckDuckGo")
+            return {'error': 'DuckDuckGo search failed'}
+        try:
+            logger.info(f"Searching DuckDuckGo for: {query}")
             
-            response = requests.get(ddg_url, headers=ddg_headers, timeout=10)
+            status_code, page, latency = yield (FETCH, 'duckduckgo',
+                                                self.duckduckgo_url(query, next_page),
+                                                self.ddg_headers, None)
             
-            if response.status_code != 200:
+            if status_code != 200:
+                duckduckgo.record_failure(latency, trip=status_code in (403, 429))
                 return {'error': 'DuckDuckGo search failed'}
             
-            soup = BeautifulSoup(response.content, 'html.parser')
-            results = []
-            
-            # Extract DuckDuckGo results
-            result_links = soup.find_all('a', class_='result__a')
-            
-            for i, link in enumerate(result_links[:num_results]):
-                try:
-                    title = link.get_text().strip()
-                    url = link.get('href', '')
-                    
-                    if not title or not url:
-                        continue
-                    
-                    # Clean the URL (DuckDuckGo sometimes uses redirects)
-                    url = self.clean_url(url)
-                    
-                    # Get description from the result snippet
-                    description = ""
-                    result_container = link.find_parent('div', class_='result')
-                    if result_container:
-                        snippet = result_container.find('a', class_='result__snippet')
-                        if snippet:
-                            description = snippet.get_text().strip()
-                    
-                    results.append({
-                        'title': title,
-                        'url': url,
-                        'description': description
-                    })
-                    
-                except Exception as e:
-                    logger.debug(f"Error extracting DuckDuckGo result: {e}")
-                    continue
-            
-            if results:
-                return {
-                    'query': query,
-                    'results': results,
-                    'total_results': len(results),
-                    'timestamp': datetime.now().isoformat(),
-                    'source': 'DuckDuckGo'
-                }
-            else:
-                return {'error': 'No results found on DuckDuckGo'}
+            duckduckgo.record_success(latency)
+            return (yield (PARSE, self.duckduckgo_response, query, page, num_results, with_next))
                 
+        except OutboundBusy:
+            return {'error': BUSY_ERROR, 'transient': True}
+        except UpstreamError as e:
+            logger.error(f"DuckDuckGo search error: {e}")
+            duckduckgo.record_failure(e.latency)
+            return {'error': 'DuckDuckGo search failed'}
         except Exception as e:
             logger.error(f"DuckDuckGo search error: {e}")
-            return {'error': 'DuckDuckGo search failed'}
\ No newline at end of file
+            return {'error': 'DuckDuckGo search failed'}
+    
+    def duckduckgo_response(self, query, content, num_results=15, with_next=False):
+        """Build the search response for a DuckDuckGo HTML results page."""
+        with time_stage('parse', 'duckduckgo'):
+            soup = self.parser.parse(content, DUCKDUCKGO_RESULT_STRAINER)
+        try:
+            return self._duckduckgo_response(query, soup, num_results, with_next)
+        finally:
+            release_soup(soup)
+    
+    def _duckduckgo_response(self, query, soup, num_results, with_next):
+        extract_started = time.perf_counter()
+        results = []
+        
+        # Extract DuckDuckGo results
+        result_links = soup.find_all('a', class_='result__a')
+        
+        for i, link in enumerate(result_links[:num_results]):
+            try:
+                title = link.get_text().strip()
+                url = link.get('href', '')
+                
+                if not title or not url:
+                    continue
+                
+                # Clean the URL (DuckDuckGo sometimes uses redirects)
+                url = self.clean_url(url)
+                
+                # Get description from the result snippet
+                description = ""
+                result_container = link.find_parent('div', class_='result')
+                if result_container:
+                    snippet = result_container.find('a', class_='result__snippet')
+                    if snippet:
+                        description = snippet.get_text().strip()
+                
+                results.append(SearchResult(title, url, description))
+                
+            except Exception as e:
+                logger.debug(f"Error extracting DuckDuckGo result: {e}")
+                continue
+        observe_stage('extract', 'duckduckgo', time.perf_counter() - extract_started)
+        self.index_results(results)
+        
+        if results:
+            response = results_response(query, results, source='DuckDuckGo')
+            if with_next:
+                response['next_page'] = self.duckduckgo_next_page(soup)
+            return response
+        return {'error': DUCKDUCKGO_NO_RESULTS_ERROR}
+    
+    @staticmethod
+    def duckduckgo_next_page(soup):
+        """Fields of the Next form on a DuckDuckGo HTML page, or None."""
+        for form in soup.select('div.nav-link form'):
+            if form.find('input', attrs={'type': 'submit', 'value': 'Next'}):
+                return {field['name']: field.get('value', '')
+                        for field in form.find_all('input', attrs={'type': 'hidden', 'name': True})}
+        return None
+    
+    def autocomplete(self, q, timeout=5):
+        """Fetch query suggestions from the DuckDuckGo autocomplete API.
+        
+        Raises OutboundBusy when the DuckDuckGo rate limit has no room.
+        """
+        self.scheduler.acquire('autocomplete')
+        response = self.http.get(self.autocomplete_url,
+                                 backend='autocomplete',
+                                 params={'q': q, 'type': 'list'},
+                                 timeout=(self.http.timeout[0], timeout))
+        if response.status_code != 200:
+            return []
+        return parse_suggestions(response.json())
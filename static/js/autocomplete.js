@@ -5,6 +5,17 @@ let autocompleteResults = [];
 let debounceTimeout;
 let activeSearchInput = null;
 
+// Suggestions fetched on this page, least recently used first
+const SUGGESTION_CACHE_SIZE = 200;
+const suggestionCache = new Map();
+let pendingRequest = null;  // AbortController of the request in flight
+let inputSequence = 0;      // bumped on every keystroke
+
+// Debounce adapts to how long suggestion requests take
+const MIN_DEBOUNCE = 100;
+const MAX_DEBOUNCE = 400;
+let latencyEstimate = 150;
+
 document.addEventListener('DOMContentLoaded', function() {
     // Support both search bars
     const homeSearchBar = document.getElementById('search-bar');
@@ -39,45 +50,131 @@ document.addEventListener('DOMContentLoaded', function() {
 const handleUserInput = (inputElement) => {
     activeSearchInput = inputElement;
     const query = inputElement.value.trim();
+    const sequence = ++inputSequence;
     
     // Clear existing timeout
     clearTimeout(debounceTimeout);
     
     if (query.length === 0) {
+        cancelSuggestionRequest();
         hideAutocomplete();
         return;
     }
     
-    // Debounce the request to avoid spam
+    // Answer from suggestions already fetched on this page when possible
+    const cached = cachedSuggestions(query);
+    if (cached) {
+        cancelSuggestionRequest();
+        showSuggestions(query, cached);
+        return;
+    }
+    
+    // Debounce the request to avoid spam; a request still in flight is
+    // left to finish meanwhile, as its answer may cover this query too
     debounceTimeout = setTimeout(() => {
-        fetchSuggestions(query);
-    }, 150);
+        const cached = cachedSuggestions(query);
+        if (cached) {
+            cancelSuggestionRequest();
+            showSuggestions(query, cached);
+        } else {
+            fetchSuggestions(query, sequence);
+        }
+    }, debounceDelay());
+};
+
+// Wait about as long as a request takes: one sent sooner would mostly be
+// superseded by the next keystroke before it is answered
+const debounceDelay = () => {
+    return Math.round(Math.min(MAX_DEBOUNCE, Math.max(MIN_DEBOUNCE, latencyEstimate)));
+};
+
+const recordLatency = (elapsed) => {
+    latencyEstimate += (elapsed - latencyEstimate) * 0.3;
 };
 
-const fetchSuggestions = async (query) => {
+const normalizeQuery = (query) => query.toLowerCase().split(/\s+/).filter(Boolean).join(' ');
+
+// Suggestions for query from the page cache, or null. A longer query is
+// answered by filtering the suggestions of a shorter one the server said
+// were complete (X-Suggestions-Complete)
+const cachedSuggestions = (query) => {
+    const key = normalizeQuery(query);
+    const entry = suggestionCache.get(key);
+    if (entry) {
+        // Most recently used last
+        suggestionCache.delete(key);
+        suggestionCache.set(key, entry);
+        return entry.suggestions;
+    }
+    for (let end = key.length - 1; end > 0; end--) {
+        const shorter = suggestionCache.get(key.substring(0, end));
+        if (shorter && shorter.complete) {
+            return shorter.suggestions.filter(suggestion => normalizeQuery(suggestion).startsWith(key));
+        }
+    }
+    return null;
+};
+
+const rememberSuggestions = (query, suggestions, complete) => {
+    const key = normalizeQuery(query);
+    suggestionCache.delete(key);
+    suggestionCache.set(key, { suggestions, complete });
+    if (suggestionCache.size > SUGGESTION_CACHE_SIZE) {
+        suggestionCache.delete(suggestionCache.keys().next().value);
+    }
+};
+
+const cancelSuggestionRequest = () => {
+    if (pendingRequest) {
+        pendingRequest.abort();
+        pendingRequest = null;
+    }
+};
+
+const fetchSuggestions = async (query, sequence) => {
+    // A newer request supersedes the one in flight
+    cancelSuggestionRequest();
+    const controller = new AbortController();
+    pendingRequest = controller;
+    const started = performance.now();
+    
     try {
-        const response = await fetch('/autocomplete', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ q: query })
+        // GET, so the browser's HTTP cache can answer repeated prefixes too
+        const response = await fetch(`/autocomplete?q=${encodeURIComponent(query)}`, {
+            signal: controller.signal
         });
         
         if (response.ok) {
             const data = await response.json();
-            autocompleteResults = data[1] || [];
-            originalSearch = data[0] || query;
-            updateAutocompleteList();
-        } else {
+            recordLatency(performance.now() - started);
+            const suggestions = data[1] || [];
+            rememberSuggestions(query, suggestions, response.headers.get('X-Suggestions-Complete') === '1');
+            // Only show it if nothing was typed since it was asked for
+            if (sequence === inputSequence) {
+                showSuggestions(data[0] || query, suggestions);
+            }
+        } else if (sequence === inputSequence) {
             hideAutocomplete();
         }
     } catch (error) {
+        if (error.name === 'AbortError') return;
         console.error('Autocomplete error:', error);
-        hideAutocomplete();
+        if (sequence === inputSequence) {
+            hideAutocomplete();
+        }
+    } finally {
+        if (pendingRequest === controller) {
+            pendingRequest = null;
+        }
     }
 };
 
+const showSuggestions = (query, suggestions) => {
+    autocompleteResults = suggestions;
+    originalSearch = query;
+    updateAutocompleteList();
+};
+
 const updateAutocompleteList = () => {
     // Determine which autocomplete list ID to use
     const isResultsPage = activeSearchInput && activeSearchInput.id === 'search-bar-results';
@@ -0,0 +1,269 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from cache import ResultCache, normalize_query
+
+logger = logging.getLogger(__name__)
+
+SUGGESTION_MODES = ('upstream', 'local', 'blend')
+
+
+class _Node:
+    __slots__ = ('children', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.top = []  # [(score, query)], best first, at most k entries
+
+
+class PrefixIndex:
+    """Prefix trie that keeps the top-k completions at every node.
+
+    Scores use forward exponential decay: a hit at time t adds
+    2 ** ((t - epoch) / half_life), so newer hits count for more while
+    existing scores never have to be rescaled. Because scores only ever
+    grow, each node's top-k list can be maintained on insert alone and a
+    lookup is a walk down the prefix plus a copy of at most k entries.
+    """
+
+    def __init__(self, k=10, half_life=7 * 24 * 3600, max_length=100, epoch=None):
+        self.k = k
+        self.half_life = half_life
+        self.max_length = max_length
+        self.epoch = time.time() if epoch is None else epoch
+        self._root = _Node()
+        self._scores = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def weight(self, timestamp):
+        return 2.0 ** ((timestamp - self.epoch) / self.half_life)
+
+    def add(self, query, timestamp=None, count=1):
+        """Record count hits of query at timestamp (default: now)."""
+        query = normalize_query(query)
+        if not query or len(query) > self.max_length:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            score = self._scores.get(query, 0.0) + count * self.weight(timestamp)
+            self._scores[query] = score
+            node = self._root
+            self._update_top(node, query, score)
+            for char in query:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _Node()
+                node = child
+                self._update_top(node, query, score)
+
+    def complete(self, prefix, limit=None):
+        """Return up to limit completions of prefix, best first."""
+        trailing_space = prefix[-1:].isspace()
+        prefix = normalize_query(prefix)
+        if not prefix:
+            return []
+        if trailing_space:
+            prefix += ' '  # "python " should not complete to "python"
+        with self._lock:
+            node = self._root
+            for char in prefix:
+                node = node.children.get(char)
+                if node is None:
+                    return []
+            return [query for _, query in node.top[:limit or self.k]]
+
+    def _update_top(self, node, query, score):
+        top = node.top
+        for i, (_, existing) in enumerate(top):
+            if existing == query:
+                del top[i]
+                break
+        else:
+            if len(top) >= self.k and score <= top[-1][0]:
+                return
+        # Lists are at most k long, so a linear insert is cheapest
+        i = 0
+        while i < len(top) and top[i][0] >= score:
+            i += 1
+        top.insert(i, (score, query))
+        del top[self.k:]
+
+
+def blend_suggestions(local, upstream, limit=10):
+    """Local suggestions first, then upstream ones not already shown."""
+    seen = set()
+    blended = []
+    for suggestion in list(local) + list(upstream):
+        key = normalize_query(suggestion)
+        if key in seen:
+            continue
+        seen.add(key)
+        blended.append(suggestion)
+        if len(blended) >= limit:
+            break
+    return blended
+
+
+class SuggestionCache:
+    """Server-side cache of upstream autocomplete suggestions.
+
+    A longer prefix can be answered by filtering a cached shorter one when
+    that list is known to be complete: upstream returned fewer than
+    ``upstream_limit`` suggestions, so nothing was cut off, and every one
+    of them was a plain completion of the shorter prefix.
+    """
+
+    def __init__(self, cache=None, upstream_limit=8, max_backtrack=8):
+        self.cache = cache if cache is not None else ResultCache(
+            max_entries=20000, max_bytes=8 * 1024 * 1024, ttl=600)
+        self.upstream_limit = upstream_limit
+        self.max_backtrack = max_backtrack
+        self.derived = 0
+
+    def lookup(self, q):
+        """Return cached suggestions for q, or None if upstream is needed."""
+        key = normalize_query(q)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry['suggestions']
+        for end in range(len(key) - 1, max(0, len(key) - self.max_backtrack - 1), -1):
+            entry = self.cache.peek(key[:end])
+            if entry is not None and entry['complete']:
+                self.derived += 1
+                return [s for s in entry['suggestions'] if normalize_query(s).startswith(key)]
+        return None
+
+    def get_or_fetch(self, q, fetch):
+        """Return suggestions for q, calling fetch(q) at most once per prefix."""
+        suggestions = self.lookup(q)
+        if suggestions is not None:
+            return suggestions
+        key = normalize_query(q)
+        return self.cache.get_or_compute(key, lambda: self._entry(key, fetch(q)))['suggestions']
+
+    def serve_stale(self, q, fetch):
+        """Stale suggestions for q, refreshed in the background, or None."""
+        key = normalize_query(q)
+        entry = self.cache.serve_stale(key, lambda: self._entry(key, fetch(q)))
+        return entry['suggestions'] if entry is not None else None
+
+    def refresh(self, q, fetch):
+        """Fetch suggestions for q again unless a fetch is already under way."""
+        key = normalize_query(q)
+        self.cache.refresh(key, lambda: self._entry(key, fetch(q)))
+
+    def ttl_left(self, q):
+        return self.cache.ttl_left(normalize_query(q))
+
+    def store(self, q, suggestions):
+        key = normalize_query(q)
+        self.cache.set(key, self._entry(key, suggestions))
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['derived'] = self.derived
+        return stats
+
+    def is_complete(self, q, suggestions):
+        """Whether suggestions hold every upstream completion of q."""
+        key = normalize_query(q)
+        return (len(suggestions) < self.upstream_limit and
+                all(normalize_query(s).startswith(key) for s in suggestions))
+
+    def _entry(self, key, suggestions):
+        return {'suggestions': suggestions, 'complete': self.is_complete(key, suggestions)}
+
+
+class LocalSuggester:
+    """Autocomplete suggestions served from our own search history.
+
+    ``mode`` decides how the local index is used: 'upstream' ignores it,
+    'local' only uses it, and 'blend' asks upstream only when fewer than
+    ``min_local`` local suggestions were found.
+    """
+
+    def __init__(self, mode='blend', k=10, min_local=4, half_life=7 * 24 * 3600,
+                 load_limit=50000, load_window=timedelta(days=90)):
+        if mode not in SUGGESTION_MODES:
+            raise ValueError(f"Unknown suggestion mode: {mode}")
+        self.mode = mode
+        self.k = k
+        self.min_local = min_local
+        self.half_life = half_life
+        self.load_limit = load_limit
+        self.load_window = load_window
+        self.index = PrefixIndex(k=k, half_life=half_life)
+
+    def record(self, query, timestamp=None):
+        if self.mode != 'upstream':
+            self.index.add(query, timestamp)
+
+    def suggest(self, q):
+        if self.mode == 'upstream':
+            return []
+        return self.index.complete(q)
+
+    def wants_upstream(self, local):
+        if self.mode == 'local':
+            return False
+        return len(local) < self.min_local
+
+    def blend(self, local, upstream):
+        return blend_suggestions(local, upstream, limit=self.k)
+
+    def is_complete(self, suggestions, upstream_complete=False):
+        """Whether suggestions, as answered for a prefix, list every completion.
+
+        Then the suggestions for a longer prefix are just these filtered,
+        and a client can work them out without asking again. Nothing was
+        cut off when fewer than k were answered; upstream ones must also
+        have been fetched and known to be complete (upstream_complete),
+        as a longer prefix with fewer local matches would fetch them.
+        """
+        if len(suggestions) >= self.k:
+            return False
+        return self.mode == 'local' or upstream_complete
+
+    def load(self):
+        """Rebuild the index from the most popular queries of the last load_window.
+
+        Counts come from the hourly rollups through analytics.top_queries,
+        so history outlives the raw search log and no raw table scan is
+        needed; call it in an app context. The new index is built off to
+        the side and swapped in, so lookups keep working while it loads.
+        """
+        if self.mode == 'upstream':
+            return
+        from analytics import db_now, top_queries
+
+        started = time.monotonic()
+        end = db_now()
+        rows = top_queries(end - self.load_window, end, limit=self.load_limit, last_seen=True)
+        index = PrefixIndex(k=self.k, half_life=self.half_life, epoch=self.index.epoch)
+        for row in rows:
+            last_seen = row['last_seen']
+            index.add(row['query'], last_seen.timestamp() if last_seen else None, row['count'])
+        self.index = index
+        logger.info(f"Loaded {len(index)} queries into the suggestion index "
+                    f"in {time.monotonic() - started:.2f}s")
+
+    def start_reloading(self, app, interval):
+        """Reload the index from the database every interval seconds."""
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    with app.app_context():
+                        self.load()
+                except Exception as e:
+                    logger.warning(f"Failed to reload suggestion index: {e}")
+
+        thread = threading.Thread(target=run, name='suggest-reload', daemon=True)
+        thread.start()
+        return thread
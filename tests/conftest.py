@@ -0,0 +1,24 @@
+import pytest
+
+from app import create_app
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """Build an app with no background threads and every store under tmp_path."""
+    def make_app(**config):
+        settings = {
+            'SEARCH_WARM_UP': "0",
+            'SEARCH_PREWARM_INTERVAL': 0.0,
+            'SEARCH_LOG_ROLLUP_INTERVAL': 0.0,
+            'SEARCH_SHARED_CACHE': '',
+            'SEARCH_LOCAL_INDEX': '',
+            'SEARCH_BREAKER_STATE': '',
+            'TESTING': True,
+        }
+        if config.pop('database', False):
+            settings['DATABASE_URL'] = f"sqlite:///{tmp_path / 'search.db'}"
+            settings['DATABASE_AUTO_MIGRATE'] = "1"
+        settings.update(config)
+        return create_app(settings)
+    return make_app
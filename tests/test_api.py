@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from results import SearchResult
+
+
+def fake_search(query, num_results=10, *args, **kwargs):
+    return {'query': query, 'total_results': 1,
+            'results': [SearchResult(query, f'https://example.com/{query}', '')]}
+
+
+@pytest.fixture
+def api_app(make_app):
+    app = make_app(database=True)
+    app.extensions['search_services'].search_engine.search = fake_search
+    return app
+
+
+def test_batch_queries_stay_out_of_search_history(api_app):
+    response = api_app.test_client().post('/api/v1/search',
+                                          json={'queries': ['python', 'rust']})
+    assert response.status_code == 200
+    assert [item['status'] for item in response.get_json()['results']] == ['ok', 'ok']
+
+    services = api_app.extensions['search_services']
+    assert services.suggester.suggest('py') == []
+    assert not services.built('query_logger') or services.query_logger.stats()['enqueued'] == 0
+
+
+@pytest.mark.parametrize('query_string', ['deadline=nan', 'deadline=inf', 'deadline=-inf'])
+def test_deadline_must_be_a_finite_number(api_app, query_string):
+    response = api_app.test_client().get(f'/api/v1/search?q=python&{query_string}')
+    assert response.status_code == 400
+
+
+def test_num_results_must_be_a_finite_number(api_app):
+    response = api_app.test_client().post(
+        '/api/v1/search', data='{"queries": ["python"], "num_results": 1e999}',
+        content_type='application/json')
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('body', [
+    'not json',
+    '["python"]',
+    '{"queries": "python"}',
+    '{"queries": ["python", 3]}',
+    '{"queries": ["  "]}',
+    '{"queries": ["python"], "num_results": "ten"}',
+])
+def test_bad_payloads_are_refused(api_app, body):
+    response = api_app.test_client().post('/api/v1/search', data=body,
+                                          content_type='application/json')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_too_many_queries_are_refused(make_app):
+    app = make_app(SEARCH_API_MAX_BATCH=3)
+    client = app.test_client()
+    assert client.get('/api/v1/search?q=a&q=b&q=c&q=d').status_code == 400
+    assert client.post('/api/v1/search', json={'queries': list('abcd')}).status_code == 400
+
+
+def test_batch_answers_each_query_in_order(api_app):
+    response = api_app.test_client().get('/api/v1/search?q=python&q=rust&num_results=5')
+    body = response.get_json()
+    assert response.status_code == 200
+    assert body['version'] == 1 and body['count'] == 2
+    assert [item['query'] for item in body['results']] == ['python', 'rust']
+    assert body['results'][0]['results'][0]['url'] == 'https://example.com/python'
+
+
+def test_batch_deadline_times_out_slow_searches(api_app):
+    release = threading.Event()
+
+    def search(query, num_results=10, *args, **kwargs):
+        if query == 'slow':
+            release.wait(5)
+        return fake_search(query, num_results)
+
+    api_app.extensions['search_services'].search_engine.search = search
+    try:
+        response = api_app.test_client().post(
+            '/api/v1/search', json={'queries': ['fast', 'slow'], 'deadline': 0.2})
+    finally:
+        release.set()
+    assert [item['status'] for item in response.get_json()['results']] == ['ok', 'timeout']
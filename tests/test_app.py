@@ -0,0 +1,38 @@
+import time
+
+import app as app_module
+
+
+def test_streamed_search_is_timed_until_the_body_is_sent(make_app, monkeypatch):
+    app = make_app(SEARCH_STREAM="1")
+    engine = app.extensions['search_services'].search_engine
+
+    def search(query, num_results=15, page=1):
+        time.sleep(0.2)
+        return {'query': query, 'total_results': 0, 'results': []}
+
+    monkeypatch.setattr(engine, 'search', search)
+    observed = []
+    monkeypatch.setattr(app_module.REQUEST_SECONDS, 'observe',
+                        lambda value, **labels: observed.append((value, labels)))
+
+    response = app.test_client().get('/search?q=python', buffered=False)
+    assert observed == []  # headers are out, the search has not run yet
+    response.get_data()
+    response.close()
+
+    [(elapsed, labels)] = observed
+    assert labels == {'endpoint': 'search', 'status': 200}
+    assert elapsed >= 0.2
+
+
+def test_metrics_report_each_series_once_however_many_apps_exist(make_app):
+    apps = [make_app() for _ in range(3)]
+    for app in apps:
+        app.extensions['search_services'].search_cache  # built, so it is reported
+
+    body = apps[-1].test_client().get('/metrics').get_data(as_text=True)
+    samples = [line.rsplit(' ', 1)[0] for line in body.splitlines()
+               if line and not line.startswith('#')]
+    assert len(samples) == len(set(samples))
+    assert any(sample.startswith('search_cache_') for sample in samples)
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from async_search_engine import AsyncGoogleSearchEngine, _Response
+from benchmarks.parser_bench import load_fixtures
+from http_client import HttpClient
+from search_engine import GoogleSearchEngine
+
+FIXTURES = {name: content.decode('utf-8') for name, _, content in load_fixtures()}
+NOSCRIPT_PAGE = '<html><noscript><a href="/?enablejs">Enable JavaScript</a></noscript></html>'
+
+# Upstream replies per scenario, and how many results each should end with
+SCENARIOS = {
+    'google answers': ({'google': (200, FIXTURES['google_normal'])}, 15),
+    'javascript wall, then DuckDuckGo': ({
+        'google': (200, NOSCRIPT_PAGE),
+        'gbv=1': (429, ''),
+        'duckduckgo': (200, FIXTURES['duckduckgo']),
+    }, 15),
+    'captcha': ({'google': (200, '<form id="captcha-form"></form>')}, 0),
+}
+
+
+def upstream(replies, fetched):
+    """Answer fetches from replies, keyed by which backend URL was asked for."""
+    def reply(url):
+        fetched.append(url)
+        if 'duckduckgo' in url:
+            return replies['duckduckgo']
+        return replies['gbv=1' if 'gbv=1' in url else 'google']
+    return reply
+
+
+@pytest.mark.parametrize('scenario', SCENARIOS)
+def test_async_engine_makes_the_sync_engines_decisions(scenario):
+    replies, count = SCENARIOS[scenario]
+    sync_fetched, async_fetched = [], []
+    engine = GoogleSearchEngine(http=HttpClient())
+    sync_reply = upstream(replies, sync_fetched)
+    engine.http.get_text = lambda url, backend=None, **kwargs: sync_reply(url)
+
+    async_engine = AsyncGoogleSearchEngine(GoogleSearchEngine(http=HttpClient()))
+    async_reply = upstream(replies, async_fetched)
+
+    async def fetch(url, backend, **kwargs):
+        return _Response(*async_reply(url))
+
+    async_engine._fetch = fetch
+    try:
+        expected = engine.search('python', 15)
+        response = asyncio.run(async_engine.search('python', 15))
+    finally:
+        async_engine.runner.stop()
+
+    assert len(expected.get('results', [])) == count
+    response.pop('timestamp', None)
+    expected.pop('timestamp', None)
+    assert response == expected
+    assert async_fetched == sync_fetched
+    for name in ('google', 'google-noscript', 'duckduckgo'):
+        health = engine.health.get(name).stats()
+        async_health = async_engine.engine.health.get(name).stats()
+        for counter in ('state', 'requests', 'failures', 'captchas'):
+            assert async_health[counter] == health[counter]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from cache import ResultCache
+
+
+def stale_cache(queued, ttl=0.05, stale_ttl=0.1):
+    """A cache whose background refreshes wait in queued until run by the test."""
+    return ResultCache(ttl=ttl, stale_ttl=stale_ttl,
+                       revalidate=lambda refresh: queued.append(refresh) or True)
+
+
+def test_stale_value_is_served_and_refreshed_once():
+    queued = []
+    cache = stale_cache(queued, stale_ttl=60)
+    cache.set('key', {'n': 1})
+    time.sleep(0.1)
+
+    assert cache.get_or_compute('key', lambda: {'n': 2}) == {'n': 1}
+    assert cache.get_or_compute('key', lambda: {'n': 3}) == {'n': 1}
+    assert len(queued) == 1
+
+    queued[0]()
+    assert cache.peek('key') == {'n': 2}
+
+
+def test_queued_refresh_does_not_hold_up_callers_after_the_stale_window():
+    queued = []
+    cache = stale_cache(queued)
+    cache.set('key', {'n': 1})
+    time.sleep(0.07)
+    assert cache.get_or_compute('key', lambda: {'n': 2}) == {'n': 1}
+    assert len(queued) == 1
+    time.sleep(0.1)
+
+    # The refresh is still queued; this caller must compute rather than wait for it
+    results = []
+    caller = threading.Thread(target=lambda: results.append(
+        cache.get_or_compute('key', lambda: {'n': 3})), daemon=True)
+    caller.start()
+    caller.join(timeout=2)
+    assert results == [{'n': 3}]
+
+    # Once its turn comes, the queued refresh finds the key filled and skips it
+    assert queued[0]() is None
+    assert cache.peek('key') == {'n': 3}
+
+
+def test_concurrent_misses_compute_once():
+    cache = ResultCache(ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(2)
+        return {'n': 1}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(
+        cache.get_or_compute('key', compute)), daemon=True)
+    leader.start()
+    assert started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(
+        cache.get_or_compute('key', compute)), daemon=True) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    while cache.stats()['coalesced'] < 4:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(timeout=2)
+
+    assert len(calls) == 1
+    assert results == [{'n': 1}] * 5
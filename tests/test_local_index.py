@@ -0,0 +1,60 @@
+from local_index import LocalIndex, tokenize
+from results import SearchResult
+
+
+def result(n, title, description=''):
+    return SearchResult(title, f'https://example.com/{n}', description)
+
+
+def test_tokenize_lowercases_and_drops_single_characters():
+    assert tokenize('Python 3 Tutorial: a_b') == ['python', 'tutorial']
+
+
+def test_search_ranks_title_matches_first_and_needs_half_the_terms():
+    index = LocalIndex()
+    index.add([result(1, 'Cooking pasta', 'a python appears in the description'),
+               result(2, 'Python tutorial', 'learn the language'),
+               result(3, 'Gardening tips', 'nothing relevant')])
+    assert [r.url for r in index.search('python')] == ['https://example.com/2',
+                                                       'https://example.com/1']
+    assert [r.url for r in index.search('python tutorial gardening zebra')] == [
+        'https://example.com/2']
+    assert index.search('zebra') == []
+
+
+def test_urls_are_indexed_once():
+    index = LocalIndex()
+    assert index.add([result(1, 'Python tutorial')]) == 1
+    assert index.add([SearchResult('Python tutorial', 'https://example.com/1/', '')]) == 0
+    assert len(index) == 1
+
+
+def test_full_index_forgets_its_oldest_documents():
+    index = LocalIndex(max_docs=20)
+    index.add([result(n, f'document number{n}') for n in range(50)])
+    assert len(index) <= 20
+    assert index.search('number0') == []
+    assert [r.url for r in index.search('number49')] == ['https://example.com/49']
+    assert len(index.search('document', limit=100)) == len(index)
+    assert index.stats()['evicted'] == 50 - len(index)
+    # Forgotten URLs can be indexed again
+    assert index.add([result(0, 'document number0')]) == 1
+
+
+def test_workers_share_the_file_across_compactions(tmp_path):
+    path = str(tmp_path / 'index.jsonl')
+    writer = LocalIndex(path=path, max_docs=20)
+    reader = LocalIndex(path=path, max_docs=20)
+    for n in range(100):
+        writer.add([result(n, f'document number{n}')])
+        if n % 7 == 0:
+            assert [r.url for r in reader.search(f'number{n}')] == [f'https://example.com/{n}']
+    assert writer.stats()['compactions'] > 0
+    with open(path) as f:
+        assert len(f.readlines()) <= 2 * 20 + 1
+    assert [r.url for r in reader.search('number99')] == ['https://example.com/99']
+    assert reader.search('number0') == []
+
+    restarted = LocalIndex(path=path, max_docs=20)
+    restarted.load()
+    assert [r.url for r in restarted.search('number99')] == ['https://example.com/99']
@@ -0,0 +1,20 @@
+import pytest
+
+from benchmarks.parser_bench import count_results, load_fixtures
+from search_engine import GoogleSearchEngine
+
+FIXTURES = load_fixtures()
+
+
+@pytest.mark.parametrize('parser', ['auto', 'html.parser', 'partial'])
+@pytest.mark.parametrize('name, kind, content', FIXTURES, ids=[name for name, _, _ in FIXTURES])
+def test_fixture_pages_yield_every_result(parser, name, kind, content):
+    engine = GoogleSearchEngine(parser=parser)
+    assert count_results(engine, kind, content) == 15
+
+
+def test_normal_layout_links_come_from_the_result_anchor():
+    name, kind, content = next(f for f in FIXTURES if f[0] == 'google_normal')
+    results = GoogleSearchEngine().google_results_from_page(content)
+    assert all(result.url.startswith('https://') for result in results)
+    assert len({result.url for result in results}) == len(results)
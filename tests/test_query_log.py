@@ -0,0 +1,32 @@
+from database import db
+from models import SearchQuery
+from query_log import QueryLogWriter
+
+
+def test_bad_row_does_not_sink_its_batch(make_app):
+    app = make_app(database=True)
+    writer = QueryLogWriter(app, db, SearchQuery)
+    rows = [{'query': f'query {n}', 'user_agent': None, 'ip_address': None} for n in range(5)]
+    rows.insert(2, {'query': None, 'user_agent': None, 'ip_address': None})
+
+    writer._write(rows)
+
+    assert writer.stats()['written'] == 5
+    assert writer.stats()['failed'] == 1
+    with app.app_context():
+        assert db.session.query(SearchQuery).count() == 5
+
+
+def test_search_log_row_fits_the_columns(make_app):
+    app = make_app(database=True)
+    logged = []
+    app.extensions['search_services'].query_logger.log = (
+        lambda query, **row: logged.append(dict(row, query=query)))
+    long_query = 'q' * 600
+    with app.test_request_context(headers={
+            'X-Forwarded-For': '2001:db8::1234:5678:9abc:def0, 10.0.0.1, 10.0.0.2'}):
+        from app import log_search_query
+        log_search_query(long_query)
+
+    assert logged[0]['query'] == 'q' * 500
+    assert logged[0]['ip_address'] == '2001:db8::1234:5678:9abc:def0'
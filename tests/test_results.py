@@ -0,0 +1,27 @@
+import json
+import pickle
+
+import pytest
+
+from results import SearchResult, json_default, json_object_hook
+
+
+def test_search_result_is_a_read_only_mapping():
+    result = SearchResult('Python', 'https://python.org/', 'The language')
+    assert dict(result) == {'title': 'Python', 'url': 'https://python.org/',
+                            'description': 'The language'}
+    assert result['url'] == result.url
+    with pytest.raises(AttributeError):
+        result.title = 'Changed'
+    with pytest.raises(AttributeError):
+        del result.url
+    assert result.title == 'Python'
+
+
+def test_search_result_round_trips_through_json_and_pickle():
+    results = [SearchResult('Python', 'https://python.org/', 'The language')]
+    loaded = json.loads(json.dumps({'results': results}, default=json_default),
+                        object_hook=json_object_hook)
+    assert loaded['results'] == results
+    assert isinstance(loaded['results'][0], SearchResult)
+    assert pickle.loads(pickle.dumps(results)) == results
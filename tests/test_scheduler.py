@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from health import MemoryBreakerStore
+from scheduler import BATCH, INTERACTIVE, OutboundBusy, OutboundScheduler, TokenBucket
+
+
+class CountingStore(MemoryBreakerStore):
+    def __init__(self):
+        super().__init__()
+        self.updates = 0
+
+    def update(self, name, change):
+        self.updates += 1
+        return super().update(name, change)
+
+
+def test_token_bucket_spends_leased_tokens_from_memory():
+    store = CountingStore()
+    bucket = TokenBucket('google', rate=100, burst=40, store=store)
+    assert bucket.lease == 10
+    assert [bucket.take() for _ in range(40)] == [0.0] * 40
+    assert store.updates == 4
+    assert bucket.take() > 0  # the burst is spent
+
+
+def test_token_bucket_drops_unspent_leases(monkeypatch):
+    bucket = TokenBucket('google', rate=100, burst=40)
+    assert bucket.take() == 0.0
+    clock = bucket._leased_at
+    monkeypatch.setattr('scheduler.time.monotonic', lambda: clock + 2)
+    bucket.take()
+    assert bucket._tokens == bucket.lease - 1  # a fresh lease, not the old one
+
+
+def test_scheduler_without_limits_never_waits():
+    scheduler = OutboundScheduler()
+    for _ in range(1000):
+        scheduler.acquire('google')
+
+
+def test_scheduler_refuses_requests_that_would_outlast_their_deadline():
+    scheduler = OutboundScheduler({'google': (1.0, 2.0)}, max_wait={0: 0.1})
+    scheduler.acquire('google')
+    scheduler.acquire('google')
+    with pytest.raises(OutboundBusy):
+        scheduler.acquire('google')
+
+
+def wait_until(condition, timeout=2.0):
+    ends = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < ends
+        time.sleep(0.005)
+
+
+def test_interactive_requests_overtake_queued_batch_requests():
+    scheduler = OutboundScheduler({'google': (5.0, 1.0)}, max_queue=2)
+    scheduler.acquire('google')  # spend the burst
+    admitted = []
+
+    def acquire(name, priority):
+        scheduler.acquire('google', priority=priority, timeout=2.0)
+        admitted.append(name)
+
+    def start(name, priority, queued):
+        thread = threading.Thread(target=acquire, args=(name, priority))
+        thread.start()
+        wait_until(lambda: scheduler.stats()['queued'].get('google') == queued)
+        return thread
+
+    threads = [start('batch 0', BATCH, 1), start('batch 1', BATCH, 2)]
+    # The queue is full of batch requests, yet an interactive one still gets in
+    with pytest.raises(OutboundBusy):
+        scheduler.acquire('google', priority=BATCH, timeout=2.0)
+    threads.append(start('interactive', INTERACTIVE, 3))
+    for thread in threads:
+        thread.join()
+
+    assert admitted == ['interactive', 'batch 0', 'batch 1']
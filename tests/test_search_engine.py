@@ -0,0 +1,132 @@
+import threading
+import time
+
+import pytest
+
+from cache import ResultCache
+from local_index import LocalIndex
+from results import SearchResult
+from search_engine import (DUCKDUCKGO_NO_RESULTS_ERROR, GOOGLE_BLOCKED_ERROR, GOOGLE_NO_MATCH_ERROR,
+                           GOOGLE_UNAVAILABLE_ERROR, NO_MORE_RESULTS_ERROR, GoogleSearchEngine)
+
+
+def duckduckgo_page(query, offset, last=60):
+    """A fake DuckDuckGo page of 30 results starting at offset."""
+    results = [SearchResult(f'{query} {n}', f'https://example.com/{n}', '')
+               for n in range(offset, offset + 30)]
+    next_page = {'q': query, 's': str(offset + 30)} if offset < last else None
+    return {'query': query, 'results': results, 'next_page': next_page}
+
+
+def test_stale_duckduckgo_pages_refresh_their_own_offset(monkeypatch):
+    refreshes = []
+    cache = ResultCache(ttl=0.05, stale_ttl=60,
+                        revalidate=lambda refresh: refreshes.append(refresh) or True)
+    engine = GoogleSearchEngine(cache=cache)
+    fetched = []
+
+    def search_duckduckgo(query, num_results=15, next_page=None, with_next=False):
+        offset = int(next_page['s']) if next_page else 0
+        fetched.append(offset)
+        return duckduckgo_page(query, offset)
+
+    monkeypatch.setattr(engine, 'search_duckduckgo', search_duckduckgo)
+    results, more = engine._duckduckgo_results('python', 90)
+    assert len(results) == 90 and not more
+    assert fetched == [0, 30, 60]
+
+    time.sleep(0.1)
+    results, _ = engine._duckduckgo_results('python', 90)
+    assert len(results) == 90  # served stale
+    assert len(refreshes) == 3
+    for refresh in refreshes:
+        refresh()
+
+    assert sorted(fetched[3:]) == [0, 30, 60]
+    for offset in (0, 30, 60):
+        page = cache.peek(engine.page_key('duckduckgo', 'python', 0, offset))
+        assert page['results'][0]['url'] == f'https://example.com/{offset}'
+
+
+@pytest.fixture
+def local_engine():
+    index = LocalIndex()
+    index.add([SearchResult('Python tutorial', 'https://docs.python.org/3/tutorial/',
+                            'The official Python tutorial')])
+    return GoogleSearchEngine(local_index=index)
+
+
+@pytest.mark.parametrize('error', [GOOGLE_NO_MATCH_ERROR, NO_MORE_RESULTS_ERROR,
+                                   DUCKDUCKGO_NO_RESULTS_ERROR])
+def test_degraded_response_passes_no_results_through(local_engine, error):
+    response = local_engine.degraded_response('python tutorial', 10, 1, {'error': error})
+    assert response == {'error': error}
+
+
+@pytest.mark.parametrize('error', [GOOGLE_BLOCKED_ERROR, GOOGLE_UNAVAILABLE_ERROR,
+                                   'DuckDuckGo search failed'])
+def test_degraded_response_serves_local_results_on_failure(local_engine, error):
+    response = local_engine.degraded_response('python tutorial', 10, 1, {'error': error})
+    assert response['degraded'] is True
+    assert response['upstream_error'] == error
+    assert [result['url'] for result in response['results']] == [
+        'https://docs.python.org/3/tutorial/']
+
+
+def fake_google(query, num_results, retry_count, *args, **kwargs):
+    return {'query': query, 'total_results': 1,
+            'results': [SearchResult(query, f'https://example.com/{query}', '')]}
+
+
+def test_search_batch_reports_searches_past_the_deadline_as_timed_out(monkeypatch):
+    engine = GoogleSearchEngine()
+    release = threading.Event()
+
+    def search(query, num_results=15):
+        if query == 'slow':
+            release.wait(5)
+        return fake_google(query, num_results, 1)
+
+    monkeypatch.setattr(engine, 'search', search)
+    try:
+        items = engine.search_batch(['fast', 'slow'], deadline=0.2)
+    finally:
+        release.set()
+
+    assert [item['status'] for item in items] == ['ok', 'timeout']
+    assert items[0]['results'][0]['url'] == 'https://example.com/fast'
+    assert 'results' not in items[1]
+
+
+def test_search_batch_runs_at_most_concurrency_searches_at_once(monkeypatch):
+    engine = GoogleSearchEngine()
+    lock = threading.Lock()
+    running = []
+    most = []
+
+    def search(query, num_results=15):
+        with lock:
+            running.append(query)
+            most.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(query)
+        return fake_google(query, num_results, 1)
+
+    monkeypatch.setattr(engine, 'search', search)
+    items = engine.search_batch([f'query {n}' for n in range(12)], concurrency=3)
+
+    assert all(item['status'] == 'ok' for item in items)
+    assert max(most) == 3
+
+
+def test_search_batch_flags_answers_from_the_cache(monkeypatch):
+    engine = GoogleSearchEngine()
+    monkeypatch.setattr(engine, '_search_google', fake_google)
+
+    first = engine.search_batch(['python', 'rust'])
+    second = engine.search_batch(['python', 'go', 'Rust '])
+
+    assert [item['cached'] for item in first] == [False, False]
+    assert [item['cached'] for item in second] == [True, False, True]
+    assert [item['status'] for item in first + second] == ['ok'] * 5
@@ -0,0 +1,60 @@
+from suggest import PrefixIndex
+
+
+def test_complete_returns_top_k_best_first():
+    index = PrefixIndex(k=3, epoch=0)
+    for query, count in [('python', 5), ('pytest', 3), ('pyramid', 1),
+                         ('pypy', 4), ('perl', 9)]:
+        index.add(query, timestamp=0, count=count)
+
+    assert index.complete('py') == ['python', 'pypy', 'pytest']
+    assert index.complete('py', limit=2) == ['python', 'pypy']
+    assert index.complete('pyr') == ['pyramid']
+    assert index.complete('ruby') == []
+
+
+def test_newer_hits_outrank_older_ones():
+    index = PrefixIndex(k=2, half_life=10, epoch=0)
+    index.add('python', timestamp=0, count=3)
+    index.add('pytest', timestamp=30, count=1)
+    index.add('pyramid', timestamp=0, count=1)
+
+    # 2 ** (30 / 10) = 8 beats three hits three half-lives earlier
+    assert index.complete('py') == ['pytest', 'python']
+
+
+def test_trailing_space_skips_the_bare_prefix():
+    index = PrefixIndex(epoch=0)
+    index.add('python', timestamp=0, count=5)
+    index.add('python flask', timestamp=0)
+
+    assert index.complete('python ') == ['python flask']
+
+
+def test_history_outlives_the_raw_search_log(make_app):
+    from datetime import timedelta
+
+    from analytics import compact_search_queries, db_now
+    from database import db
+    from models import SearchQuery
+    from suggest import LocalSuggester
+
+    app = make_app(database=True)
+    with app.app_context():
+        now = db_now()
+        for query, age, count in [('python tutorial', timedelta(days=40), 3),
+                                  ('python flask', timedelta(hours=1), 2),
+                                  ('python regex', timedelta(days=120), 5)]:
+            for _ in range(count):
+                row = SearchQuery(query)
+                row.timestamp = now - age
+                db.session.add(row)
+        db.session.commit()
+        compact_search_queries(retention=timedelta(days=30))
+        assert db.session.query(SearchQuery).count() == 2  # only the recent rows are left
+
+        suggester = LocalSuggester(mode='local')
+        suggester.load()
+
+    # 'python regex' is older than the 90-day load window
+    assert suggester.suggest('python') == ['python flask', 'python tutorial']